@@ -0,0 +1,239 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Timings, peak memory and allocations of the core operations over qubit counts, batch sizes, dtypes and threads
+
+    python benchmarks.py run --output results.json
+    python benchmarks.py run --quick --filter apply_on --output results.json
+    python benchmarks.py compare baseline.json results.json
+
+Every case runs in a forked process of its own, so the peak resident memory is the one of that case.
+compare exits with 1 when some case got slower, or allocates more, than the tolerance allows.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import platform
+import datetime
+import itertools
+import multiprocessing
+import torch
+from torch.profiler import profile, ProfilerActivity
+from pytorchqbit import (Plus, Minus, Measure, Combine, Batch, equal, convert_to_complex, H, PauliX, PauliZ,
+                         CNOT, CPauliZ, R, Unitary, Precision, apply, apply_on, Circuit, P1, Pn)
+
+
+def _state(n: int, batch: int = 1) -> torch.Tensor:
+    state = Combine(*[Plus(), Minus()] * (n // 2) + [Plus()] * (n % 2)) if n > 1 else Plus()
+    return Batch(state, size=batch) if batch > 1 else state
+
+
+def _circuit(n: int, depth: int) -> Circuit:
+    rng = random.Random(n * 1000 + depth)
+    circuit = Circuit(n)
+    for _ in range(depth):
+        for qubit in range(n):
+            circuit.add(rng.choice([H, PauliX, PauliZ, R(rng.random())]), qubit)
+        for qubit in range(rng.randrange(2), n - 1, 2):
+            circuit.add(rng.choice([CNOT, CPauliZ]), qubit, qubit + 1)
+    return circuit
+
+
+# each case takes its parameters and returns the function to time, the sweeps are (full, quick)
+def _apply(n, batch):
+    state, gate = _state(n, batch), Unitary(torch.linalg.qr(torch.randn(2**n, 2**n, dtype=Precision.dtype))[0])
+    return lambda: apply(state, gate)
+
+
+def _apply_on(n, batch, gate):
+    state, gate, targets = _state(n, batch), {'H': H, 'Z': PauliZ, 'CX': CNOT, 'CZ': CPauliZ}[gate], {
+        'H': [n // 2], 'Z': [n // 2], 'CX': [0, n - 1], 'CZ': [0, n - 1]}[gate]
+    return lambda: apply_on(state, gate, targets)
+
+
+def _combine(n):
+    qubits = [Plus(), Minus()] * (n // 2) + [Plus()] * (n % 2)
+    return lambda: Combine(*qubits)
+
+
+def _measure(n, batch):
+    state = _state(n, batch)
+    return lambda: Measure.sample(state, 1000)
+
+
+def _equal(n, batch):
+    x, y = _state(n, batch), _state(n, batch).clone()
+    return lambda: equal(x, y)
+
+
+def _convert_to_complex(n):
+    values = [[complex(row, column) for column in range(2**n)] for row in range(2**n)]
+    return lambda: convert_to_complex(values)
+
+
+def _enumerate(n, compact):
+    group = P1 if n == 1 else Pn(n)
+    return lambda: sum(1 for _ in group(compact=compact))
+
+
+def _run(n, depth, compiled):
+    circuit = _circuit(n, depth)
+    if compiled:
+        circuit = circuit.compile()
+    return lambda: circuit.run()
+
+
+CASES = {
+    'apply': (_apply, {'n': [4, 8, 10], 'batch': [1, 8]}, {'n': [4, 8], 'batch': [1]}),
+    'apply_on': (_apply_on, {'n': [10, 16, 20], 'batch': [1, 16], 'gate': ['H', 'Z', 'CX', 'CZ']},
+                 {'n': [10, 16], 'batch': [1], 'gate': ['H', 'Z', 'CX', 'CZ']}),
+    'Combine': (_combine, {'n': [10, 16, 20]}, {'n': [10, 16]}),
+    'Measure': (_measure, {'n': [10, 16, 20], 'batch': [1, 16]}, {'n': [10, 16], 'batch': [1]}),
+    'equal': (_equal, {'n': [10, 16, 20], 'batch': [1, 16]}, {'n': [10, 16], 'batch': [1]}),
+    'convert_to_complex': (_convert_to_complex, {'n': [2, 6, 10]}, {'n': [2, 6]}),
+    'Pn': (_enumerate, {'n': [1, 2, 3], 'compact': [False, True]}, {'n': [1, 2], 'compact': [False, True]}),
+    'Circuit.run': (_run, {'n': [8, 12, 16], 'depth': [20], 'compiled': [False, True]},
+                    {'n': [8, 12], 'depth': [10], 'compiled': [False, True]}),
+}
+
+DTYPES = {'complex64': torch.complex64, 'complex128': torch.complex128}
+
+
+def _time(function, budget: float, repeats: int) -> list:
+    """Wall clock times of calls until the budget or the repeats run out, after one warm up call"""
+    function()
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeats and (len(times) < 3 or time.perf_counter() - start < budget):
+        before = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - before)
+    return times
+
+
+def _allocations(function) -> tuple:
+    """Bytes allocated and the number of allocating operations in one call, from the torch profiler"""
+    # the profiler reports its start and stop on stderr, keep that out of the way
+    stderr = os.dup(2)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 2)
+        try:
+            with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as profiler:
+                function()
+        finally:
+            os.dup2(stderr, 2)
+            os.close(stderr)
+    events = [event for event in profiler.events() if event.self_cpu_memory_usage > 0]
+    return sum(event.self_cpu_memory_usage for event in events), len(events)
+
+
+def _measure_case(name: str, params: dict, dtype: str, threads: int, budget: float, repeats: int, connection):
+    try:
+        torch.set_num_threads(threads)
+        with Precision.use(DTYPES[dtype]):
+            function = CASES[name][0](**params)
+            times = _time(function, budget, repeats)
+            allocated, allocations = _allocations(function)
+        times.sort()
+        connection.send({'seconds': times[0], 'median': times[len(times) // 2], 'repeats': len(times),
+                         'allocated': allocated, 'allocations': allocations,
+                         'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024})
+    except Exception as error:
+        connection.send({'error': '%s: %s' % (type(error).__name__, error)})
+    finally:
+        connection.close()
+
+
+def key(result: dict) -> str:
+    """The name of a case with its parameters, the same case has the same key in every run"""
+    params = ','.join('%s=%s' % item for item in sorted(result['params'].items()))
+    return '%s[%s,dtype=%s,threads=%d]' % (result['name'], params, result['dtype'], result['threads'])
+
+
+def run(names: list = None, quick: bool = False, dtypes: list = None, threads: list = None,
+        budget: float = 0.5, repeats: int = 50, log=sys.stderr) -> dict:
+    """Run the cases, each parameter combination with each dtype and thread count in a process of its own"""
+    context = multiprocessing.get_context('fork')
+    dtypes = dtypes or list(DTYPES)
+    threads = threads or sorted({1, os.cpu_count() or 1})
+    results = []
+    for name in names or list(CASES):
+        sweep = CASES[name][2 if quick else 1]
+        for values in itertools.product(*sweep.values()):
+            params = dict(zip(sweep, values))
+            for dtype, count in itertools.product(dtypes, threads):
+                receiver, sender = context.Pipe(duplex=False)
+                worker = context.Process(target=_measure_case,
+                                         args=(name, params, dtype, count, budget, repeats, sender))
+                worker.start()
+                sender.close()
+                try:
+                    measured = receiver.recv()
+                except EOFError:
+                    measured = {'error': 'the process died with the exit code %s' % worker.exitcode}
+                worker.join()
+                result = dict({'name': name, 'params': params, 'dtype': dtype, 'threads': count}, **measured)
+                results.append(result)
+                if log is not None:
+                    print('%-70s %s' % (key(result), result.get('error') or '%.3g s' % result['seconds']), file=log)
+    return {'meta': {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(), 'torch': torch.__version__,
+                     'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'results': results}
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.25) -> list:
+    """The cases of both runs, with the ratios current / baseline and whether they regressed beyond the tolerance"""
+    before = {key(result): result for result in baseline['results'] if 'error' not in result}
+    rows = []
+    for result in current['results']:
+        old = before.get(key(result))
+        if old is None or 'error' in result:
+            continue
+        time_ratio = result['seconds'] / old['seconds']
+        memory_ratio = (result['allocated'] + 1) / (old['allocated'] + 1)
+        rows.append({'key': key(result), 'time': time_ratio, 'allocated': memory_ratio,
+                     'regressed': time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance})
+    return rows
+
+
+def main(arguments: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    runner = commands.add_parser('run', help='run the benchmarks')
+    runner.add_argument('--output', default='benchmarks.json', help='the JSON file of the results')
+    runner.add_argument('--filter', nargs='*', choices=list(CASES), help='the cases to run, all by default')
+    runner.add_argument('--quick', action='store_true', help='the small sizes only')
+    runner.add_argument('--dtype', nargs='*', choices=list(DTYPES), help='both by default')
+    runner.add_argument('--threads', nargs='*', type=int, help='1 and the CPU count by default')
+    runner.add_argument('--budget', type=float, default=0.5, help='seconds of repeated calls per case')
+    comparer = commands.add_parser('compare', help='flag the regressions against a baseline')
+    comparer.add_argument('baseline')
+    comparer.add_argument('current')
+    comparer.add_argument('--tolerance', type=float, default=0.25, help='the allowed relative slow down')
+    options = parser.parse_args(arguments)
+
+    if options.command == 'run':
+        results = run(options.filter, options.quick, options.dtype, options.threads, options.budget)
+        with open(options.output, 'wt') as output:
+            json.dump(results, output, indent=1)
+        return 0
+
+    with open(options.baseline) as baseline, open(options.current) as current:
+        rows = compare(json.load(baseline), json.load(current), options.tolerance)
+    for row in rows:
+        print('%-70s time x%.2f allocated x%.2f%s' % (row['key'], row['time'], row['allocated'],
+                                                       '  REGRESSION' if row['regressed'] else ''))
+    regressions = sum(row['regressed'] for row in rows)
+    print('%d of %d cases regressed' % (regressions, len(rows)))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
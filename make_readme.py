@@ -3,10 +3,14 @@
 
 
 import pytorchqbit
+import benchmarks
 
 README =  "# pypytorchqbit" + "\n"
 README += "Quantum bit and the usual gates in torch tensors straight from the Wikipedia."
+README += '\n## Precision'+ "\n" + pytorchqbit.Precision.__doc__
+README += '\n### compress'+ "\n" + pytorchqbit.compress.__doc__
 README += '\n## apply'+ "\n" + pytorchqbit.apply.__doc__
+README += '\n## apply_on'+ "\n" + pytorchqbit.apply_on.__doc__
 README += '\n## Quantum bit definitions\n'
 README += '\n### Zero'+ "\n" + pytorchqbit.Zero.__doc__
 README += '\n### One'+ "\n" + pytorchqbit.One.__doc__
@@ -14,6 +18,7 @@ README += '\n### Plus'+ "\n" + pytorchqbit.Plus.__doc__
 README += '\n### Minus'+ "\n" + pytorchqbit.Minus.__doc__
 README += '\n### Measure'+ "\n" + pytorchqbit.Measure.__doc__
 README += '\n### Combine'+ "\n" + pytorchqbit.Combine.__doc__
+README += '\n### Batch'+ "\n" + pytorchqbit.Batch.__doc__
 README += '\n### equal'+ "\n" + pytorchqbit.equal.__doc__
 README += '\n## Quantum gates\n'
 README += '\n### Identity'+ "\n" + pytorchqbit.Identity.__doc__
@@ -23,14 +28,46 @@ README += '\n### PauliY'+ "\n" + pytorchqbit.PauliY.__doc__
 README += '\n### PauliZ'+ "\n" + pytorchqbit.PauliZ.__doc__
 README += '\n### Phase'+ "\n" +  pytorchqbit.Phase.__doc__
 README += '\n### R'+ "\n" + pytorchqbit.R.__doc__
+README += '\n### RX'+ "\n" + pytorchqbit.RX.__doc__
+README += '\n### RY'+ "\n" + pytorchqbit.RY.__doc__
+README += '\n### RZ'+ "\n" + pytorchqbit.RZ.__doc__
 README += '\n### CNOT'+ "\n" + pytorchqbit.CNOT.__doc__
 README += '\n### CPauliZ'+ "\n" + pytorchqbit.CPauliZ.__doc__
 README += '\n### SWAP'+ "\n" + pytorchqbit.SWAP.__doc__
+README += '\n### MCX'+ "\n" + pytorchqbit.MCX.__doc__
+README += '\n### Diagonal'+ "\n" + pytorchqbit.Diagonal.__doc__
+README += '\n### Unitary'+ "\n" + pytorchqbit.Unitary.__doc__
+README += '\n### Register'+ "\n" + pytorchqbit.Register.__doc__
+README += '\n### MappedState'+ "\n" + pytorchqbit.MappedState.__doc__
+README += '\n### ShardedState'+ "\n" + pytorchqbit.ShardedState.__doc__
+README += '\n### launch'+ "\n" + pytorchqbit.launch.__doc__
+README += '\n### MPSState'+ "\n" + pytorchqbit.MPSState.__doc__
+README += '\n## Circuits\n'
+README += '\n### Circuit'+ "\n" + pytorchqbit.Circuit.__doc__
+README += '\n### circuits_equivalent'+ "\n" + pytorchqbit.circuits_equivalent.__doc__
+README += '\n### adjoint_expectation'+ "\n" + pytorchqbit.adjoint_expectation.__doc__
+README += '\n### Parameter'+ "\n" + pytorchqbit.Parameter.__doc__
+README += '\n### sweep'+ "\n" + pytorchqbit.sweep.__doc__
+README += '\n### parameter_shift'+ "\n" + pytorchqbit.parameter_shift.__doc__
 README += '\n## Pauli group\n'
 README += '\n### P1'+ "\n" + pytorchqbit.P1.__doc__
 README += '\n### Pn'+ "\n" + pytorchqbit.Pn.__doc__
+README += '\n### PauliString'+ "\n" + pytorchqbit.PauliString.__doc__
+README += '\n### expectation'+ "\n" + pytorchqbit.expectation.__doc__
 README += '\n## Stabilizer codes\n'
 README += '\n### S_5_1_3'+ "\n" + pytorchqbit.S_5_1_3.__doc__
+README += '\n### Tableau'+ "\n" + pytorchqbit.Tableau.__doc__
+README += '\n### FrameSampler'+ "\n" + pytorchqbit.FrameSampler.__doc__
+README += '\n## Density matrices and noise\n'
+README += '\n### density_matrix'+ "\n" + pytorchqbit.density_matrix.__doc__
+README += '\n### evolve'+ "\n" + pytorchqbit.evolve.__doc__
+README += '\n### Kraus'+ "\n" + pytorchqbit.Kraus.__doc__
+README += '\n### Depolarizing'+ "\n" + pytorchqbit.Depolarizing.__doc__
+README += '\n### AmplitudeDamping'+ "\n" + pytorchqbit.AmplitudeDamping.__doc__
+README += '\n### PhaseDamping'+ "\n" + pytorchqbit.PhaseDamping.__doc__
+README += '\n## Tracing\n'
+README += '\n### Tracer'+ "\n" + pytorchqbit.Tracer.__doc__
+README += '\n## Benchmarks\n' + benchmarks.__doc__
 
 
 with open('README.md', 'wt') as readme_file:
@@ -9,6 +9,9 @@
 
 __all__ = [
     'convert_to_complex',
+    'Precision',
+    'compress',
+    'decompress',
     'Zero',
     'One',
     'Plus',
@@ -23,16 +26,60 @@ __all__ = [
     'CNOT',
     'CPauliZ',
     'SWAP',
+    'MCX',
+    'Toffoli',
+    'Diagonal',
+    'Unitary',
     'apply',
+    'apply_on',
     'Identity',
     'Combine',
+    'Batch',
     'equal',
+    'Circuit',
     'P1',
     'Pn',
-    'S_5_1_3'
+    'PauliString',
+    'expectation',
+    'S_5_1_3',
+    'Tableau',
+    'density_matrix',
+    'evolve',
+    'Kraus',
+    'Depolarizing',
+    'AmplitudeDamping',
+    'PhaseDamping',
+    'MappedState',
+    'ShardedState',
+    'launch',
+    'Tracer',
+    'RX',
+    'RY',
+    'RZ',
+    'adjoint_expectation',
+    'Parameter',
+    'sweep',
+    'parameter_shift',
+    'MPSState',
+    'Register',
+    'circuits_equivalent',
+    'FrameSampler',
+    'unpack'
     ]
-from .convert import convert_to_complex
-from .qbit import Zero, One, Plus, Minus, Measure, Combine, equal
-from .gate import Identity, H, PauliX, PauliY, PauliZ, Phase, R, CNOT, CPauliZ, SWAP, apply
-from .pauli_group import P1, Pn
-from .stabilizer import S_5_1_3
\ No newline at end of file
+from .convert import convert_to_complex, Precision, compress, decompress
+from .qbit import Zero, One, Plus, Minus, Measure, Combine, Batch, equal
+from .gate import Identity, H, PauliX, PauliY, PauliZ, Phase, R, RX, RY, RZ, CNOT, CPauliZ, SWAP, MCX, Toffoli, Diagonal, Unitary, apply, apply_on
+from .circuit import Circuit, circuits_equivalent
+from .pauli_group import P1, Pn, PauliString
+from .expectation import expectation
+from .stabilizer import S_5_1_3
+from .tableau import Tableau
+from .density import density_matrix, evolve, Kraus, Depolarizing, AmplitudeDamping, PhaseDamping
+from .mapped import MappedState
+from .sharded import ShardedState, launch
+from .tracer import Tracer
+from .adjoint import adjoint_expectation
+from .sweep import Parameter, sweep, parameter_shift
+from .mps import MPSState
+from .register import Register
+from .frame import FrameSampler, unpack
\ No newline at end of file
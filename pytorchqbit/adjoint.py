@@ -0,0 +1,113 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Gradients of expectation values by the adjoint method, https://arxiv.org/abs/2009.02823
+"""
+
+import torch
+from .gate import PauliX, PauliY, PauliZ, Diagonal, Unitary, apply_on
+from .pauli_group import PauliString
+from .expectation import expectation, _letters
+from .circuit import _self_inverse
+
+_LETTERS = {'X': PauliX, 'Y': PauliY, 'Z': PauliZ}
+
+
+def _dagger(gate, dtype: torch.dtype, device):
+    """The inverse of a unitary gate"""
+    if _self_inverse(gate):
+        return gate
+    if getattr(gate, 'kind', None) == 'diagonal':
+        return Diagonal(gate.diagonal(dtype, device).conj(), '%s*' % gate)
+    if isinstance(gate, torch.Tensor):
+        return gate.mH
+    return Unitary(gate(dtype, device).mH, '%s*' % gate)
+
+
+def _apply_pauli(state: torch.Tensor, string: PauliString) -> torch.Tensor:
+    """P state for a Hermitian Pauli string, one letter at a time"""
+    for qubit, letter in _letters(string).items():
+        state = apply_on(state, _LETTERS[letter], qubit)
+    sign = (string.phase - (string.x & string.z).bit_count()) % 4
+    return -state if sign == 2 else state
+
+
+class _Adjoint(torch.autograd.Function):
+    """The expectation values of a circuit, differentiated by one backward sweep over the gates"""
+
+    @staticmethod
+    def forward(ctx, circuit, strings, state, *parameters):
+        with torch.no_grad():
+            final = circuit.run(state)
+        ctx.circuit, ctx.strings, ctx.final = circuit, strings, final
+        ctx.parameters = parameters
+        return expectation(final, strings)
+
+    @staticmethod
+    def backward(ctx, grad):
+        circuit, strings, psi = ctx.circuit, ctx.strings, ctx.final
+        indices = {id(parameter): index for index, parameter in enumerate(ctx.parameters)}
+        grads = [None] * len(ctx.parameters)
+        with torch.no_grad():
+            # lambda = sum_k grad_k P_k psi, so that <lambda|dU psi> sums the derivatives of all the strings
+            lam = sum(grad[..., index, None, None] * _apply_pauli(psi, string) for index, string in enumerate(strings))
+            for gate, targets in reversed(circuit.operations):
+                inverse = _dagger(gate, psi.dtype, psi.device)
+                psi = apply_on(psi, inverse, targets)
+                index = indices.get(id(getattr(gate, 'parameter', None)))
+                if index is not None:
+                    mu = apply_on(psi, gate.derivative(psi.dtype, psi.device), targets)
+                    value = 2 * (lam.conj() * mu).real.sum(dim=(-2, -1))
+                    value = value.sum_to_size(ctx.parameters[index].shape)
+                    grads[index] = value if grads[index] is None else grads[index] + value
+                lam = apply_on(lam, inverse, targets)
+        return (None, None, None, *grads)
+
+
+def adjoint_expectation(circuit, paulis, state: torch.Tensor = None) -> torch.Tensor:
+    """Expectation values of Pauli strings after a circuit, differentiable by the angles of its gates
+
+The result is the same as the one of expectation(circuit.run(state), paulis), but autograd does not keep the
+intermediate states. The backward pass runs the circuit in reverse and gets the gradients of all the angles
+in one sweep with three state vectors, whatever the depth of the circuit:
+
+    >>> import torch
+    >>> angles = torch.tensor([0.3, 1.1, -0.7, 2.0], requires_grad=True)
+    >>> circuit = Circuit(3).add(H, 0).add(RY(angles[0]), 1).add(CNOT, 0, 1).add(RX(angles[1]), 2)
+    >>> circuit = circuit.add(CNOT, 1, 2).add(RZ(angles[2]), 2).add(R(angles[3]), 0).add(H, 0)
+    >>> value = adjoint_expectation(circuit, 'XZZ')
+    >>> value.backward()
+    >>> adjoint = angles.grad.clone()
+
+Autograd through the state vectors agrees:
+
+    >>> angles.grad = None
+    >>> expected = expectation(circuit.run(), 'XZZ')
+    >>> expected.backward()
+    >>> torch.allclose(value, expected), torch.allclose(adjoint, angles.grad, atol=1e-5)
+    (True, True)
+
+Several strings give several values, and an angle used by many gates gets the sum of their derivatives:
+
+    >>> theta = torch.tensor(0.4, requires_grad=True)
+    >>> def layer(theta):
+    ...     return Circuit(2).add(RY(theta), 0).add(RY(theta), 1).add(CPauliZ, 0, 1).add(RX(2 * theta), 0)
+    >>> values = adjoint_expectation(layer(theta), ['ZI', 'IZ', 'XX'])
+    >>> values.shape
+    torch.Size([3])
+    >>> gradient, = torch.autograd.grad(values.sum(), theta)
+    >>> reference, = torch.autograd.grad(expectation(layer(theta).run(), ['ZI', 'IZ', 'XX']).sum(), theta)
+    >>> torch.allclose(gradient, reference, atol=1e-5)
+    True
+
+    """
+    if any(getattr(gate, 'kind', None) == 'channel' for gate, _ in circuit.operations):
+        raise ValueError('the adjoint method needs unitary gates, the noise channels need evolve')
+    single = isinstance(paulis, (str, PauliString))
+    strings = [PauliString.from_label(pauli) if isinstance(pauli, str) else pauli
+               for pauli in ([paulis] if single else paulis)]
+    values = _Adjoint.apply(circuit, strings, state, *circuit.parameters())
+    if single:
+        return values[..., 0]
+    return values
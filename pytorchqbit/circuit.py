@@ -0,0 +1,432 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Circuits as recorded lists of gates and a compiler that fuses them
+"""
+
+import typing
+import torch
+from .convert import Precision, _reading_constants
+from .tracer import Tracer
+from .qbit import Zero, Combine
+from .gate import (Identity, H, PauliX, PauliY, PauliZ, Phase, CNOT, CPauliZ, SWAP, MCX, Unitary, apply_on,
+                   _apply_diagonal, _phase_mask, _flops)
+from .density import density_matrix, evolve
+
+
+# gates which are their own inverse, two of these in a row on the same targets cancel out
+_SELF_INVERSE = (H, PauliX, PauliY, PauliZ, CNOT, CPauliZ, SWAP)
+
+
+def _self_inverse(gate) -> bool:
+    return gate in _SELF_INVERSE or isinstance(gate, MCX)
+
+
+class _Fused:
+    """A gate of the compiled circuit with the names of the gates fused into it"""
+    def __init__(self, gate, targets: tuple):
+        self.gate = gate
+        self.targets = targets
+        # wider gates and noise channels are never fused, so their matrices are not needed. The fused
+        # matrices are kept in complex128 and cast to the precision of the state when the circuit runs
+        self.matrix = (gate(torch.complex128) if len(targets) <= 2 and getattr(gate, 'kind', None) != 'channel'
+                       else None)
+        self.names = [repr(gate)]
+
+    def fuse(self, matrix: torch.Tensor, names: list, after: bool = True):
+        if after:
+            self.matrix = torch.matmul(matrix, self.matrix)
+            self.names = self.names + names
+        else:
+            self.matrix = torch.matmul(self.matrix, matrix)
+            self.names = names + self.names
+        self.gate = None
+
+    def is_identity(self) -> bool:
+        identity = torch.eye(self.matrix.shape[-1], dtype=self.matrix.dtype, device=self.matrix.device)
+        return torch.allclose(self.matrix, identity, atol=Precision.tolerance(self.matrix.dtype))
+
+    def result(self) -> tuple:
+        if self.gate is not None:
+            return self.gate, self.targets
+        return Unitary(self.matrix, '[%s]' % ' '.join(self.names)), self.targets
+
+
+def _embed(matrix: torch.Tensor, position: int) -> torch.Tensor:
+    """Lift a single qubit gate to act on the given qubit of a two qubit gate"""
+    identity = torch.eye(2, dtype=matrix.dtype, device=matrix.device)
+    if position == 0:
+        return torch.kron(matrix, identity)
+    return torch.kron(identity, matrix)
+
+
+def _reorder(matrix: torch.Tensor, targets: tuple, order: tuple) -> torch.Tensor:
+    """Express a gate on targets as a gate on the same qubits in the given order"""
+    if targets == order:
+        return matrix
+    swap = SWAP(matrix.dtype, matrix.device)
+    return torch.matmul(swap, torch.matmul(matrix, swap))
+
+
+class _FusedDiagonal:
+    """A run of diagonal gates as one diagonal gate, its phases multiplied out in the precision of the state"""
+    kind = 'diagonal'
+    def __init__(self, run: list, wires: list):
+        self._run = list(run)
+        self._wires = wires
+    def __repr__(self):
+        return '[%s]' % ' '.join(repr(gate) for gate, _ in self._run)
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return torch.diag_embed(self.diagonal(dtype, device))
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        mask = 1
+        for gate, targets in self._run:
+            mask = mask * _phase_mask(gate.diagonal(dtype, device), list(targets), self._wires)
+        return mask.reshape(*mask.shape[:mask.dim() - len(self._wires)], -1)
+
+
+def _fuse_diagonals(operations: list) -> list:
+    """Replace every run of consecutive diagonal gates by one diagonal gate over the union of their targets"""
+    fused = []
+    run = []
+
+    def flush():
+        if len(run) == 1:
+            fused.append(run[0])
+        elif run:
+            wires = sorted({wire for _, targets in run for wire in targets})
+            fused.append((_FusedDiagonal(run, wires), tuple(wires)))
+        run.clear()
+
+    for gate, targets in operations:
+        if getattr(gate, 'kind', None) == 'diagonal':
+            # the gates of a run commute, so a self inverse gate cancels its earlier copy anywhere in the run
+            if _self_inverse(gate) and (gate, targets) in run:
+                run.remove((gate, targets))
+            else:
+                run.append((gate, targets))
+        else:
+            flush()
+            fused.append((gate, targets))
+    flush()
+    return fused
+
+
+class Circuit:
+    """Circuit records gates and the qubits they act on, and runs them on a register when asked
+
+    >>> from math import pi
+    >>> circuit = Circuit(2).add(H, 0).add(H, 0).add(PauliX, 1).add(R(pi/4), 1).add(PauliZ, 1)
+    >>> circuit = circuit.add(CNOT, 0, 1).add(H, 1)
+    >>> circuit
+    Circuit(2, [(H, (0,)), (H, (0,)), (X, (1,)), (R(0.7853981633974483), (1,)), (Z, (1,)), (CX, (0, 1)), (H, (1,))])
+    >>> len(circuit)
+    7
+
+Without a state the circuit starts from the all zero register:
+
+    >>> Measure.one(Circuit(3).add(PauliX, 0).add(CNOT, 0, 2).run())
+    5
+    >>> Measure.one(Circuit(2).add(PauliX, 1).run(Combine(One(), Zero())))
+    3
+
+The compiler cancels inverse pairs, merges runs of single qubit gates on the same wire and absorbs single
+qubit gates into the neighbouring two qubit gates:
+
+    >>> compiled = circuit.compile()
+    >>> compiled
+    Circuit(2, [([X [R(0.7853981633974483) Z] CX H], (0, 1))])
+    >>> equal(compiled.run(), circuit.run(), atol=1e-6)
+    True
+
+Long chains of rotations collapse into a single gate per wire:
+
+    >>> chain = Circuit(3)
+    >>> for layer in range(100):
+    ...     chain = chain.add(R(0.01 * layer), layer % 3).add(H, (layer + 1) % 3)
+    >>> len(chain), len(chain.compile())
+    (200, 3)
+    >>> equal(chain.compile().run(Combine(Plus(), One(), Minus())), chain.run(Combine(Plus(), One(), Minus())), atol=1e-5)
+    True
+
+Two qubit gates on the same pair are merged too, whichever way the pair is ordered:
+
+    >>> Circuit(2).add(CNOT, 0, 1).add(CNOT, 0, 1).compile()
+    Circuit(2, [])
+    >>> Circuit(2).add(SWAP, 0, 1).add(SWAP, 1, 0).compile()
+    Circuit(2, [])
+    >>> Circuit(2).add(CNOT, 0, 1).add(CNOT, 1, 0).compile()
+    Circuit(2, [([CX CX], (0, 1))])
+    >>> Circuit(3).add(Toffoli, 0, 1, 2).add(MCX(2), 0, 1, 2).compile()
+    Circuit(3, [])
+
+Self inverse diagonal gates cancel before the diagonal runs are fused, even with other phases between them:
+
+    >>> Circuit(1).add(PauliZ, 0).add(PauliZ, 0).compile()
+    Circuit(1, [])
+    >>> Circuit(2).add(CPauliZ, 0, 1).add(CPauliZ, 0, 1).compile()
+    Circuit(2, [])
+    >>> Circuit(2).add(CPauliZ, 0, 1).add(Phase, 1).add(CPauliZ, 0, 1).compile()
+    Circuit(2, [(P, (1,))])
+
+Consecutive diagonal gates commute, so any run of them is fused into one phase mask over all the qubits
+they touch, and the mask is applied as a single elementwise product:
+
+    >>> from math import pi
+    >>> layer = Circuit(3).add(H, 0).add(H, 1).add(H, 2)
+    >>> layer = layer.add(CPauliZ, 0, 1).add(R(pi/3), 1).add(CPauliZ, 1, 2).add(PauliZ, 0).add(Phase, 2).add(H, 1)
+    >>> compiled = layer.compile()
+    >>> compiled
+    Circuit(3, [(H, (0,)), (H, (1,)), (H, (2,)), ([CZ R(1.0471975511965976) CZ Z P], (0, 1, 2)), (H, (1,))])
+    >>> compiled.operations[3][0].kind
+    'diagonal'
+    >>> equal(compiled.run(), layer.run(), atol=1e-6)
+    True
+
+The phases are taken in the precision of the state, so a complex128 state does not drift through the
+complex64 default, neither gate by gate nor fused:
+
+    >>> import torch
+    >>> rotations = Circuit(2)
+    >>> for step in range(50):
+    ...     _ = rotations.add(R(0.1 * step), step % 2).add(RZ(0.3 + 0.1 * step), (step + 1) % 2)
+    >>> start = Combine(Plus(), Minus()).to(torch.complex128)
+    >>> expected = start
+    >>> for gate, targets in rotations:
+    ...     expected = apply_on(expected, gate, targets)
+    >>> result = rotations.run(start)
+    >>> result.dtype, torch.allclose(result, expected, rtol=0, atol=1e-12)
+    (torch.complex128, True)
+    >>> torch.allclose(rotations.compile().run(start), expected, rtol=0, atol=1e-12)
+    True
+
+The fused matrices of the other gates are kept in complex128 and cast to the precision of the state:
+
+    >>> mixed = Circuit(3)
+    >>> for layer in range(200):
+    ...     _ = mixed.add(H, layer % 3).add(R(0.1 * layer), (layer + 1) % 3).add(CNOT, layer % 3, (layer + 2) % 3)
+    >>> start = Combine(Plus(), One(), Minus()).to(torch.complex128)
+    >>> len(mixed.compile()) < len(mixed), torch.allclose(mixed.compile().run(start), mixed.run(start), rtol=0, atol=1e-12)
+    (True, True)
+
+Noise channels make the circuit run on density matrices, and the compiler leaves them in place:
+
+    >>> import torch
+    >>> noisy = Circuit(2).add(H, 0).add(Depolarizing(0.1), 0).add(H, 0).add(CNOT, 0, 1).add(AmplitudeDamping(0.2), 1)
+    >>> noisy.compile()
+    Circuit(2, [(H, (0,)), (Depolarizing(0.1), (0,)), ([H CX], (0, 1)), (AmplitudeDamping(0.2), (1,))])
+    >>> torch.allclose(noisy.compile().evolve(), noisy.evolve(), atol=1e-6)
+    True
+    >>> torch.diagonal(noisy.evolve()).real
+    tensor([0.9500, 0.0000, 0.0100, 0.0400])
+
+    """
+
+    def __init__(self, n: int, operations: typing.Iterable[tuple] = ()):
+        self.n = n
+        self.operations = list(operations)
+
+    def __repr__(self):
+        return 'Circuit(%d, %s)' % (self.n, self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __iter__(self) -> typing.Iterator[tuple]:
+        return iter(self.operations)
+
+    def add(self, gate, *targets: int) -> 'Circuit':
+        """Append gate acting on the targets, returns the circuit for chaining"""
+        if isinstance(gate, torch.Tensor):
+            gate = Unitary(gate)
+        self.operations.append((gate, targets))
+        return self
+
+    def parameters(self) -> typing.List[torch.Tensor]:
+        """The angle tensors of the gates which require gradients, each once, in the order of the gates"""
+        parameters = {}
+        for gate, _ in self.operations:
+            parameter = getattr(gate, 'parameter', None)
+            if isinstance(parameter, torch.Tensor) and parameter.requires_grad:
+                parameters.setdefault(id(parameter), parameter)
+        return list(parameters.values())
+
+    @_reading_constants
+    def run(self, state: torch.Tensor = None) -> torch.Tensor:
+        """Apply the gates in order to the state"""
+        if state is not None and not isinstance(state, torch.Tensor):
+            # states kept outside of the memory run the circuits themselves
+            return state.run(self)
+        if state is None:
+            state = Zero() if self.n == 1 else Combine(*[Zero()] * self.n)
+        owned = False
+        for gate, targets in self.operations:
+            if getattr(gate, 'kind', None) == 'channel':
+                raise ValueError('%s is a noise channel, it needs a density matrix from evolve' % gate)
+            phases = (gate.diagonal(state.dtype, state.device)
+                      if owned and getattr(gate, 'kind', None) == 'diagonal' else None)
+            if phases is not None and self._inplace(state, phases):
+                # the state is our own intermediate result, so it can be multiplied in place
+                if Tracer.active:
+                    Tracer.call('apply_on', repr(gate),
+                                lambda state: _apply_diagonal(state, phases, list(targets), inplace=True),
+                                (state,), flops=lambda state: _flops(state, gate))
+                else:
+                    _apply_diagonal(state, phases, list(targets), inplace=True)
+            else:
+                state = apply_on(state, gate, targets)
+                owned = True
+        return state
+
+    def unitary(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        """The 2^n x 2^n matrix of the circuit, the columns of the identity pushed through it as one state"""
+        dtype, device = Precision.resolve(dtype, device)
+        return self.run(torch.eye(2**self.n, dtype=dtype, device=device))
+
+    def evolve(self, rho: torch.Tensor = None) -> torch.Tensor:
+        """Apply the gates and the noise channels in order to a density matrix"""
+        if rho is None:
+            rho = density_matrix(Zero() if self.n == 1 else Combine(*[Zero()] * self.n))
+        for operation, targets in self.operations:
+            rho = evolve(rho, operation, targets)
+        return rho
+
+    @staticmethod
+    def _inplace(state: torch.Tensor, phases: torch.Tensor) -> bool:
+        batch = state.shape[:-2]
+        return (state.is_contiguous() and not state.requires_grad and not phases.requires_grad
+                and torch.broadcast_shapes(batch, phases.shape[:-1]) == batch)
+
+    def compile(self) -> 'Circuit':
+        """Fuse the gates of this circuit into as few one and two qubit gates as possible"""
+        operations = []
+        wires = [[] for _ in range(self.n)]
+        fused_diagonals = _fuse_diagonals(self.operations)
+
+        def last(wire):
+            return wires[wire][-1] if wires[wire] else None
+
+        def append(operation):
+            operations.append(operation)
+            for wire in operation.targets:
+                wires[wire].append(len(operations) - 1)
+
+        def remove(index):
+            for wire in operations[index].targets:
+                wires[wire].pop()
+            operations[index] = None
+
+        for gate, targets in fused_diagonals:
+            operation = _Fused(gate, targets)
+            previous = {last(wire) for wire in targets}
+            index = previous.pop() if len(previous) == 1 else None
+
+            if index is not None and set(operations[index].targets) == set(targets):
+                fused = operations[index]
+                if fused.gate == gate and fused.targets == targets and _self_inverse(gate):
+                    remove(index)
+                    continue
+                if fused.matrix is not None and operation.matrix is not None:
+                    fused.fuse(_reorder(operation.matrix, targets, fused.targets), operation.names)
+                    if fused.is_identity():
+                        remove(index)
+                    continue
+
+            if (len(targets) == 1 and operation.matrix is not None and index is not None
+                    and len(operations[index].targets) == 2 and operations[index].matrix is not None):
+                fused = operations[index]
+                fused.fuse(_embed(operation.matrix, fused.targets.index(targets[0])), operation.names)
+                continue
+
+            if len(targets) == 2 and operation.matrix is not None:
+                for position, wire in enumerate(targets):
+                    index = last(wire)
+                    if index is not None and operations[index].targets == (wire,) and operations[index].matrix is not None:
+                        single = operations[index]
+                        operation.fuse(_embed(single.matrix, position), single.names, after=False)
+                        remove(index)
+            append(operation)
+
+        return Circuit(self.n, [operation.result() for operation in operations if operation is not None])
+
+
+def _stabilizer_states(n: int, count: int, generator: torch.Generator = None, dtype: torch.dtype = None,
+                       device=None) -> torch.Tensor:
+    """A batch of random stabilizer states, from layers of random H, Phase and CNOT gates on |0...0>"""
+    dtype, device = Precision.resolve(dtype, device)
+    singles = torch.stack([Identity(1, dtype, device), H(dtype, device), Phase(dtype, device),
+                           torch.matmul(H(dtype, device), Phase(dtype, device))])
+    pairs = torch.stack([Identity(2, dtype, device), CNOT(dtype, device)])
+    state = torch.zeros(count, 2**n, 1, dtype=dtype, device=device)
+    state[:, 0] = 1
+    for layer in range(n):
+        for qubit in range(n):
+            state = apply_on(state, singles[torch.randint(4, (count,), generator=generator)], qubit)
+        for qubit in range(layer % 2, n - 1, 2):
+            state = apply_on(state, pairs[torch.randint(2, (count,), generator=generator)], [qubit, qubit + 1])
+    return state
+
+
+def circuits_equivalent(a: Circuit, b: Circuit, up_to_global_phase: bool = True, states: int = 2,
+                        exact: bool = False, atol: float = None, generator: torch.Generator = None) -> bool:
+    """Whether two circuits act the same, compared on random states and random stabilizer states
+
+Both circuits run once on a batch of a few random states and a few random stabilizer states. Different
+unitaries give different results on a random state with the probability one, and the stabilizer states catch
+the differences of Clifford circuits exactly. Up to a global phase the overlaps must all share one phase:
+
+    >>> from math import pi
+    >>> circuits_equivalent(Circuit(2).add(CNOT, 0, 1).add(CNOT, 1, 0).add(CNOT, 0, 1), Circuit(2).add(SWAP, 0, 1))
+    True
+    >>> circuits_equivalent(Circuit(1).add(H, 0).add(PauliZ, 0).add(H, 0), Circuit(1).add(PauliX, 0))
+    True
+    >>> circuits_equivalent(Circuit(1).add(RZ(pi / 3), 0), Circuit(1).add(R(pi / 3), 0))
+    True
+    >>> circuits_equivalent(Circuit(1).add(RZ(pi / 3), 0), Circuit(1).add(R(pi / 3), 0), up_to_global_phase=False)
+    False
+    >>> circuits_equivalent(Circuit(2).add(CNOT, 0, 1), Circuit(2).add(CNOT, 1, 0))
+    False
+
+A phase on a part of the state only is a real difference:
+
+    >>> circuits_equivalent(Circuit(2).add(H, 0).add(CPauliZ, 0, 1), Circuit(2).add(H, 0))
+    False
+
+A gate changing only two of the 2^16 amplitudes is a difference too:
+
+    >>> circuits_equivalent(Circuit(16).add(MCX(15), *range(16)), Circuit(16))
+    False
+
+Compiled circuits can be checked against their sources, with the full unitaries on request. The unitary
+pushes the columns of the identity through the circuit as one state of 2^n columns:
+
+    >>> circuit = Circuit(3).add(H, 0).add(CNOT, 0, 2).add(RY(0.3), 1).add(CPauliZ, 1, 2).add(Toffoli, 0, 1, 2)
+    >>> circuit = circuit.add(H, 1).add(R(0.2), 2).add(SWAP, 0, 1)
+    >>> circuits_equivalent(circuit, circuit.compile()), circuits_equivalent(circuit, circuit.compile(), exact=True)
+    (True, True)
+    >>> circuit.unitary().shape
+    torch.Size([8, 8])
+
+    """
+    if a.n != b.n:
+        raise ValueError('circuits of %d and %d qubits' % (a.n, b.n))
+    dtype, device = Precision.resolve()
+    atol = 10 * Precision.tolerance(dtype) if atol is None else atol
+
+    def same(x: torch.Tensor, y: torch.Tensor) -> bool:
+        # one output state per row, the global phase aligned by the first one
+        x = x.movedim(-2, -1).reshape(-1, x.shape[-2])
+        y = y.movedim(-2, -1).reshape(-1, y.shape[-2])
+        overlap = torch.vdot(x[0], y[0])
+        phase = overlap / overlap.abs() if up_to_global_phase and overlap.abs() > 0 else 1
+        # the states themselves are compared, a few differing amplitudes out of 2^n would hardly move an overlap
+        return bool(torch.all(torch.linalg.vector_norm(y - phase * x, dim=-1) <= atol))
+
+    if exact:
+        return same(a.unitary(dtype, device), b.unitary(dtype, device))
+
+    random = torch.randn(states, 2**a.n, 1, dtype=dtype, device=device, generator=generator)
+    random = random / torch.linalg.vector_norm(random, dim=-2, keepdim=True)
+    fingerprints = torch.cat([random, _stabilizer_states(a.n, states, generator, dtype, device)])
+    return same(a.run(fingerprints), b.run(fingerprints))
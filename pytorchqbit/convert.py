@@ -4,20 +4,261 @@
 Representation of single qubit basic states
 """
 
+import functools
 import random
+from collections import OrderedDict
+from contextlib import contextmanager
 import torch
 import numpy as np
+from .tracer import Tracer
 
 
-def convert_to_complex(lits_form:list) -> torch.Tensor:
+# the largest norm of a difference still counted as equal, by the precision of the states
+_TOLERANCES = {torch.complex128: 1e-10, torch.complex64: 1e-5}
+
+
+class _Precision:
+    """Precision is the default dtype and device of every state, gate and Pauli group element
+
+complex64 is the fast default, complex128 keeps long circuits from drifting:
+
+    >>> import torch
+    >>> Precision
+    Precision(torch.complex64, cpu)
+    >>> H().dtype
+    torch.complex64
+    >>> with Precision.use(torch.complex128):
+    ...     H().dtype, Combine(Plus(), One()).dtype, Pn(2)[37].dtype, S_5_1_3.g1().dtype
+    (torch.complex128, torch.complex128, torch.complex128, torch.complex128)
+    >>> H().dtype
+    torch.complex64
+
+Precision.set changes the defaults for good, and every state and gate can also be asked for a dtype and device
+per call. apply and apply_on fetch the gate matrices in the precision and on the device of the state:
+
+    >>> H(dtype=torch.complex128).dtype
+    torch.complex128
+    >>> apply_on(Combine(Zero(dtype=torch.complex128), One(dtype=torch.complex128)), H, 0).dtype
+    torch.complex128
+
+The tolerances of the comparisons follow the precision:
+
+    >>> Precision.tolerance(torch.complex64), Precision.tolerance(torch.complex128)
+    (1e-05, 1e-10)
+
+    """
+    def __init__(self):
+        self.dtype = torch.complex64
+        self.device = torch.device('cpu')
+
+    def __repr__(self):
+        return 'Precision(%s, %s)' % (self.dtype, self.device)
+
+    def set(self, dtype: torch.dtype = None, device=None) -> '_Precision':
+        """Change the default dtype, the device or both"""
+        if dtype is not None:
+            if not dtype.is_complex:
+                raise ValueError('%s is not a complex dtype' % dtype)
+            self.dtype = dtype
+        if device is not None:
+            self.device = torch.device(device)
+        return self
+
+    @contextmanager
+    def use(self, dtype: torch.dtype = None, device=None):
+        """Change the defaults for the duration of a with block"""
+        previous = self.dtype, self.device
+        self.set(dtype, device)
+        try:
+            yield self
+        finally:
+            self.dtype, self.device = previous
+
+    def resolve(self, dtype: torch.dtype = None, device=None) -> tuple:
+        """The given dtype and device, or the defaults for the ones left out"""
+        return (self.dtype if dtype is None else dtype,
+                self.device if device is None else torch.device(device))
+
+    def real(self, dtype: torch.dtype = None) -> torch.dtype:
+        """The real dtype of the parts of a complex dtype"""
+        return torch.empty((), dtype=self.resolve(dtype)[0]).real.dtype
+
+    def tolerance(self, dtype: torch.dtype = None) -> float:
+        """The absolute tolerance of the comparisons of states of dtype"""
+        return _TOLERANCES.get(self.resolve(dtype)[0], 1e-2)
+
+Precision = _Precision()
+
+
+def convert_to_complex(lits_form:list, dtype: torch.dtype = None, device=None) -> torch.Tensor:
     """
     >>> convert_to_complex([[1, 0], [0, 0+1j]])
     tensor([[1.+0.j, 0.+0.j],
-            [0.+0.j, 0.+1.j])
+            [0.+0.j, 0.+1.j]])
+    >>> convert_to_complex([[1j]], dtype=torch.complex128)
+    tensor([[0.+1.j]], dtype=torch.complex128)
+
+    """
+    dtype, device = Precision.resolve(dtype, device)
+    return torch.tensor(np.array(lits_form, dtype=complex), dtype=dtype, device=device)
+
+
+def compress(state: torch.Tensor, dtype: torch.dtype = torch.float16) -> torch.Tensor:
+    """Store the real and imaginary parts of a state in a half precision tensor with a trailing axis of two
+
+Half the memory of complex64 for keeping states around, to be decompressed for the computations:
+
+    >>> packed = compress(Combine(Plus(), Minus()))
+    >>> packed.dtype, packed.shape
+    (torch.float16, torch.Size([4, 1, 2]))
+    >>> equal(decompress(packed), Combine(Plus(), Minus()), atol=1e-3)
+    True
+    >>> compress(Plus(), torch.bfloat16).element_size()
+    2
+
     """
-    arr = np.array(lits_form)
-    real_part = np.real(arr)
-    imaginary_part = np.imag(arr)
-    real_tensor = torch.tensor(real_part, dtype=torch.float32)
-    imaginary_tensor = torch.tensor(imaginary_part, dtype=torch.float32)
-    return torch.complex(real_tensor, imaginary_tensor)
\ No newline at end of file
+    return torch.view_as_real(state).to(dtype)
+
+
+def decompress(packed: torch.Tensor, dtype: torch.dtype = None) -> torch.Tensor:
+    """The complex state of a compressed one, in the given or the default precision"""
+    return torch.view_as_complex(packed.to(Precision.real(dtype)).contiguous())
+
+# the operator methods changing their tensor in place, the other in place methods end with an underscore
+_INPLACE = {'__setitem__', '__iadd__', '__isub__', '__imul__', '__itruediv__', '__ifloordiv__', '__imod__',
+            '__ipow__', '__imatmul__', '__iand__', '__ior__', '__ixor__', '__ilshift__', '__irshift__'}
+
+
+class _ReadOnly(torch.Tensor):
+    """A tensor refusing the in place operations on itself and on its views, the results of the other
+operations are plain tensors
+
+    >>> from pytorchqbit.convert import _ReadOnly
+    >>> constant = torch.eye(2).as_subclass(_ReadOnly)
+    >>> constant.T[0] = 5
+    Traceback (most recent call last):
+    ...
+    RuntimeError: the shared constant tensors are read only, clone them before changing them in place
+    >>> type(constant * 2), type(constant.clone())
+    (<class 'torch.Tensor'>, <class 'torch.Tensor'>)
+
+    """
+
+    @classmethod
+    def __torch_function__(cls, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        name = getattr(func, '__name__', '')
+        if ((args and isinstance(args[0], _ReadOnly) and (name in _INPLACE or
+                                                          (name.endswith('_') and not name.endswith('__'))))
+                or isinstance(kwargs.get('out'), _ReadOnly)):
+            raise RuntimeError('the shared constant tensors are read only, clone them before changing them in place')
+        with torch._C.DisableTorchFunctionSubclass():
+            result = func(*args, **kwargs)
+        # a view shares the memory of the constant, so it stays read only
+        if (isinstance(result, torch.Tensor) and result._is_view()
+                and any(isinstance(arg, _ReadOnly) for arg in args)):
+            return result.as_subclass(_ReadOnly)
+        return result
+
+    def __repr__(self, *, tensor_contents=None):
+        return repr(self.as_subclass(torch.Tensor))
+
+
+def _reading_constants(function):
+    """Run a hot path which only reads the constants without the read only checks, on plain tensors"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with torch._C.DisableTorchFunctionSubclass():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+class _ConstantCache:
+    """Builds constant tensors once per (key, dtype, device) and hands out the same tensor afterwards
+
+A cache hit returns the very same tensor object, so nothing is allocated:
+
+    >>> from pytorchqbit.convert import _ConstantCache
+    >>> cache = _ConstantCache()
+    >>> x = cache('X', lambda: convert_to_complex([[0, 1], [1, 0]]))
+    >>> x is cache('X', lambda: convert_to_complex([[0, 1], [1, 0]]))
+    True
+    >>> cache
+    ConstantCache(hits=1, misses=1, size=1)
+
+Every caller shares the tensor, so it is read only. Changing it in place, directly or through a view, raises
+instead of leaking into the tensors handed out before, and the out of place operations give plain tensors:
+
+    >>> a, b = H(), H()
+    >>> a.zero_()
+    Traceback (most recent call last):
+    ...
+    RuntimeError: the shared constant tensors are read only, clone them before changing them in place
+    >>> bool(b.abs().sum() > 0)
+    True
+    >>> c = H().clone()
+    >>> _ = c.zero_()
+    >>> equal(H(), c)
+    False
+
+With maxsize the least recently used tensors are dropped:
+
+    >>> angles = _ConstantCache(maxsize=2)
+    >>> for angle in [0.1, 0.2, 0.1, 0.3]:
+    ...     _ = angles(angle, lambda: convert_to_complex([[angle]]))
+    >>> angles
+    ConstantCache(hits=1, misses=3, size=2)
+
+    """
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tensors = OrderedDict()
+
+    def __repr__(self):
+        return 'ConstantCache(hits=%d, misses=%d, size=%d)' % (self.hits, self.misses, len(self._tensors))
+
+    def __call__(self, key, factory, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        dtype, device = Precision.resolve(dtype, device)
+        cache_key = (key, dtype, device)
+        entry = self._tensors.get(cache_key)
+        if entry is not None:
+            self.hits += 1
+            if Tracer.active:
+                Tracer.cache(True)
+            if self.maxsize is not None:
+                self._tensors.move_to_end(cache_key)
+            return entry
+
+        self.misses += 1
+        if Tracer.active:
+            Tracer.cache(False)
+            tensor = Tracer.call('construct', str(key), self._build, (factory, dtype, device))
+        else:
+            tensor = self._build(factory, dtype, device)
+        self._tensors[cache_key] = tensor
+        if self.maxsize is not None and len(self._tensors) > self.maxsize:
+            self._tensors.popitem(last=False)
+        return tensor
+
+    @staticmethod
+    def _build(factory, dtype: torch.dtype, device) -> torch.Tensor:
+        if dtype.is_complex:
+            # the factory builds its tensors, and the ones it fetches from here, in the requested precision
+            with Precision.use(dtype, device):
+                tensor = factory()
+        else:
+            tensor = factory()
+        return tensor.to(dtype=dtype, device=device).as_subclass(_ReadOnly)
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._tensors.clear()
+
+# the fixed gates and basis states
+CONSTANTS = _ConstantCache()
+
+# the matrices of the parametrized gates by their angle
+ANGLES = _ConstantCache(maxsize=256)
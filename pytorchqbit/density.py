@@ -0,0 +1,196 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Density matrices of mixed states and the noise channels acting on them
+"""
+
+import torch
+from .convert import CONSTANTS, Precision
+from .gate import Identity, PauliX, PauliY, PauliZ, apply_on, _apply_diagonal, _apply_permutation, _targets
+from .qbit import _kron
+
+
+def density_matrix(state: torch.Tensor) -> torch.Tensor:
+    """The density matrix |state><state| of a pure state, or of each state of a batch
+
+    >>> density_matrix(Plus())
+    tensor([[0.5000+0.j, 0.5000+0.j],
+            [0.5000+0.j, 0.5000+0.j]])
+    >>> density_matrix(Batch(Zero(), One(), Plus())).shape
+    torch.Size([3, 2, 2])
+
+    """
+    return torch.matmul(state, state.mH)
+
+
+def _channel_parameter(value) -> torch.Tensor:
+    """A float or a tensor of noise parameters as a real tensor with a trailing axis for the Kraus operators"""
+    return torch.as_tensor(value, dtype=Precision.real(), device=Precision.device)[..., None, None, None]
+
+
+class Kraus:
+    """Kraus is a noise channel rho -> sum K rho K^dagger given by its operators
+
+The operators are given as a list of matrices or as a tensor of shape (..., m, 2^k, 2^k), where the leading
+dimensions are a batch of channels. The channel acts on the density matrices through its superoperator:
+
+    >>> flip = Kraus([0.6**0.5 * Identity(), 0.4**0.5 * PauliX()], 'flip')
+    >>> flip
+    flip
+    >>> flip().shape
+    torch.Size([4, 4])
+    >>> evolve(density_matrix(Zero()), flip, 0)
+    tensor([[0.6000+0.j, 0.0000+0.j],
+            [0.0000+0.j, 0.4000+0.j]])
+
+    """
+    kind = 'channel'
+
+    def __init__(self, operators, name: str = 'K'):
+        if not isinstance(operators, torch.Tensor):
+            operators = torch.stack(list(operators))
+        self._operators = operators
+        self._name = name
+
+    def __repr__(self):
+        return self._name
+
+    def kraus(self) -> torch.Tensor:
+        """The Kraus operators, with the shape (..., m, 2^k, 2^k)"""
+        return self._operators
+
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        """The superoperator acting on the row major flattened density matrix of the targets"""
+        operators = self.kraus().to(dtype=dtype, device=device)
+        return _kron(operators, operators.conj()).sum(dim=-3)
+
+
+class Depolarizing(Kraus):
+    """Depolarizing replaces the qubit by the maximally mixed state with the probability p
+
+    >>> Depolarizing(0.1)
+    Depolarizing(0.1)
+    >>> evolve(density_matrix(Zero()), Depolarizing(0.5), 0)
+    tensor([[0.7500+0.j, 0.0000+0.j],
+            [0.0000+0.j, 0.2500+0.j]])
+
+A tensor of probabilities gives a batch of channels, and a batch of density matrices as the result:
+
+    >>> import torch
+    >>> evolve(density_matrix(Zero()), Depolarizing(torch.tensor([0.0, 0.5, 1.0])), 0)[:, 1, 1]
+    tensor([0.0000+0.j, 0.2500+0.j, 0.5000+0.j])
+
+    """
+    def __init__(self, p):
+        self.p = p
+        probability = _channel_parameter(p)
+        paulis = CONSTANTS('IXYZ', lambda: torch.stack([Identity(), PauliX(), PauliY(), PauliZ()]))
+        weights = torch.cat([1 - 3 * probability / 4, (probability / 4).expand(*probability.shape[:-3], 3, 1, 1)],
+                            dim=-3)
+        super().__init__(weights.sqrt() * paulis, 'Depolarizing(%s)' % p)
+
+
+class AmplitudeDamping(Kraus):
+    """AmplitudeDamping relaxes the state |1> to |0> with the probability gamma
+
+    >>> AmplitudeDamping(0.3)
+    AmplitudeDamping(0.3)
+    >>> evolve(density_matrix(One()), AmplitudeDamping(0.3), 0)
+    tensor([[0.3000+0.j, 0.0000+0.j],
+            [0.0000+0.j, 0.7000+0.j]])
+
+    """
+    def __init__(self, gamma):
+        self.gamma = gamma
+        gamma = _channel_parameter(gamma)
+        zero, one = torch.zeros_like(gamma), torch.ones_like(gamma)
+        operators = torch.cat([torch.cat([torch.cat([one, zero], dim=-1),
+                                          torch.cat([zero, (1 - gamma).sqrt()], dim=-1)], dim=-2),
+                               torch.cat([torch.cat([zero, gamma.sqrt()], dim=-1),
+                                          torch.cat([zero, zero], dim=-1)], dim=-2)], dim=-3)
+        super().__init__(operators.to(Precision.dtype), 'AmplitudeDamping(%s)' % self.gamma)
+
+
+class PhaseDamping(Kraus):
+    """PhaseDamping scales the coherences between |0> and |1> by sqrt(1 - lambda) without changing the populations
+
+    >>> PhaseDamping(0.36)
+    PhaseDamping(0.36)
+    >>> evolve(density_matrix(Plus()), PhaseDamping(0.36), 0)
+    tensor([[0.5000+0.j, 0.4000+0.j],
+            [0.4000+0.j, 0.5000+0.j]])
+
+    """
+    def __init__(self, lambda_):
+        self.lambda_ = lambda_
+        lambda_ = _channel_parameter(lambda_)
+        zero, one = torch.zeros_like(lambda_), torch.ones_like(lambda_)
+        operators = torch.cat([torch.cat([torch.cat([one, zero], dim=-1),
+                                          torch.cat([zero, (1 - lambda_).sqrt()], dim=-1)], dim=-2),
+                               torch.cat([torch.cat([zero, zero], dim=-1),
+                                          torch.cat([zero, lambda_.sqrt()], dim=-1)], dim=-2)], dim=-3)
+        super().__init__(operators.to(Precision.dtype), 'PhaseDamping(%s)' % self.lambda_)
+
+
+def _both_sides(state: torch.Tensor, gate, wires: list) -> torch.Tensor:
+    """U rho U^dagger as one pass of U times its complex conjugate over the row and then the column wires"""
+    kind = getattr(gate, 'kind', None)
+    if kind == 'diagonal':
+        phases = gate.diagonal(state.dtype, state.device)
+        phases = phases[..., :, None] * phases.conj()[..., None, :]
+        return _apply_diagonal(state, phases.reshape(*phases.shape[:-2], -1), wires)
+    if kind == 'permutation':
+        permutation = gate.permutation(state.device)
+        return _apply_permutation(state, (permutation[:, None] * len(permutation) + permutation).reshape(-1), wires)
+    if not isinstance(gate, torch.Tensor):
+        gate = gate(state.dtype, state.device)
+    return apply_on(state, _kron(gate, gate.conj()), wires)
+
+
+def evolve(rho: torch.Tensor, operation, targets) -> torch.Tensor:
+    """Apply a gate or a noise channel to the target qubits of a density matrix
+
+The density matrix is handled as a state of 2n qubits, the first n indexing its rows and the rest its columns.
+Gates are the same objects as for the state vectors and give U rho U^dagger, as U on the row qubits and the
+complex conjugate of U on the column qubits. Both are applied at once in a single pass over rho, and diagonal
+and permutation gates keep their fast paths:
+
+    >>> import torch
+    >>> rho = evolve(density_matrix(Combine(Zero(), Zero())), H, 0)
+    >>> rho = evolve(rho, CNOT, [0, 1])
+    >>> equal(rho, density_matrix(apply(Combine(Plus(), Zero()), CNOT())), atol=1e-6)
+    True
+
+Channels are contracted as a 4^k x 4^k matrix with the row and column qubits of their k targets only,
+so the full superoperator of the register is never built. The noise on one half of a Bell pair leaves the other half alone:
+
+    >>> noisy = evolve(rho, Depolarizing(1.0), 1)
+    >>> torch.diagonal(noisy).real
+    tensor([0.2500, 0.2500, 0.2500, 0.2500])
+    >>> torch.allclose(evolve(rho, AmplitudeDamping(0.2), [1]), evolve(rho, Kraus(AmplitudeDamping(0.2).kraus()), 1))
+    True
+
+A batch of channel parameters, here 10 damping rates on a register of 10 qubits, runs as one contraction:
+
+    >>> rates = torch.linspace(0, 1, 10)
+    >>> rho = density_matrix(Combine(*[One()] * 10))
+    >>> damped = evolve(rho, AmplitudeDamping(rates), 5)
+    >>> damped.shape
+    torch.Size([10, 1024, 1024])
+    >>> torch.allclose(damped[:, 1023 - 16, 1023 - 16].real, rates)
+    True
+
+    """
+    targets = _targets(rho, targets)
+    n = rho.shape[-1].bit_length() - 1
+    columns = [n + target for target in targets]
+    state = rho.reshape(*rho.shape[:-2], 4**n, 1)
+    if getattr(operation, 'kind', None) == 'channel':
+        superoperator = operation(rho.dtype, rho.device)
+        if superoperator.shape[-2:] != (4**len(targets), 4**len(targets)):
+            raise ValueError('channel %s does not act on %d qubits' % (operation, len(targets)))
+        state = apply_on(state, superoperator, targets + columns)
+    else:
+        state = _both_sides(state, operation, targets + columns)
+    return state.reshape(*state.shape[:-2], 2**n, 2**n)
@@ -0,0 +1,232 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Pauli frame sampling of noisy Clifford circuits, 64 shots to a machine word
+"""
+
+import math
+import typing
+import torch
+from .qbit import Zero, Measure
+from .gate import Identity, H, PauliX, PauliY, PauliZ, Phase, CNOT, CPauliZ, SWAP
+from .tableau import Tableau
+
+# the Pauli errors of a channel as (x, z) flips, in the order of the probabilities of _pauli_probabilities
+_FLIPS = torch.tensor([[1, 0], [1, 1], [0, 1]], dtype=torch.bool)
+
+# above this probability the flips are drawn shot by shot instead of by the gaps between them
+_DENSE = 0.05
+
+
+def _pauli_probabilities(channel) -> typing.List[float]:
+    """The probabilities of X, Y and Z of a single qubit Pauli channel, from the diagonal of its chi matrix"""
+    operators = channel.kraus()
+    if operators.shape != (operators.shape[0], 2, 2):
+        raise ValueError('%s is not a single qubit channel' % channel)
+    paulis = torch.stack([Identity(), PauliX(), PauliY(), PauliZ()]).to(operators.dtype)
+    # K = sum_P c_P P with c_P = tr(P K) / 2
+    coefficients = torch.einsum('pij,kij->kp', paulis.conj(), operators) / 2
+    chi = torch.einsum('kp,kq->pq', coefficients, coefficients.conj())
+    if not torch.allclose(chi, torch.diag_embed(torch.diagonal(chi)), atol=1e-6):
+        raise ValueError('%s is not a Pauli channel' % channel)
+    return torch.diagonal(chi).real[1:].tolist()
+
+
+def _pack(bits: torch.Tensor) -> torch.Tensor:
+    """Pack the bools of the last axis into int64 words, the bit i of a word being the shot i modulo 64"""
+    words = (bits.shape[-1] + 63) // 64
+    bits = torch.nn.functional.pad(bits.long(), (0, 64 * words - bits.shape[-1]))
+    # the powers of two are distinct, so their sum is their bitwise or
+    return (bits.reshape(*bits.shape[:-1], words, 64) << torch.arange(64)).sum(-1)
+
+
+def unpack(words: torch.Tensor, shots: int) -> torch.Tensor:
+    """The bools of shape (shots, rows) of packed words of shape (rows, words)"""
+    bits = (words[..., None] >> torch.arange(64)) & 1
+    return bits.reshape(words.shape[0], -1)[:, :shots].T.bool()
+
+
+class FrameSampler:
+    """FrameSampler draws millions of shots of a noisy Clifford circuit from one noiseless reference run
+
+The circuit is built from H, Phase, CNOT, CPauliZ, SWAP and the Pauli gates, with Measure for measuring
+qubits in the computational basis, Zero for resetting them, and single qubit Pauli channels like
+Depolarizing for the noise. The reference run on a Tableau fixes one outcome per measurement. Every shot
+then differs from the reference by a Pauli frame, and the frames of all the shots are pushed through the
+circuit as rows of int64 words, one bit per shot, with a few XORs per gate. The flips of the noise are drawn
+from the gaps between them, so rare errors cost close to nothing.
+
+A distance five repetition code, five rounds of syndrome extraction with ancillas 5..8:
+
+    >>> import torch
+    >>> circuit = Circuit(9)
+    >>> detectors = []
+    >>> for round in range(5):
+    ...     for qubit in range(5):
+    ...         _ = circuit.add(Depolarizing(0.01), qubit)
+    ...     for ancilla in range(4):
+    ...         _ = circuit.add(CNOT, ancilla, 5 + ancilla).add(CNOT, ancilla + 1, 5 + ancilla)
+    ...     for ancilla in range(4):
+    ...         _ = circuit.add(Measure, 5 + ancilla).add(Zero, 5 + ancilla)
+    ...         detectors.append([4 * round + ancilla] + ([4 * (round - 1) + ancilla] if round else []))
+    >>> for qubit in range(5):
+    ...     _ = circuit.add(Measure, qubit)
+    >>> detectors += [[20 + qubit, 21 + qubit, 16 + qubit] for qubit in range(4)]
+    >>> sampler = FrameSampler(circuit, detectors, generator=torch.Generator().manual_seed(0))
+    >>> sampler
+    FrameSampler(9 qubits, 25 measurements, 24 detectors)
+
+The results are packed, the bit s % 64 of the word s // 64 of a row being the shot s:
+
+    >>> measurements, detections = sampler.sample(1000000)
+    >>> measurements.shape, detections.shape
+    (torch.Size([25, 15625]), torch.Size([24, 15625]))
+    >>> events = unpack(detections, 1000000)
+    >>> events.shape, events.dtype
+    (torch.Size([1000000, 24]), torch.bool)
+
+Without noise the detectors never fire, and the rate of the events follows the error rate:
+
+    >>> rate = events.double().mean().item()
+    >>> 0.005 < rate < 0.02
+    True
+    >>> noiseless = Circuit(9, [(gate, targets) for gate, targets in circuit if gate.__class__ is not Depolarizing])
+    >>> bool(FrameSampler(noiseless, detectors).sample(1000)[1].eq(0).all())
+    True
+
+Random measurements stay random, and the correlations of the outcomes are kept:
+
+    >>> bell = Circuit(2).add(H, 0).add(CNOT, 0, 1).add(Measure, 0).add(Measure, 1)
+    >>> outcomes = unpack(FrameSampler(bell).sample(10000)[0], 10000)
+    >>> bool(torch.all(outcomes[:, 0] == outcomes[:, 1])), abs(outcomes[:, 0].double().mean().item() - 0.5) < 0.03
+    (True, True)
+
+    """
+
+    def __init__(self, circuit, detectors: typing.Iterable[typing.Iterable[int]] = (),
+                 generator: torch.Generator = None):
+        self.n = circuit.n
+        self.generator = generator
+        self.detectors = [list(detector) for detector in detectors]
+        # the reference run records one outcome per measurement, and the frames need the Clifford structure only
+        tableau = Tableau(circuit.n, generator)
+        reference = []
+        self._program = []
+        for gate, targets in circuit:
+            if gate is Measure:
+                for target in targets:
+                    reference.append(tableau.measure(target))
+                self._program.append(('measure', targets))
+            elif gate is Zero:
+                for target in targets:
+                    if tableau.measure(target):
+                        tableau.apply(PauliX, target)
+                self._program.append(('reset', targets))
+            elif getattr(gate, 'kind', None) == 'channel':
+                self._program.append(('noise', targets, _pauli_probabilities(gate)))
+            else:
+                tableau.apply(gate, *targets)
+                if gate not in (PauliX, PauliY, PauliZ):
+                    self._program.append((gate, targets))
+        self.reference = torch.tensor(reference, dtype=torch.bool)
+        for detector in self.detectors:
+            if any(not -len(reference) <= record < len(reference) for record in detector):
+                raise ValueError('detector %s refers to a measurement out of %d' % (detector, len(reference)))
+
+    def __repr__(self):
+        return 'FrameSampler(%d qubits, %d measurements, %d detectors)' % (
+            self.n, len(self.reference), len(self.detectors))
+
+    def _random_words(self, words: int) -> torch.Tensor:
+        """Words of independent fair bits"""
+        return torch.randint(0, 256, (words * 8,), dtype=torch.uint8, generator=self.generator).view(torch.int64)
+
+    def _flips(self, shots: int, words: int, probability: float) -> tuple:
+        """The shots hit by an error of the probability, as words, and their indices"""
+        if probability >= _DENSE:
+            hit = torch.rand(shots, generator=self.generator) < probability
+            return _pack(hit), torch.nonzero(hit)[:, 0]
+        # the gaps between the hits are geometric, so the hits come in the order of the shots
+        log = math.log1p(-probability)
+        parts, last = [], -1
+        while last < shots:
+            draws = 1 - torch.rand(int(shots * probability * 1.1) + 16, dtype=torch.float64, generator=self.generator)
+            positions = last + torch.cumsum(torch.floor(torch.log(draws) / log) + 1, 0).long()
+            parts.append(positions[positions < shots])
+            last = int(positions[-1])
+        positions = torch.cat(parts)
+        mask = torch.zeros(words, dtype=torch.int64)
+        mask.index_add_(0, positions >> 6, torch.ones_like(positions) << (positions & 63))
+        return mask, positions
+
+    def _noise(self, x: torch.Tensor, z: torch.Tensor, target: int, probabilities: typing.List[float],
+               shots: int, words: int):
+        total = sum(probabilities)
+        if total <= 0:
+            return
+        _, positions = self._flips(shots, words, total)
+        if len(positions) == 0:
+            return
+        # which of X, Y and Z hit each of the shots
+        kinds = torch.multinomial(torch.tensor(probabilities, dtype=torch.float64), len(positions), replacement=True,
+                                  generator=self.generator)
+        flips = _FLIPS[kinds]
+        for row, flip in [(x, flips[:, 0]), (z, flips[:, 1])]:
+            hit = positions[flip]
+            mask = torch.zeros(words, dtype=torch.int64)
+            mask.index_add_(0, hit >> 6, torch.ones_like(hit) << (hit & 63))
+            row[target] ^= mask
+
+    def sample(self, shots: int) -> typing.Tuple[torch.Tensor, torch.Tensor]:
+        """The packed measurement outcomes of shape (measurements, words) and detection events of shape
+(detectors, words), with words = ceil(shots / 64)"""
+        words = (shots + 63) // 64
+        x = torch.zeros(self.n, words, dtype=torch.int64)
+        # a random Z frame on |0> changes nothing, and makes the random measurements random
+        z = self._random_words(self.n * words).reshape(self.n, words)
+        records = []
+        for operation in self._program:
+            gate, targets = operation[0], operation[1]
+            if gate is H:
+                a, = targets
+                x[a], z[a] = z[a].clone(), x[a].clone()
+            elif gate is Phase:
+                a, = targets
+                z[a] ^= x[a]
+            elif gate is CNOT:
+                a, b = targets
+                x[b] ^= x[a]
+                z[a] ^= z[b]
+            elif gate is CPauliZ:
+                a, b = targets
+                z[a] ^= x[b]
+                z[b] ^= x[a]
+            elif gate is SWAP:
+                a, b = targets
+                x[[a, b]] = x[[b, a]]
+                z[[a, b]] = z[[b, a]]
+            elif gate == 'measure':
+                for target in targets:
+                    records.append(x[target].clone())
+                    z[target] = self._random_words(words)
+            elif gate == 'reset':
+                for target in targets:
+                    x[target] = 0
+                    z[target] = self._random_words(words)
+            else:
+                for target in targets:
+                    self._noise(x, z, target, operation[2], shots, words)
+
+        flips = torch.stack(records) if records else torch.zeros(0, words, dtype=torch.int64)
+        # the bits past the last shot are left zero
+        valid = torch.full((words,), -1, dtype=torch.int64)
+        if shots % 64:
+            valid[-1] = (1 << (shots % 64)) - 1
+        flips &= valid
+        measurements = flips ^ (self.reference.long()[:, None] * valid)
+        detections = torch.zeros(len(self.detectors), words, dtype=torch.int64)
+        for row, detector in enumerate(self.detectors):
+            for record in detector:
+                detections[row] ^= flips[record]
+        return measurements, detections
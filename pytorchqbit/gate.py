@@ -7,8 +7,10 @@ Quatum gates from https://en.wikipedia.org/wiki/Quantum_logic_gate
 """
 
 from math import e
+import typing
 import torch
-from .convert import convert_to_complex
+from .convert import convert_to_complex, CONSTANTS, ANGLES, Precision, _reading_constants
+from .tracer import Tracer
 
 
 class _Identity():
@@ -24,15 +26,16 @@ class _Identity():
             [0.+0.j, 1.+0.j, 0.+0.j, 0.+0.j],
             [0.+0.j, 0.+0.j, 1.+0.j, 0.+0.j],
             [0.+0.j, 0.+0.j, 0.+0.j, 1.+0.j]])
-
+    >>> Identity(3).shape
+    torch.Size([8, 8])
 
     """
     def __init__(self):
         pass
     def __repr__(self):
         return 'Identity'
-    def __call__(self, n:int = 1) -> torch.Tensor:
-        return convert_to_complex(torch.eye(2*n))
+    def __call__(self, n:int = 1, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS(('Identity', n), lambda: torch.eye(2**n), dtype, device)
 
 Identity = _Identity()
 
@@ -45,13 +48,18 @@ class _H():
     tensor([[ 0.7071+0.j,  0.7071+0.j],
             [ 0.7071+0.j, -0.7071+0.j]])
 
+The gate matrices are built once and shared, do not change them in place:
+
+    >>> H() is H()
+    True
+
     """
     def __init__(self):
         pass
     def __repr__(self):
         return 'H'
-    def __call__(self) -> torch.Tensor:
-        return (2**-0.5)*convert_to_complex([[1, 1], [1, -1]])
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('H', lambda: (2**-0.5)*convert_to_complex([[1, 1], [1, -1]]), dtype, device)
 
 H = _H()
 
@@ -64,13 +72,23 @@ class _PauliX():
     tensor([[0.+0.j, 1.+0.j],
             [1.+0.j, 0.+0.j]])
 
+X only moves amplitudes around, so it is applied by indexing the state with its permutation:
+
+    >>> PauliX.kind
+    'permutation'
+    >>> PauliX.permutation()
+    tensor([1, 0])
+
     """
+    kind = 'permutation'
     def __init__(self):
         pass
     def __repr__(self):
         return 'X'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([[0, 1], [1, 0]])
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('X', lambda: convert_to_complex([[0, 1], [1, 0]]), dtype, device)
+    def permutation(self, device=None) -> torch.Tensor:
+        return CONSTANTS('X', lambda: torch.tensor([1, 0]), dtype=torch.int64, device=device)
 
 PauliX = _PauliX()
 
@@ -88,10 +106,10 @@ class _PauliY():
         pass
     def __repr__(self):
         return 'Y'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('Y', lambda: convert_to_complex([
             [0, -1j],
-            [1j, 0]])
+            [1j, 0]]), dtype, device)
 
 PauliY = _PauliY()
 
@@ -104,15 +122,25 @@ class _PauliZ():
     tensor([[ 1.+0.j,  0.+0.j],
             [ 0.+0.j, -1.+0.j]])
 
+Z is diagonal, so it is applied as an elementwise product with its diagonal:
+
+    >>> PauliZ.kind
+    'diagonal'
+    >>> PauliZ.diagonal()
+    tensor([ 1.+0.j, -1.+0.j])
+
     """
+    kind = 'diagonal'
     def __init__(self):
         pass
     def __repr__(self):
         return 'Z'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('Z', lambda: convert_to_complex([
             [1, 0],
-            [0, -1]])
+            [0, -1]]), dtype, device)
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return torch.diagonal(self(dtype, device))
 
 PauliZ = _PauliZ()
 
@@ -126,15 +154,24 @@ class _Phase():
             [0.+0.j, 0.+1.j]])
 
     """
+    kind = 'diagonal'
     def __init__(self):
         pass
     def __repr__(self):
         return 'P'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([[1, 0], [0, 0+1j]])
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('P', lambda: convert_to_complex([[1, 0], [0, 0+1j]]), dtype, device)
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return torch.diagonal(self(dtype, device))
 
 Phase = _Phase()
 
+def _angle_tensor(angle: torch.Tensor, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+    """A tensor of angles in the real precision of dtype, keeping its autograd history"""
+    dtype, device = Precision.resolve(dtype, device)
+    return angle.to(dtype=Precision.real(dtype), device=device)
+
+
 class R:
     """R is the custom phase shift gate
 
@@ -145,14 +182,142 @@ class R:
     tensor([[1.0000+0.0000j, 0.0000+0.0000j],
             [0.0000+0.0000j, 0.7071+0.7071j]])
 
+The latest angles are kept in a bounded cache:
+
+    >>> R(pi/4)() is R(pi/4)()
+    True
+
+The angle can be a tensor, which is then rebuilt on every call and followed by autograd, and a tensor of
+angles is a batch of gates:
+
+    >>> import torch
+    >>> angle = torch.tensor(pi/4, requires_grad=True)
+    >>> torch.vdot(Plus()[:, 0], apply(Plus(), R(angle))[:, 0]).real.backward()
+    >>> angle.grad
+    tensor(-0.3536)
+    >>> batch = R(torch.tensor([pi/4, pi/2]))
+    >>> batch.diagonal().shape
+    torch.Size([2, 2])
+    >>> equal(batch()[1], R(pi/2)())
+    True
+
+The derivative by the angle is a gate too:
+
+    >>> R(angle).derivative().diagonal()
+    tensor([ 0.0000+0.0000j, -0.7071+0.7071j], grad_fn=<MulBackward0>)
 
     """
+    kind = 'diagonal'
     def __init__(self, phase_shift):
         self._phase_shift = phase_shift
     def __repr__(self):
         return 'R(%s)'%self._phase_shift
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([[1, 0], [0, e**((0 + 1j) * self._phase_shift)]])
+    @property
+    def parameter(self):
+        return self._phase_shift
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        if isinstance(self._phase_shift, torch.Tensor):
+            return torch.diag_embed(self.diagonal(dtype, device))
+        return ANGLES(self._phase_shift, lambda: convert_to_complex([[1, 0], [0, e**((0 + 1j) * self._phase_shift)]]),
+                      dtype, device)
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        if isinstance(self._phase_shift, torch.Tensor):
+            angle = _angle_tensor(self._phase_shift, dtype, device)
+            phases = torch.stack([torch.zeros_like(angle), angle], -1)
+            return torch.polar(torch.ones_like(phases), phases)
+        return torch.diagonal(self(dtype, device))
+    def derivative(self, dtype: torch.dtype = None, device=None) -> 'Diagonal':
+        """The gate d R / d angle = diag(0, i e^(i angle))"""
+        return Diagonal(self.diagonal(dtype, device) * convert_to_complex([0, 1j], dtype, device), "R'")
+
+
+class _Rotation:
+    """The rotations exp(-i angle P / 2) about the Pauli axis P, the angle being a float or a tensor, build
+giving the matrices of a tensor of angles"""
+    def __init__(self, angle, name: str, build: typing.Callable[[torch.Tensor], torch.Tensor]):
+        self._angle = angle
+        self.name = name
+        self._build = build
+    def __repr__(self):
+        return '%s(%s)' % (self.name, self._angle)
+    @property
+    def parameter(self):
+        return self._angle
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        if isinstance(self._angle, torch.Tensor):
+            return self._build(_angle_tensor(self._angle, dtype, device))
+        return ANGLES((self.name, self._angle),
+                      lambda: self._build(torch.tensor(self._angle, dtype=Precision.real(), device=Precision.device)),
+                      dtype, device)
+    def derivative(self, dtype: torch.dtype = None, device=None) -> 'Unitary':
+        """The gate d U / d angle = -i P U / 2, which is U(angle + pi) / 2"""
+        if isinstance(self._angle, torch.Tensor):
+            matrix = self._build(_angle_tensor(self._angle, dtype, device) + torch.pi)
+        else:
+            matrix = type(self)(self._angle + torch.pi)(dtype, device)
+        return Unitary(matrix / 2, "%s'" % self.name)
+
+def _cos_sin(angle: torch.Tensor) -> tuple:
+    """cos(angle / 2) and sin(angle / 2) as complex tensors"""
+    zero = torch.zeros_like(angle)
+    return torch.complex(torch.cos(angle / 2), zero), torch.complex(torch.sin(angle / 2), zero)
+
+class RX(_Rotation):
+    """RX is the rotation exp(-i angle X / 2) about the X axis
+
+    >>> from math import pi
+    >>> RX(pi)
+    RX(3.141592653589793)
+    >>> equal(RX(pi)(), -1j * PauliX())
+    True
+    >>> import torch
+    >>> RX(torch.tensor([0.1, 0.2]))().shape
+    torch.Size([2, 2, 2])
+
+    """
+    def __init__(self, angle):
+        super().__init__(angle, 'RX', _rx)
+
+def _rx(angle: torch.Tensor) -> torch.Tensor:
+    cos, sin = _cos_sin(angle)
+    return torch.stack([cos, -1j * sin, -1j * sin, cos], -1).reshape(*angle.shape, 2, 2)
+
+class RY(_Rotation):
+    """RY is the rotation exp(-i angle Y / 2) about the Y axis, a real matrix
+
+    >>> from math import pi
+    >>> equal(RY(pi)(), -1j * PauliY())
+    True
+    >>> Measure.one(apply(Zero(), RY(pi)))
+    1
+
+    """
+    def __init__(self, angle):
+        super().__init__(angle, 'RY', _ry)
+
+def _ry(angle: torch.Tensor) -> torch.Tensor:
+    cos, sin = _cos_sin(angle)
+    return torch.stack([cos, -sin, sin, cos], -1).reshape(*angle.shape, 2, 2)
+
+class RZ(_Rotation):
+    """RZ is the rotation exp(-i angle Z / 2) about the Z axis, R(angle) up to a global phase
+
+    >>> from math import pi
+    >>> equal(RZ(pi)(), -1j * PauliZ())
+    True
+    >>> RZ(pi).kind
+    'diagonal'
+
+    """
+    kind = 'diagonal'
+    def __init__(self, angle):
+        super().__init__(angle, 'RZ', _rz)
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return torch.diagonal(self(dtype, device), dim1=-2, dim2=-1)
+
+def _rz(angle: torch.Tensor) -> torch.Tensor:
+    phases = torch.stack([-angle / 2, angle / 2], -1)
+    return torch.diag_embed(torch.polar(torch.ones_like(phases), phases))
 
 
 class _CNOT:
@@ -167,16 +332,19 @@ class _CNOT:
             [0.+0.j, 0.+0.j, 1.+0.j, 0.+0.j]])
 
     """
+    kind = 'permutation'
     def __init__(self):
         pass
     def __repr__(self):
         return 'CX'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('CX', lambda: convert_to_complex([
             [1, 0, 0, 0],
             [0, 1, 0, 0],
             [0, 0, 0, 1],
-            [0, 0, 1, 0]])
+            [0, 0, 1, 0]]), dtype, device)
+    def permutation(self, device=None) -> torch.Tensor:
+        return CONSTANTS('CX', lambda: torch.tensor([0, 1, 3, 2]), dtype=torch.int64, device=device)
 
 CNOT = _CNOT()
 
@@ -192,16 +360,19 @@ class _CPauliZ:
             [ 0.+0.j,  0.+0.j,  0.+0.j, -1.+0.j]])
 
     """
+    kind = 'diagonal'
     def __init__(self):
         pass
     def __repr__(self):
         return 'CZ'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('CZ', lambda: convert_to_complex([
             [1, 0, 0, 0],
             [0, 1, 0, 0],
             [0, 0, 1, 0],
-            [0, 0, 0, -1]])
+            [0, 0, 0, -1]]), dtype, device)
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return torch.diagonal(self(dtype, device))
 
 CPauliZ = _CPauliZ()
 
@@ -217,20 +388,122 @@ class _SWAP:
             [0.+0.j, 0.+0.j, 0.+0.j, 1.+0.j]])
 
     """
+    kind = 'permutation'
     def __init__(self):
         pass
     def __repr__(self):
         return 'SWAP'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('SWAP', lambda: convert_to_complex([
             [1, 0, 0, 0],
             [0, 0, 1, 0],
             [0, 1, 0, 0],
-            [0, 0, 0, 1]])
+            [0, 0, 0, 1]]), dtype, device)
+    def permutation(self, device=None) -> torch.Tensor:
+        return CONSTANTS('SWAP', lambda: torch.tensor([0, 2, 1, 3]), dtype=torch.int64, device=device)
 
 SWAP = _SWAP()
 
-def apply(state: torch.Tensor, gate: torch.Tensor) -> torch.Tensor:
+class MCX:
+    """MCX is the multi-controlled X gate, which flips the last qubit when all the controls are one
+
+    >>> MCX(2)
+    CCX
+    >>> MCX(2).permutation()
+    tensor([0, 1, 2, 3, 4, 5, 7, 6])
+    >>> equal(MCX(1)(), CNOT())
+    True
+    >>> Measure.one(apply_on(Combine(One(), One(), Zero()), Toffoli, [0, 1, 2]))
+    7
+    >>> Measure.one(apply_on(Combine(One(), One(), Zero(), One()), MCX(3), [3, 0, 1, 2]))
+    15
+
+    """
+    kind = 'permutation'
+    def __init__(self, controls: int):
+        self._controls = controls
+    def __repr__(self):
+        return 'C' * self._controls + 'X'
+    def __eq__(self, other):
+        return isinstance(other, MCX) and other._controls == self._controls
+    def __hash__(self):
+        return hash(('MCX', self._controls))
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS(repr(self), lambda: torch.eye(2**(self._controls + 1))[self.permutation('cpu')],
+                         dtype, device)
+    def permutation(self, device=None) -> torch.Tensor:
+        def build():
+            indices = torch.arange(2**(self._controls + 1))
+            indices[-2:] = indices[-2:].flip(0)
+            return indices
+        return CONSTANTS(repr(self), build, dtype=torch.int64, device=device)
+
+Toffoli = MCX(2)
+
+class Diagonal:
+    """Diagonal is a gate given by the diagonal of its matrix
+
+The matrix is never built when the gate is applied, the state is multiplied elementwise by the diagonal instead:
+
+    >>> import torch
+    >>> CZ = Diagonal(torch.tensor([1, 1, 1, -1], dtype=torch.complex64), 'CZ')
+    >>> CZ
+    CZ
+    >>> equal(CZ(), CPauliZ())
+    True
+    >>> state = Combine(One(), Zero(), One())
+    >>> equal(apply_on(state, CZ, [2, 0]), -state)
+    True
+    >>> equal(apply_on(state, CZ, [1, 0]), state)
+    True
+
+    """
+    kind = 'diagonal'
+    def __init__(self, phases: torch.Tensor, name: str = 'D'):
+        self._phases = phases
+        self._name = name
+    def __repr__(self):
+        return self._name
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return torch.diag_embed(self.diagonal(dtype, device))
+    def diagonal(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return self._phases.to(dtype=dtype, device=device)
+
+class Unitary:
+    """Unitary is a gate given directly by its matrix
+
+    >>> XZ = Unitary(PauliX() @ PauliZ(), 'XZ')
+    >>> XZ
+    XZ
+    >>> XZ()
+    tensor([[ 0.+0.j, -1.+0.j],
+            [ 1.+0.j,  0.+0.j]])
+
+    """
+    def __init__(self, matrix: torch.Tensor, name: str = 'U'):
+        self._matrix = matrix
+        self._name = name
+    def __repr__(self):
+        return self._name
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return self._matrix.to(dtype=dtype, device=device)
+
+def _flops(state: torch.Tensor, gate, targets=None) -> int:
+    """Estimate of the real floating point operations of applying gate to the targets, or to all of the state"""
+    if getattr(gate, 'kind', None) == 'permutation':
+        return 0
+    if getattr(gate, 'kind', None) == 'diagonal':
+        return 6 * state.numel()
+    if targets is None:
+        k = state.shape[-2].bit_length() - 1
+    else:
+        k = 1 if isinstance(targets, int) else len(targets)
+    # a complex multiply-add is eight real operations, and every amplitude sums 2^k of them
+    return 8 * 2**k * state.numel()
+
+@Tracer.traced('apply', _flops)
+@_reading_constants
+def apply(state: torch.Tensor, gate) -> torch.Tensor:
     """Apply gate to a state
 
 For example this chain evaluates to zero:
@@ -259,7 +532,195 @@ Swap places of a bit
             [1.+0.j],
             [0.+0.j]])
 
+A batch of states of shape (B, 2^n, 1) goes through a shared gate or through a batch of gates of shape (B, 2^n, 2^n)
+with a single matrix multiplication:
+
+    >>> import torch
+    >>> Measure.one(apply(Batch(Zero(), One()), PauliX()))
+    tensor([1, 0])
+    >>> Measure.one(apply(Batch(Zero(), Zero()), torch.stack([Identity(), PauliX()])))
+    tensor([0, 1])
+
+Gate objects can be given as such. Diagonal gates are then applied without a matrix multiplication:
+
+    >>> apply(Combine(One(), One()), CPauliZ)
+    tensor([[ 0.+0.j],
+            [ 0.+0.j],
+            [ 0.+0.j],
+            [-1.+0.j]])
+
+Likewise permutation gates just move the amplitudes:
+
+    >>> Measure.one(apply(Combine(One(), Zero()), CNOT))
+    3
+
+The gate has to span the whole register:
+
+    >>> apply(Combine(Zero(), Zero()), PauliX)
+    Traceback (most recent call last):
+    ...
+    ValueError: permutation of length 2 does not act on 2 qubits
 
     """
 
+    n = state.shape[-2].bit_length() - 1
+    if getattr(gate, 'kind', None) == 'diagonal':
+        phases = gate.diagonal(*_precision(state))
+        if phases.shape[-1] != state.shape[-2]:
+            raise ValueError('diagonal of length %d does not act on %d qubits' % (phases.shape[-1], n))
+        return state * phases.unsqueeze(-1)
+    if getattr(gate, 'kind', None) == 'permutation':
+        permutation = gate.permutation(state.device)
+        if permutation.shape[-1] != state.shape[-2]:
+            raise ValueError('permutation of length %d does not act on %d qubits' % (permutation.shape[-1], n))
+        return state.index_select(-2, permutation)
+    if not isinstance(gate, torch.Tensor):
+        gate = gate(*_precision(state))
+    if gate.shape[-1] != state.shape[-2]:
+        raise ValueError('gate of shape %s does not act on %d qubits' % (tuple(gate.shape), n))
     return torch.matmul(gate, state)
+
+def _precision(state: torch.Tensor) -> tuple:
+    """The dtype and device for the gate matrices applied to the state"""
+    return (state.dtype if state.dtype.is_complex else None), state.device
+
+@Tracer.traced('apply_on', _flops)
+@_reading_constants
+def apply_on(state: torch.Tensor, gate, targets) -> torch.Tensor:
+    """Apply a small gate to the target qubits of a register without building the full register operator
+
+The state is reshaped into a rank-n tensor with one axis per qubit, the gate is contracted over the target
+axes only and the rest of the register is left untouched. Qubit 0 is the leftmost qubit of Combine.
+
+    >>> state = Combine(Zero(), One())
+    >>> apply_on(state, SWAP(), [0, 1])
+    tensor([[0.+0.j],
+            [0.+0.j],
+            [1.+0.j],
+            [0.+0.j]])
+
+The result is the same as with the Kronecker built operator:
+
+    >>> import torch
+    >>> state = Combine(Zero(), One(), Plus())
+    >>> equal(apply_on(state, H(), [1]), apply(state, torch.kron(torch.kron(Identity(), H()), Identity())))
+    True
+
+Targets can be given in any order, gate qubits follow the order of the targets:
+
+    >>> Measure.one(apply_on(Combine(One(), Zero(), Zero()), CNOT(), [0, 2]))
+    5
+    >>> Measure.one(apply_on(Combine(Zero(), Zero(), One()), CNOT(), [2, 0]))
+    5
+
+Gate objects can be given without calling them:
+
+    >>> Measure.one(apply_on(Combine(Zero(), Zero()), PauliX, 1))
+    1
+
+Every gate touches the state only once, so wider registers are fine:
+
+    >>> wide = apply_on(Combine(*[Zero()] * 20), PauliX, 19)
+    >>> wide.shape
+    torch.Size([1048576, 1])
+    >>> Measure.one(wide)
+    1
+
+Batches of states and batches of gates are broadcast against each other:
+
+    >>> import torch
+    >>> Measure.one(apply_on(Batch(Combine(Zero(), Zero()), size=2), torch.stack([Identity(), PauliX()]), 0))
+    tensor([0, 2])
+    >>> Measure.one(apply_on(Batch(Combine(Zero(), One()), Combine(One(), Zero())), SWAP, [0, 1]))
+    tensor([2, 1])
+
+    """
+    targets = _targets(state, targets)
+    if getattr(gate, 'kind', None) == 'diagonal':
+        return _apply_diagonal(state, gate.diagonal(*_precision(state)), targets)
+    if getattr(gate, 'kind', None) == 'permutation':
+        return _apply_permutation(state, gate.permutation(state.device), targets)
+    if not isinstance(gate, torch.Tensor):
+        gate = gate(*_precision(state))
+    n = state.shape[-2].bit_length() - 1
+    k = len(targets)
+    if gate.shape[-2:] != (2**k, 2**k):
+        raise ValueError('gate of shape %s does not act on %d qubits' % (tuple(gate.shape), k))
+
+    batch = torch.broadcast_shapes(state.shape[:-2], gate.shape[:-2])
+    state = state.expand(*batch, *state.shape[-2:])
+    axes = [len(batch) + target for target in targets]
+    front = list(range(len(batch), len(batch) + k))
+
+    tensor = state.reshape(*batch, *[2] * n, state.shape[-1])
+    tensor = torch.movedim(tensor, axes, front)
+    shape = tensor.shape
+    tensor = torch.matmul(gate, tensor.reshape(*batch, 2**k, -1))
+    tensor = torch.movedim(tensor.reshape(shape), front, axes)
+    return tensor.reshape(state.shape)
+
+def _targets(state: torch.Tensor, targets) -> list:
+    """Check the targets against the register size of the state"""
+    targets = [targets] if isinstance(targets, int) else list(targets)
+    n = state.shape[-2].bit_length() - 1
+    if len(set(targets)) != len(targets) or not all(0 <= target < n for target in targets):
+        raise ValueError('invalid targets %s for a register of %d qubits' % (targets, n))
+    return targets
+
+def _phase_mask(phases: torch.Tensor, targets: list, wires: list) -> torch.Tensor:
+    """Reshape the diagonal of a gate on targets to broadcast over one axis per wire"""
+    k = len(targets)
+    if phases.shape[-1] != 2**k:
+        raise ValueError('diagonal of length %d does not act on %d qubits' % (phases.shape[-1], k))
+    batch = phases.shape[:-1]
+    positions = [wires.index(target) for target in targets]
+    order = sorted(range(k), key=positions.__getitem__)
+    mask = phases.reshape(*batch, *[2] * k)
+    mask = mask.permute(*range(len(batch)), *[len(batch) + i for i in order])
+    shape = [1] * len(wires)
+    for position in positions:
+        shape[position] = 2
+    return mask.reshape(*batch, *shape)
+
+@_reading_constants
+def _apply_diagonal(state: torch.Tensor, phases: torch.Tensor, targets: list, inplace: bool = False) -> torch.Tensor:
+    """Multiply the state elementwise by the diagonal of a gate on the targets"""
+    n = state.shape[-2].bit_length() - 1
+    mask = _phase_mask(phases, targets, range(n)).unsqueeze(-1)
+    tensor = state.reshape(*state.shape[:-2], *[2] * n, state.shape[-1])
+    if inplace:
+        tensor.mul_(mask)
+        return state
+    batch = torch.broadcast_shapes(state.shape[:-2], phases.shape[:-1])
+    return (tensor * mask).reshape(*batch, *state.shape[-2:])
+
+def _apply_permutation(state: torch.Tensor, permutation: torch.Tensor, targets: list) -> torch.Tensor:
+    """Move the amplitudes of the state along the target axes in the order of the permutation"""
+    n = state.shape[-2].bit_length() - 1
+    k = len(targets)
+    if permutation.shape[-1] != 2**k:
+        raise ValueError('permutation of length %d does not act on %d qubits' % (permutation.shape[-1], k))
+    batch = state.shape[:-2]
+    axes = [len(batch) + target for target in targets]
+    tensor = state.reshape(*batch, *[2] * n, state.shape[-1])
+
+    if k <= 3:
+        # a strided copy of each block of the target axes, no reshuffling of the whole state
+        result = torch.empty_like(tensor)
+        for index, source in enumerate(permutation.tolist()):
+            result[_block(tensor.dim(), axes, index)] = tensor[_block(tensor.dim(), axes, source)]
+        return result.reshape(state.shape)
+
+    front = list(range(len(batch), len(batch) + k))
+    tensor = torch.movedim(tensor, axes, front)
+    shape = tensor.shape
+    tensor = tensor.reshape(*batch, 2**k, -1).index_select(len(batch), permutation)
+    tensor = torch.movedim(tensor.reshape(shape), front, axes)
+    return tensor.reshape(state.shape)
+
+def _block(dims: int, axes: list, index: int) -> tuple:
+    """Index of the block where the bits of index are set on the axes, the first axis being the most significant"""
+    block = [slice(None)] * dims
+    for position, axis in enumerate(axes):
+        block[axis] = (index >> (len(axes) - 1 - position)) & 1
+    return tuple(block)
@@ -0,0 +1,219 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+State vectors kept in memory mapped files and processed block by block, for registers larger than the memory
+"""
+
+import typing
+from itertools import product
+import numpy as np
+import torch
+from .convert import Precision
+from .gate import SWAP, apply_on
+
+_NUMPY_DTYPES = {torch.complex64: np.complex64, torch.complex128: np.complex128}
+
+# the most high order qubits whose blocks are paired in one pass over the file
+_PAIRED = 3
+
+
+class MappedState:
+    """MappedState is a state vector of n qubits stored in a file, only a few blocks of it are in memory at a time
+
+The file is split into blocks of 2^chunk amplitudes, which are the amplitudes of the last chunk qubits. Gates on
+those qubits stream through the blocks one by one. Gates on the first qubits combine the blocks differing in those
+qubits, so a pass over the file still reads every block once:
+
+    >>> import os, tempfile, torch
+    >>> directory = tempfile.mkdtemp()
+    >>> qubits = [Zero(), Plus(), One(), Zero(), Minus(), Plus()]
+    >>> state = MappedState.combine(os.path.join(directory, 'state'), *qubits, chunk=2)
+    >>> state
+    MappedState(6, chunk=2)
+    >>> equal(state.tensor(), Combine(*qubits))
+    True
+
+Circuits run on the file in place. Consecutive gates share a pass as long as they touch at most three of the
+qubits selecting the blocks, here the first four:
+
+    >>> circuit = Circuit(6).add(H, 0).add(CNOT, 0, 5).add(R(0.3), 3).add(Toffoli, 5, 1, 0).add(SWAP, 2, 3)
+    >>> circuit = circuit.add(Unitary(torch.linalg.qr(torch.randn(4, 4, dtype=torch.complex64))[0]), 3, 0)
+    >>> expected = circuit.run(state.tensor())
+    >>> circuit.run(state) is state
+    True
+    >>> equal(state.tensor(), expected)
+    True
+    >>> state.passes(circuit)
+    2
+
+A gate on more than three of those qubits swaps the extra ones with free qubits of the blocks first, and
+back after it, each swap exchanging half of the amplitudes of the blocks it pairs:
+
+    >>> wide = MappedState.combine(os.path.join(directory, 'wide'), One(), One(), Plus(), One(), One(), Minus(), Zero(), chunk=2)
+    >>> expected = apply_on(wide.tensor(), MCX(4), [0, 1, 2, 3, 4])
+    >>> equal(Circuit(7).add(MCX(4), 0, 1, 2, 3, 4).run(wide).tensor(), expected)
+    True
+    >>> wide.passes(Circuit(7).add(MCX(4), 0, 1, 2, 3, 4))
+    3
+
+A gate needs room for all of its qubits in one pass:
+
+    >>> wide.passes(Circuit(7).add(MCX(5), 0, 1, 2, 3, 4, 5))
+    Traceback (most recent call last):
+    ...
+    ValueError: CCCCCX acts on 6 qubits, more than the 3 high order qubits of a pass and the 2 of a block
+
+Measurements read the blocks from the file too:
+
+    >>> state = MappedState.zeros(os.path.join(directory, 'ghz'), 12, chunk=4)
+    >>> state = Circuit(12).add(H, 0).add(CNOT, 0, 1).add(MCX(1), 1, 11).run(state)
+    >>> sorted(Measure.counts(state, 100))
+    ['000000000000', '110000000001']
+    >>> Measure.one(MappedState.combine(os.path.join(directory, 'one'), One(), Zero(), One(), chunk=1))
+    5
+
+    """
+
+    def __init__(self, path: str, n: int, chunk: int = 20, dtype: torch.dtype = None, mode: str = 'r+'):
+        self.path = path
+        self.n = n
+        self.chunk = min(chunk, n)
+        self.dtype = Precision.resolve(dtype)[0]
+        self._data = np.memmap(path, dtype=_NUMPY_DTYPES[self.dtype], mode=mode, shape=(2**n,))
+
+    def __repr__(self):
+        return 'MappedState(%d, chunk=%d)' % (self.n, self.chunk)
+
+    @property
+    def shape(self) -> torch.Size:
+        return torch.Size([2**self.n, 1])
+
+    @staticmethod
+    def zeros(path: str, n: int, chunk: int = 20, dtype: torch.dtype = None) -> 'MappedState':
+        """The all zero register in a new file"""
+        state = MappedState(path, n, chunk, dtype, mode='w+')
+        state._data[0] = 1
+        return state
+
+    @staticmethod
+    def combine(path: str, *qubits: torch.Tensor, chunk: int = 20, dtype: torch.dtype = None) -> 'MappedState':
+        """The product of single qubit states in a new file, like Combine but one block at a time"""
+        state = MappedState(path, len(qubits), chunk, dtype, mode='w+')
+        qubits = [qubit.to(state.dtype).reshape(2) for qubit in qubits]
+        high = qubits[:state.n - state.chunk]
+        low = qubits[state.n - state.chunk]
+        for qubit in qubits[state.n - state.chunk + 1:]:
+            low = torch.kron(low, qubit)
+        for index, bits in enumerate(product([0, 1], repeat=len(high))):
+            factor = 1
+            for qubit, bit in zip(high, bits):
+                factor = factor * qubit[bit]
+            state._block(index).copy_(factor * low)
+        return state
+
+    @staticmethod
+    def from_tensor(path: str, tensor: torch.Tensor, chunk: int = 20) -> 'MappedState':
+        """Store an in memory state in a new file"""
+        state = MappedState(path, tensor.shape[-2].bit_length() - 1, chunk, tensor.dtype, mode='w+')
+        state._data[:] = tensor.reshape(-1).numpy()
+        return state
+
+    def tensor(self) -> torch.Tensor:
+        """The whole state in memory as a column vector"""
+        return torch.from_numpy(np.array(self._data)).reshape(-1, 1)
+
+    def flush(self):
+        self._data.flush()
+
+    def _block(self, index: int) -> torch.Tensor:
+        """The block of amplitudes at index as a tensor sharing the memory of the file"""
+        size = 2**self.chunk
+        return torch.from_numpy(self._data[index * size:(index + 1) * size])
+
+    def _high(self, targets: typing.Iterable[int]) -> list:
+        """The targets which select between the blocks"""
+        return sorted({target for target in targets if target < self.n - self.chunk})
+
+    def _transposed(self, operations: typing.Iterable[tuple]) -> typing.Iterator[tuple]:
+        """The operations with the gates on more than _PAIRED high order qubits wrapped in swaps, which move the
+extra high qubits into the blocks for the gate and back after it"""
+        for gate, targets in operations:
+            extra = self._high(targets)[_PAIRED:]
+            if not extra:
+                yield gate, targets
+                continue
+            free = [qubit for qubit in range(self.n - 1, self.n - self.chunk - 1, -1) if qubit not in targets]
+            if len(free) < len(extra):
+                raise ValueError('%s acts on %d qubits, more than the %d high order qubits of a pass and the %d of a block'
+                                 % (gate, len(targets), _PAIRED, self.chunk))
+            swaps = dict(zip(extra, free))
+            for high, low in swaps.items():
+                yield SWAP, (high, low)
+            yield gate, tuple(swaps.get(target, target) for target in targets)
+            for high, low in swaps.items():
+                yield SWAP, (high, low)
+
+    def _passes(self, operations: typing.Iterable[tuple]) -> typing.List[tuple]:
+        """Group consecutive operations into passes over the file with at most _PAIRED high order qubits"""
+        passes = []
+        high, group = [], []
+        for gate, targets in self._transposed(operations):
+            extended = sorted(set(high) | set(self._high(targets)))
+            if group and len(extended) > _PAIRED:
+                passes.append((high, group))
+                high, group = self._high(targets), []
+            else:
+                high = extended
+            group.append((gate, targets))
+        if group:
+            passes.append((high, group))
+        return passes
+
+    def passes(self, circuit) -> int:
+        """The number of passes over the file needed to run the circuit"""
+        return len(self._passes(circuit))
+
+    def run(self, circuit) -> 'MappedState':
+        """Apply the gates of a circuit in place, returns the state"""
+        low = self.n - self.chunk
+        for high, group in self._passes(circuit):
+            # the register of a pass is the paired high qubits followed by the qubits of a block
+            wires = {qubit: position for position, qubit in enumerate(high)}
+            wires.update({qubit: len(high) + qubit - low for qubit in range(low, self.n)})
+            others = [qubit for qubit in range(low) if qubit not in wires]
+            for rest in product([0, 1], repeat=len(others)):
+                base = sum(bit << (low - 1 - qubit) for qubit, bit in zip(others, rest))
+                indices = [base + sum(bit << (low - 1 - qubit) for qubit, bit in zip(high, bits))
+                           for bits in product([0, 1], repeat=len(high))]
+                blocks = [self._block(index) for index in indices]
+                register = torch.cat(blocks).reshape(-1, 1)
+                for gate, targets in group:
+                    register = apply_on(register, gate, [wires[target] for target in targets])
+                for block, values in zip(blocks, register.reshape(len(blocks), -1)):
+                    block.copy_(values)
+        return self
+
+    def sample(self, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots basis state indices, reading the file twice"""
+        blocks = 2**(self.n - self.chunk)
+        totals = torch.tensor([self._block(index).abs().square().sum(dtype=torch.float64).item()
+                               for index in range(blocks)])
+        cumulative = torch.cumsum(totals, dim=0)
+        draws = torch.rand(shots, dtype=torch.float64, generator=generator) * cumulative[-1]
+        chosen = torch.searchsorted(cumulative, draws, right=True).clamp_(max=blocks - 1)
+        # the shots grouped by their block, so each block reads only its own shots
+        order = torch.argsort(chosen)
+        counts = torch.bincount(chosen, minlength=blocks).tolist()
+        samples = torch.empty(shots, dtype=torch.int64)
+        start = 0
+        for index, count in enumerate(counts):
+            if count == 0:
+                continue
+            shot = order[start:start + count]
+            start += count
+            offset = cumulative[index - 1] if index > 0 else 0
+            local = torch.cumsum(self._block(index).abs().square().double(), dim=0)
+            found = torch.searchsorted(local, draws[shot] - offset, right=True).clamp_(max=len(local) - 1)
+            samples[shot] = index * 2**self.chunk + found
+        return samples
@@ -0,0 +1,265 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Matrix product states for circuits which keep the entanglement low
+"""
+
+import typing
+import torch
+from .convert import Precision
+from .gate import SWAP, PauliX, PauliY, PauliZ, Identity
+from .pauli_group import PauliString
+from .expectation import _letters
+
+
+class MPSState:
+    """MPSState keeps a register as a chain of n tensors of shape (left bond, 2, right bond), one per site
+
+A product state has bonds of one, so the memory grows with the entanglement instead of with 2^n:
+
+    >>> state = MPSState.combine(One(), Zero(), Zero())
+    >>> state
+    MPSState(3, bonds=[1, 1])
+    >>> Measure.one(state)
+    4
+
+Gates on neighbouring sites are contracted into a block, and the block is split back with singular value
+decompositions, dropping the singular values outside the bond dimension max_bond or below the relative weight
+cutoff. Gates on distant qubits first swap the sites next to each other, and the qubits stay where they were
+moved. A hundred qubit GHZ state needs bonds of two only:
+
+    >>> import torch
+    >>> ghz = MPSState.zeros(100)
+    >>> circuit = Circuit(100).add(H, 0)
+    >>> for qubit in range(99):
+    ...     _ = circuit.add(CNOT, qubit, qubit + 1)
+    >>> _ = circuit.run(ghz)
+    >>> max(ghz.bonds)
+    2
+    >>> bits = ghz.sample_bits(1000, generator=torch.Generator().manual_seed(0))
+    >>> tuple(bits.shape), bool(torch.all(bits == bits[:, :1]))
+    ((1000, 100), True)
+    >>> ghz.expectation(['Z' * 100, 'X' * 100, 'Z' + 'I' * 98 + 'Z'])
+    tensor([1.0000, 1.0000, 1.0000])
+    >>> abs(ghz.expectation('Z' + 'I' * 99).item()) < 1e-3
+    True
+
+The results agree with the state vectors, for gates on any qubits in any order:
+
+    >>> circuit = Circuit(5).add(H, 0).add(CNOT, 0, 3).add(RY(0.4), 4).add(Toffoli, 4, 0, 2).add(CPauliZ, 1, 4)
+    >>> circuit = circuit.add(SWAP, 3, 1).add(Unitary(torch.linalg.qr(torch.randn(4, 4, dtype=torch.complex64))[0]), 2, 0)
+    >>> mps = circuit.run(MPSState.combine(Plus(), Zero(), One(), Minus(), Plus()))
+    >>> expected = circuit.run(Combine(Plus(), Zero(), One(), Minus(), Plus()))
+    >>> equal(mps.tensor(), expected, atol=1e-5)
+    True
+    >>> torch.allclose(mps.expectation(['XXIZI', 'ZIZYI']), expectation(expected, ['XXIZI', 'ZIZYI']), atol=1e-5)
+    True
+    >>> counts = Measure.counts(mps, 10000, generator=torch.Generator().manual_seed(1))
+    >>> probability = expected[int(max(counts, key=counts.get), 2), 0].abs().square().item()
+    >>> abs(max(counts.values()) / 10000 - probability) < 0.02
+    True
+
+A small bond dimension approximates the state, and the weight of the dropped singular values is kept count of:
+
+    >>> small = MPSState.zeros(6, max_bond=2)
+    >>> layers = Circuit(6)
+    >>> for layer in range(3):
+    ...     for qubit in range(6):
+    ...         _ = layers.add(RY(0.3 * qubit + layer), qubit)
+    ...     for qubit in range(layer % 2, 5, 2):
+    ...         _ = layers.add(CNOT, qubit, qubit + 1)
+    >>> _ = layers.run(small)
+    >>> max(small.bonds), small.error > 0
+    (2, True)
+    >>> bool(torch.vdot(small.tensor()[:, 0], layers.run()[:, 0]).abs() > 0.9)
+    True
+
+    """
+
+    def __init__(self, tensors: typing.List[torch.Tensor], max_bond: int = None, cutoff: float = 1e-12):
+        self.n = len(tensors)
+        self.sites = list(tensors)
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        # the site of each qubit, and the site left of which every tensor is left orthonormal and right of
+        # which every tensor is right orthonormal
+        self.layout = list(range(self.n))
+        self.center = 0
+        self.error = 0.0
+
+    def __repr__(self):
+        return 'MPSState(%d, bonds=%s)' % (self.n, self.bonds)
+
+    @property
+    def shape(self) -> tuple:
+        return (2**self.n, 1)
+
+    @property
+    def bonds(self) -> typing.List[int]:
+        """The dimensions of the bonds between the neighbouring sites"""
+        return [site.shape[-1] for site in self.sites[:-1]]
+
+    @staticmethod
+    def zeros(n: int, max_bond: int = None, cutoff: float = 1e-12, dtype: torch.dtype = None) -> 'MPSState':
+        """The all zero register"""
+        return MPSState.combine(*[torch.tensor([[1], [0]])] * n, max_bond=max_bond, cutoff=cutoff, dtype=dtype)
+
+    @staticmethod
+    def combine(*qubits: torch.Tensor, max_bond: int = None, cutoff: float = 1e-12,
+                dtype: torch.dtype = None) -> 'MPSState':
+        """The product of single qubit states, with bonds of one"""
+        dtype, device = Precision.resolve(dtype)
+        return MPSState([qubit.to(dtype=dtype, device=device).reshape(1, 2, 1) for qubit in qubits],
+                        max_bond, cutoff)
+
+    def _move_center(self, site: int):
+        """Move the orthogonality center to site with QR decompositions"""
+        while self.center < site:
+            tensor = self.sites[self.center]
+            left, _, right = tensor.shape
+            q, r = torch.linalg.qr(tensor.reshape(left * 2, right))
+            self.sites[self.center] = q.reshape(left, 2, -1)
+            self.sites[self.center + 1] = torch.einsum('ab,bsc->asc', r, self.sites[self.center + 1])
+            self.center += 1
+        while self.center > site:
+            tensor = self.sites[self.center]
+            left, _, right = tensor.shape
+            q, r = torch.linalg.qr(tensor.reshape(left, 2 * right).mT)
+            self.sites[self.center] = q.mT.reshape(-1, 2, right)
+            self.sites[self.center - 1] = torch.einsum('asb,cb->asc', self.sites[self.center - 1], r)
+            self.center -= 1
+
+    def _split(self, block: torch.Tensor, first: int, k: int):
+        """Split a block of shape (left, 2^k, right) back into the sites first..first+k-1, truncating the bonds"""
+        left, right = block.shape[0], block.shape[-1]
+        rest = block.reshape(left, -1)
+        for site in range(first, first + k - 1):
+            u, s, vh = torch.linalg.svd(rest.reshape(rest.shape[0] * 2, -1), full_matrices=False)
+            weights = s.square()
+            total = weights.sum()
+            # the smallest rank whose dropped weight stays within the cutoff and the bond dimension
+            dropped = torch.flip(torch.cumsum(torch.flip(weights, [0]), 0), [0]) / total
+            rank = max(1, int((dropped > self.cutoff).sum()))
+            if self.max_bond is not None:
+                rank = min(rank, self.max_bond)
+            self.error += float(weights[rank:].sum() / total)
+            kept = s[:rank] * (total / weights[:rank].sum()).sqrt()
+            self.sites[site] = u[:, :rank].reshape(rest.shape[0], 2, rank)
+            rest = kept[:, None].to(vh.dtype) * vh[:rank]
+        self.sites[first + k - 1] = rest.reshape(-1, 2, right)
+        self.center = first + k - 1
+
+    def _apply_sites(self, matrix: torch.Tensor, first: int, k: int):
+        """Apply a 2^k x 2^k matrix on the consecutive sites first..first+k-1"""
+        self._move_center(first)
+        block = self.sites[first]
+        for site in range(first + 1, first + k):
+            block = torch.einsum('asb,btc->astc', block, self.sites[site]).reshape(block.shape[0], -1,
+                                                                                 self.sites[site].shape[-1])
+        block = torch.einsum('ts,asb->atb', matrix, block)
+        self._split(block, first, k)
+
+    def _swap_sites(self, site: int):
+        """Exchange the qubits of the sites site and site + 1"""
+        self._apply_sites(SWAP(self.sites[site].dtype, self.sites[site].device), site, 2)
+        for qubit, place in enumerate(self.layout):
+            if place == site:
+                self.layout[qubit] = site + 1
+            elif place == site + 1:
+                self.layout[qubit] = site
+
+    def apply(self, gate, *targets: int) -> 'MPSState':
+        """Apply a gate on the targets, returns the state for chaining"""
+        if getattr(gate, 'kind', None) == 'channel':
+            raise ValueError('%s is a noise channel, it needs a density matrix from evolve' % gate)
+        dtype, device = self.sites[0].dtype, self.sites[0].device
+        matrix = gate if isinstance(gate, torch.Tensor) else gate(dtype, device)
+        k = len(targets)
+        if matrix.shape != (2**k, 2**k):
+            raise ValueError('gate of shape %s does not act on %d qubits' % (tuple(matrix.shape), k))
+        # gather the targets next to the leftmost one
+        order = sorted(targets, key=lambda target: self.layout[target])
+        for index, target in enumerate(order[1:], 1):
+            while self.layout[target] > self.layout[order[index - 1]] + 1:
+                self._swap_sites(self.layout[target] - 1)
+        # the gate axes follow the targets, the sites follow the layout
+        axes = [targets.index(target) for target in order]
+        matrix = matrix.reshape([2] * 2 * k).permute(*axes, *[k + axis for axis in axes]).reshape(2**k, 2**k)
+        self._apply_sites(matrix, self.layout[order[0]], k)
+        return self
+
+    def run(self, circuit) -> 'MPSState':
+        """Apply the gates of a circuit in order"""
+        for gate, targets in circuit:
+            self.apply(gate, *targets)
+        return self
+
+    def tensor(self) -> torch.Tensor:
+        """The full state vector, for registers small enough to have one"""
+        state = self.sites[0]
+        for site in self.sites[1:]:
+            state = torch.einsum('axb,bsc->axsc', state, site).reshape(1, -1, site.shape[-1])
+        state = state.reshape(*[2] * self.n)
+        return state.permute(self.layout).reshape(-1, 1)
+
+    def _environments(self) -> typing.List[torch.Tensor]:
+        """The norms of the chain right of each site, as bond x bond matrices"""
+        environments = [torch.ones(1, 1, dtype=self.sites[0].dtype, device=self.sites[0].device)]
+        for site in reversed(self.sites):
+            environments.append(torch.einsum('asc,cd,bsd->ab', site, environments[-1], site.conj()))
+        return environments[::-1]
+
+    def sample_bits(self, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots results as bits of shape (shots, n), qubit by qubit from the conditional probabilities"""
+        environments = self._environments()
+        dtype, device = self.sites[0].dtype, self.sites[0].device
+        vectors = torch.ones(shots, 1, dtype=dtype, device=device)
+        draws = torch.rand(shots, self.n, dtype=torch.float64, generator=generator)
+        bits = torch.zeros(shots, self.n, dtype=torch.bool)
+        for index, site in enumerate(self.sites):
+            # the unnormalized states of the rest of the chain for both values of the site
+            candidates = torch.einsum('xa,asb->xsb', vectors, site)
+            weights = torch.einsum('xsb,bc,xsc->xs', candidates, environments[index + 1], candidates.conj()).real
+            one = draws[:, index] * weights.sum(-1).double() >= weights[:, 0].double()
+            bits[:, index] = one
+            vectors = candidates[torch.arange(shots), one.long()]
+            vectors = vectors / torch.linalg.vector_norm(vectors, dim=-1, keepdim=True)
+        # from the order of the sites to the order of the qubits
+        return bits[:, self.layout]
+
+    def sample(self, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots basis state indices like Measure.sample, for registers of up to 63 qubits"""
+        if self.n > 63:
+            raise ValueError('the indices of %d qubits do not fit into int64, use sample_bits' % self.n)
+        bits = self.sample_bits(shots, generator).long()
+        return (bits << torch.arange(self.n - 1, -1, -1)).sum(-1)
+
+    def expectation(self, paulis) -> torch.Tensor:
+        """Expectation values of Hermitian Pauli strings like expectation, contracting the chain once per string"""
+        single = isinstance(paulis, (str, PauliString))
+        strings = [PauliString.from_label(pauli) if isinstance(pauli, str) else pauli
+                   for pauli in ([paulis] if single else paulis)]
+        dtype, device = self.sites[0].dtype, self.sites[0].device
+        letters = {'I': Identity(1, dtype, device), 'X': PauliX(dtype, device), 'Y': PauliY(dtype, device),
+                   'Z': PauliZ(dtype, device)}
+        operators = torch.stack([letters['I']] * self.n)[None].repeat(len(strings) + 1, 1, 1, 1)
+        signs = []
+        for index, string in enumerate(strings):
+            if string.n != self.n:
+                raise ValueError('%s does not act on %d qubits' % (string, self.n))
+            sign = (string.phase - (string.x & string.z).bit_count()) % 4
+            if sign % 2:
+                raise ValueError('%s is not Hermitian' % string)
+            signs.append(1 - sign)
+            for qubit, letter in _letters(string).items():
+                operators[index, self.layout[qubit]] = letters[letter]
+        # the last row of identities gives the norm
+        environment = torch.ones(len(strings) + 1, 1, 1, dtype=dtype, device=device)
+        for index, site in enumerate(self.sites):
+            environment = torch.einsum('xab,asc,xts,btd->xcd', environment, site, operators[:, index], site.conj())
+        values = environment[:, 0, 0].real
+        values = values[:-1] / values[-1] * torch.tensor(signs, dtype=values.dtype, device=device)
+        if single:
+            return values[0]
+        return values
@@ -12,6 +12,131 @@ import torch
 from .gate import (PauliX, PauliY, PauliZ, Identity, apply)
 
 
+# the phase exponents of the scalars of the Pauli groups, i**exponent == scalar
+_EXPONENTS = {1: 0, 1j: 1, -1: 2, -1j: 3}
+# the scalars in the order the groups enumerate them
+_MULTIPLIERS = [-1, 1, -1j, 1j]
+_SIGNS = ['+', '+i', '-', '-i']
+
+
+class PauliString:
+    """PauliString is a compact n qubit Pauli operator i**phase * X**x * Z**z, where the bits of the integers x and z
+tell which qubits carry an X or a Z factor. Bit q belongs to qubit q, and qubit 0 is the leftmost one as in Combine.
+
+    >>> p = PauliString.from_label('-iXYZ')
+    >>> p
+    -iXYZ
+    >>> p.n, bin(p.x), bin(p.z), p.phase
+    (3, '0b11', '0b110', 0)
+
+The dense operator is built only on request by calling the string like any other gate:
+
+    >>> import torch
+    >>> equal(p(), -1j * torch.kron(torch.kron(PauliX(), PauliY()), PauliZ()))
+    True
+
+Multiplication, commutation checks, hashing and equality work on the bits only:
+
+    >>> PauliString.from_label('XX') * PauliString.from_label('ZZ')
+    -YY
+    >>> PauliString.from_label('XI') * PauliString.from_label('ZI')
+    -iYI
+    >>> PauliString.from_label('XX').commutes(PauliString.from_label('ZZ'))
+    True
+    >>> PauliString.from_label('XI').commutes(PauliString.from_label('ZI'))
+    False
+    >>> 1j * PauliString.from_label('Y') == -(PauliString.from_label('X') * PauliString.from_label('Z'))
+    True
+    >>> len({PauliString.from_label('X'), PauliString.from_label('+X'), PauliString.from_label('-X')})
+    2
+    >>> equal((PauliString.from_label('XY') * PauliString.from_label('YZ'))(),
+    ...       torch.matmul(PauliString.from_label('XY')(), PauliString.from_label('YZ')()))
+    True
+
+Strings on separate registers combine like Combine does for states:
+
+    >>> PauliString.from_label('X').kron(PauliString.from_label('-YZ'))
+    -XYZ
+
+Large strings cost a few integer operations:
+
+    >>> a = PauliString.from_label('XYZI' * 250)
+    >>> b = PauliString.from_label('ZZXY' * 250)
+    >>> (a * b).n, a.commutes(b), a * a == PauliString(1000)
+    (1000, True, True)
+
+    """
+
+    def __init__(self, n: int, x: int = 0, z: int = 0, phase: int = 0):
+        self.n = n
+        self.x = x
+        self.z = z
+        self.phase = phase % 4
+
+    @staticmethod
+    def from_label(label: str) -> 'PauliString':
+        """Parse labels like 'XIZ', '-YY' or '+iZ'"""
+        letters = label.lstrip('+-i')
+        sign = label[:len(label) - len(letters)]
+        phase = {'': 0, '+': 0, '+i': 1, 'i': 1, '-': 2, '-i': 3}[sign]
+        x = z = 0
+        for qubit, letter in enumerate(letters):
+            if letter in 'XY':
+                x |= 1 << qubit
+            if letter in 'ZY':
+                z |= 1 << qubit
+            if letter == 'Y':
+                # Y = iXZ
+                phase += 1
+            elif letter not in 'IXZ':
+                raise ValueError('invalid Pauli label %s' % label)
+        return PauliString(len(letters), x, z, phase)
+
+    def __repr__(self):
+        letters = ''.join('IXZY'[(self.x >> qubit & 1) | (self.z >> qubit & 1) << 1] for qubit in range(self.n))
+        return _SIGNS[(self.phase - (self.x & self.z).bit_count()) % 4] + letters
+
+    def __eq__(self, other):
+        return (isinstance(other, PauliString) and self.n == other.n and self.x == other.x and self.z == other.z
+                and self.phase == other.phase)
+
+    def __hash__(self):
+        return hash((self.n, self.x, self.z, self.phase))
+
+    def __mul__(self, other: 'PauliString') -> 'PauliString':
+        if not isinstance(other, PauliString):
+            return self.__rmul__(other)
+        # moving the Z part of self over the X part of other gives a -1 for each qubit where both are set
+        phase = self.phase + other.phase + 2 * (self.z & other.x).bit_count()
+        return PauliString(self.n, self.x ^ other.x, self.z ^ other.z, phase)
+
+    def __rmul__(self, scalar) -> 'PauliString':
+        if scalar not in _EXPONENTS:
+            raise ValueError('%s is not a phase of the Pauli group' % scalar)
+        return PauliString(self.n, self.x, self.z, self.phase + _EXPONENTS[scalar])
+
+    def __neg__(self) -> 'PauliString':
+        return PauliString(self.n, self.x, self.z, self.phase + 2)
+
+    def commutes(self, other: 'PauliString') -> bool:
+        return ((self.x & other.z) ^ (self.z & other.x)).bit_count() % 2 == 0
+
+    def kron(self, other: 'PauliString') -> 'PauliString':
+        """The tensor product, self acting on the first qubits and other on the rest"""
+        return PauliString(self.n + other.n, self.x | other.x << self.n, self.z | other.z << self.n,
+                           self.phase + other.phase)
+
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        factors = [Identity(1, dtype, device), PauliX(dtype, device), PauliZ(dtype, device),
+                   torch.matmul(PauliX(dtype, device), PauliZ(dtype, device))]
+        tensor = reduce(torch.kron, [factors[(self.x >> qubit & 1) | (self.z >> qubit & 1) << 1]
+                                     for qubit in range(self.n)])
+        return 1j**self.phase * tensor
+
+# the single qubit strings in the order of P1
+_P1_STRINGS = [PauliString.from_label(label) for label in 'IXYZ']
+
+
 class _P1():
     """P1 is the First Pauli Group done from the cross product of
 [-1, 1, -1j, 1j] and [Identity(), PauliX(), PauliY(), PauliZ()]
@@ -53,13 +178,25 @@ Inverse element:
     >>> all([ any([equal(apply(a, b), Identity()) for b in P1()]) for a in P1() ])
     True
 
+The same elements are available as compact Pauli strings:
+
+    >>> list(P1(compact=True))[:6]
+    [-I, +I, -iI, +iI, -X, +X]
+    >>> all(equal(a, b()) for a, b in zip(P1(), P1(compact=True)))
+    True
+    >>> len({a * b for a in P1(compact=True) for b in P1(compact=True)})
+    16
+
     """
     def __init__(self):
         pass
     def __repr__(self):
         return 'P1'
-    def __call__(self) -> typing.Iterator[torch.Tensor]:
-        return map(lambda x: x[0] * x[1], product([Identity(), PauliX(), PauliY(), PauliZ()], [-1, 1, -1j, 1j]))
+    def __call__(self, compact: bool = False, dtype: torch.dtype = None, device=None) -> typing.Iterator[torch.Tensor]:
+        if compact:
+            return map(lambda x: x[1] * x[0], product(_P1_STRINGS, [-1, 1, -1j, 1j]))
+        factors = [Identity(1, dtype, device), PauliX(dtype, device), PauliY(dtype, device), PauliZ(dtype, device)]
+        return map(lambda x: x[0] * x[1], product(factors, [-1, 1, -1j, 1j]))
 #        return [
 #            -1  * Identity(), #  0
 #            1   * Identity(), #  1
@@ -125,6 +262,43 @@ Inverse element:
     >>> all([ any([equal(apply(a, b), i2) for b in p2]) for a in random.sample(p2, 20)])
     True
 
+With compact Pauli strings the group axioms can be checked for every element:
+
+    >>> s2 = list(P2(compact=True))
+    >>> all(equal(a, b()) for a, b in zip(p2, s2))
+    True
+    >>> group = set(s2)
+    >>> len(group)
+    64
+    >>> all(a * b in group for a in group for b in group)
+    True
+    >>> all(any(a * b == s2[1] for b in group) for a in group)
+    True
+
+Elements can be reached without enumerating the group. The index is decoded straight into the tensor factors
+and the phase:
+
+    >>> len(P2), len(Pn(1)), Pn(20).size
+    (1024, 16, 4835703278458516698824704)
+    >>> equal(P2[1], p2[1]) and equal(P2[-1], p2[-1])
+    True
+    >>> all(equal(a, b) for a, b in zip(P2[100:200:7], p2[100:200:7]))
+    True
+    >>> P2.string(1023), s2[1023]
+    (-iZZ, -iZZ)
+    >>> Pn(20).string(Pn(20).size - 1)
+    +iZZZZZZZZZZZZZZZZZZZZ
+
+Random elements are drawn uniformly with replacement:
+
+    >>> import torch
+    >>> Pn(3).sample(4, generator=torch.Generator().manual_seed(0), compact=True)
+    [+iZZX, +iIIY, +iIXY, -IXI]
+    >>> len(Pn(40).sample(1000, compact=True))
+    1000
+    >>> Pn(2).sample(1)[0].shape
+    torch.Size([4, 4])
+
     """
 
     def __init__(self, n: int):
@@ -133,11 +307,74 @@ Inverse element:
     def __repr__(self):
         return 'P%d'%(self.n)
 
-    def __call__(self) -> typing.Iterator[torch.Tensor]:
+    @property
+    def size(self) -> int:
+        """The number of elements, also for groups too large for len"""
+        if self.n == 1:
+            return 16
+        return 4 * 16**self.n
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(self.size)[index]]
+        return self.string(index)()
+
+    def string(self, index: int) -> PauliString:
+        """The element at index as a compact Pauli string"""
+        size = self.size
+        if not -size <= index < size:
+            raise IndexError('%s index out of range' % self)
+        index %= size
         if self.n == 1:
-            return P1()
-        for items in reduce(product, [P1() for _ in range(self.n)]):
-            tensor_part = reduce(torch.kron, items)
-            for multiplier in [-1, 1, -1j, 1j]:
-                yield multiplier * tensor_part
+            return self._decode(index // 4, [index % 4])
+        multiplier = index % 4
+        index //= 4
+        digits = [(index >> 4 * (self.n - 1 - qubit)) & 15 for qubit in range(self.n)]
+        return self._decode(sum(digit // 4 << 2 * qubit for qubit, digit in enumerate(digits)),
+                            [digit % 4 for digit in digits] + [multiplier])
+
+    def sample(self, k: int, generator: torch.Generator = None, compact: bool = False) -> list:
+        """Draw k elements uniformly with replacement, without enumerating the group"""
+        factors = torch.randint(16, (k, self.n), generator=generator).tolist()
+        multipliers = torch.randint(4, (k,), generator=generator).tolist()
+        strings = []
+        for digits, multiplier in zip(factors, multipliers):
+            extra = [multiplier] if self.n > 1 else []
+            strings.append(self._decode(sum(digit // 4 << 2 * qubit for qubit, digit in enumerate(digits)),
+                                        [digit % 4 for digit in digits] + extra))
+        if compact:
+            return strings
+        return [string() for string in strings]
+
+    def _decode(self, letters: int, multipliers: list) -> PauliString:
+        """Build the string from two bits per qubit telling I, X, Y or Z and the indices of the multipliers"""
+        string = PauliString(self.n)
+        for qubit in range(self.n):
+            letter = _P1_STRINGS[letters >> 2 * qubit & 3]
+            string = PauliString(self.n, string.x | letter.x << qubit, string.z | letter.z << qubit,
+                                 string.phase + letter.phase)
+        phase = sum(_EXPONENTS[_MULTIPLIERS[multiplier]] for multiplier in multipliers)
+        return PauliString(self.n, string.x, string.z, string.phase + phase)
+
+    def __call__(self, compact: bool = False, dtype: torch.dtype = None, device=None) -> typing.Iterator[torch.Tensor]:
+        if self.n == 1:
+            return P1(compact, dtype, device)
+        if compact:
+            return self._enumerate(list(P1(compact=True)), PauliString.kron)
+        return self._enumerate(list(P1(dtype=dtype, device=device)), torch.kron)
+
+    def _enumerate(self, factors: list, kron) -> typing.Iterator:
+        """Walk the products depth first so that every shared prefix of factors is combined only once"""
+        def expand(prefix, depth):
+            if depth == self.n:
+                for multiplier in _MULTIPLIERS:
+                    yield multiplier * prefix
+                return
+            for factor in factors:
+                yield from expand(kron(prefix, factor), depth + 1)
 
+        for factor in factors:
+            yield from expand(factor, 1)
@@ -4,9 +4,9 @@
 Representation of single qubit basic states
 """
 
-import random
 import torch
-from .convert import convert_to_complex
+from .convert import convert_to_complex, CONSTANTS, Precision
+from .tracer import Tracer
  
 
 
@@ -26,8 +26,8 @@ class _Zero():
         pass
     def __repr__(self):
         return '|0>'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([[1], [0]])
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('|0>', lambda: convert_to_complex([[1], [0]]), dtype, device)
 
 Zero = _Zero()
 
@@ -47,8 +47,8 @@ class _One():
         pass
     def __repr__(self):
         return '|1>'
-    def __call__(self) -> torch.Tensor:
-        return convert_to_complex([[0], [1]])
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('|1>', lambda: convert_to_complex([[0], [1]]), dtype, device)
 
 One = _One()
 
@@ -66,8 +66,8 @@ class _Plus():
         pass
     def __repr__(self):
         return '|+>'
-    def __call__(self) -> torch.Tensor:
-        return (2**-0.5) *(Zero() + One())
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('|+>', lambda: (2**-0.5) *(Zero() + One()), dtype, device)
 
 Plus = _Plus()
 
@@ -85,8 +85,8 @@ class _Minus():
         pass
     def __repr__(self):
         return '|->'
-    def __call__(self) -> torch.Tensor:
-        return (2**-0.5) *(Zero() - One())
+    def __call__(self, dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return CONSTANTS('|->', lambda: (2**-0.5) *(Zero() - One()), dtype, device)
 
 Minus = _Minus()
 
@@ -104,6 +104,72 @@ class _Measure:
     >>> Measure.one(One())
     1
 
+A batch of states is measured in one go and gives one result per state:
+
+    >>> Measure.one(Batch(Zero(), One(), One()))
+    tensor([0, 1, 1])
+
+Many shots are drawn at once from the same probabilities. A torch.Generator makes the draws reproducible:
+
+    >>> import torch
+    >>> Measure.sample(Combine(One(), Zero()), 5)
+    tensor([2, 2, 2, 2, 2])
+    >>> shots = Measure.sample(Plus(), 1000000, generator=torch.Generator().manual_seed(1))
+    >>> shots.shape
+    torch.Size([1000000])
+    >>> abs(shots.double().mean().item() - 0.5) < 0.01
+    True
+
+The results can be collected into a histogram of bit strings:
+
+    >>> Measure.counts(Combine(Zero(), One()), 10)
+    {'01': 10}
+    >>> sorted(Measure.counts(Combine(Plus(), One()), 1000))
+    ['01', '11']
+    >>> Measure.counts(Batch(Zero(), One()), 3)
+    [{'0': 3}, {'1': 3}]
+
+Subsets of the qubits are measured from their marginal probabilities, which sum out the other qubits once
+for all the shots:
+
+    >>> state = Combine(One(), Plus(), Zero())
+    >>> Measure.marginal(state, [1, 0])
+    tensor([0.0000, 0.5000, 0.0000, 0.5000])
+    >>> Measure.qubits(state, [0, 2], 5)
+    tensor([2, 2, 2, 2, 2])
+
+With collapse the measurement also gives the state left behind by each outcome. Here one shot of a Bell pair:
+
+    >>> bell = apply_on(Combine(Plus(), Zero()), CNOT, [0, 1])
+    >>> outcome, after = Measure.qubits(bell, 0, collapse=True)
+    >>> after.shape
+    torch.Size([1, 4, 1])
+    >>> Measure.one(after[0]) == 3 * outcome.item()
+    True
+
+The shots of the collapsed states form a batch, so feed-forward corrections are batched gates picked by the
+outcomes. Teleportation of a state from qubit 0 to qubit 2 over a thousand shots at once:
+
+    >>> message = apply(apply(Zero(), RY(1.2)), R(0.7))
+    >>> register = apply_on(apply_on(Combine(message, Zero(), Zero()), H, 1), CNOT, [1, 2])
+    >>> register = apply_on(apply_on(register, CNOT, [0, 1]), H, 0)
+    >>> outcomes, states = Measure.qubits(register, [0, 1], 1000, collapse=True)
+    >>> corrections = torch.stack([Identity(), PauliX()])[outcomes & 1]
+    >>> corrections = torch.stack([Identity(), PauliZ()])[outcomes >> 1] @ corrections
+    >>> states = apply_on(states, corrections, 2)
+    >>> torch.allclose(Measure.marginal(states, 2), Measure.marginal(message, 0).expand(1000, 2), atol=1e-6)
+    True
+    >>> expected = [Combine([Zero(), One()][outcome >> 1], [Zero(), One()][outcome & 1], message)
+    ...             for outcome in outcomes.tolist()]
+    >>> all(equal(state, target, atol=1e-5) for state, target in zip(states, expected))
+    True
+
+Batches of states are measured item by item:
+
+    >>> Measure.qubits(Batch(Combine(Zero(), One()), Combine(One(), One())), 1, 3)
+    tensor([[1, 1, 1],
+            [1, 1, 1]])
+
     """
     def __init__(self):
         pass
@@ -113,10 +179,122 @@ class _Measure:
     def one(q_bit: torch.Tensor) -> int:
         """Gets a random value according the quantum state weights"""
 
-        return random.choices(range(len(q_bit)), (q_bit * q_bit).real, k=1)[0]
+        result = Measure.sample(q_bit, 1)[..., 0]
+        if result.dim() == 0:
+            return result.item()
+        return result
+
+    @staticmethod
+    def sample(state: torch.Tensor, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots basis state indices at once, the result has the shape (..., shots)"""
+
+        if not isinstance(state, torch.Tensor):
+            # states kept outside of the memory sample themselves
+            return state.sample(shots, generator)
+        return _draw(state[..., 0].abs().square(), shots, generator)
+
+    @staticmethod
+    def counts(state: torch.Tensor, shots: int, generator: torch.Generator = None):
+        """Draws shots results and counts them per bit string, a batch gives a list of histograms"""
+
+        n = state.shape[-2].bit_length() - 1
+        samples = Measure.sample(state, shots, generator)
+
+        def histogram(indices):
+            values, counts = torch.unique(indices, return_counts=True)
+            return {format(value, '0%db' % n): count for value, count in zip(values.tolist(), counts.tolist())}
+
+        if samples.dim() == 1:
+            return histogram(samples)
+        return [histogram(indices) for indices in samples.reshape(-1, shots)]
+
+    @staticmethod
+    def marginal(state: torch.Tensor, targets) -> torch.Tensor:
+        """The probabilities of the values of the target qubits, of shape (..., 2^k), the first target highest"""
+        targets = [targets] if isinstance(targets, int) else list(targets)
+        n = state.shape[-2].bit_length() - 1
+        batch = state.shape[:-2]
+        probabilities = state[..., 0].abs().square().reshape(*batch, *[2] * n)
+        others = [len(batch) + qubit for qubit in range(n) if qubit not in targets]
+        if others:
+            probabilities = probabilities.sum(dim=others)
+        # the remaining axes are in the order of the qubits, put them in the order of the targets
+        order = sorted(targets)
+        probabilities = probabilities.permute(*range(len(batch)), *[len(batch) + order.index(target) for target in targets])
+        return probabilities.reshape(*batch, 2**len(targets))
+
+    @staticmethod
+    def qubits(state: torch.Tensor, targets, shots: int = 1, generator: torch.Generator = None,
+               collapse: bool = False):
+        """Measures the target qubits only, the outcomes have the shape (..., shots) with the first target highest
+
+With collapse the states after each outcome come along, normalized, as a batch of shape (..., shots, 2^n, 1)
+        """
+        targets = [targets] if isinstance(targets, int) else list(targets)
+        outcomes = _draw(Measure.marginal(state, targets), shots, generator)
+        if not collapse:
+            return outcomes
+        n = state.shape[-2].bit_length() - 1
+        k = len(targets)
+        batch = state.shape[:-2]
+        axes = [len(batch) + target for target in targets]
+        front = list(range(len(batch), len(batch) + k))
+        tensor = torch.movedim(state.reshape(*batch, *[2] * n), axes, front).reshape(*batch, 1, 2**k, -1)
+        tensor = tensor.expand(*batch, shots, *tensor.shape[-2:])
+        index = outcomes[..., None, None].expand(*outcomes.shape, 1, tensor.shape[-1])
+        picked = torch.gather(tensor, -2, index)
+        picked = picked / torch.linalg.vector_norm(picked, dim=-1, keepdim=True)
+        collapsed = torch.zeros_like(tensor).scatter_(-2, index, picked)
+        collapsed = collapsed.reshape(*batch, shots, *[2] * n)
+        offset = len(batch) + 1
+        collapsed = torch.movedim(collapsed, [offset + axis for axis in range(k)], [offset + target for target in targets])
+        return outcomes, collapsed.reshape(*batch, shots, 2**n, 1)
 
 Measure = _Measure()
 
+def _draw(probabilities: torch.Tensor, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+    """Draws shots indices from the probabilities of the last dimension"""
+    cumulative = torch.cumsum(probabilities.double(), dim=-1)
+    draws = torch.rand(*cumulative.shape[:-1], shots, dtype=cumulative.dtype, device=cumulative.device,
+                       generator=generator)
+    draws *= cumulative[..., -1:]
+    return torch.searchsorted(cumulative, draws, right=True).clamp_(max=cumulative.shape[-1] - 1)
+
+def Batch(*states: torch.Tensor, size: int = 1) -> torch.Tensor:
+    """Stack states into a batch of shape (B, 2^n, 1), repeating the stack size times.
+
+The batch is just a leading dimension on top of the usual column state, so the
+functions in here and in the gate module handle all the states at once.
+
+    >>> Batch(Zero(), One())
+    tensor([[[1.+0.j],
+             [0.+0.j]],
+    <BLANKLINE>
+            [[0.+0.j],
+             [1.+0.j]]])
+    >>> Batch(Plus(), size=1000).shape
+    torch.Size([1000, 2, 1])
+
+    """
+    return torch.stack(states).repeat(size, 1, 1)
+
+def _kron(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    """Kronecker product of the last two dimensions, broadcasting over the leading batch dimensions"""
+    if x.dim() == 2 and y.dim() == 2:
+        return torch.kron(x, y)
+    batch = torch.broadcast_shapes(x.shape[:-2], y.shape[:-2])
+    product = x[..., :, None, :, None] * y[..., None, :, None, :]
+    return product.reshape(*batch, x.shape[-2] * y.shape[-2], x.shape[-1] * y.shape[-1])
+
+def _combine_flops(*states: torch.Tensor) -> int:
+    """Estimate of the real floating point operations of Combine, a complex product per amplitude of each step"""
+    size, flops = states[0].numel(), 0
+    for state in states[1:]:
+        size *= state.numel()
+        flops += 6 * size
+    return flops
+
+@Tracer.traced('Combine', _combine_flops)
 def Combine(x, y, *rest):
     """Use Kronecker product of two arrays to combine qubits.
 
@@ -155,13 +333,19 @@ Each row represents the probability of getting it's index's value as a result
     >>> Measure.one( Combine(One(), Combine(Zero(),Zero())) )
     4
 
+Batches are combined item by item and single states are broadcast over the batch:
+
+    >>> Measure.one(Combine(Batch(Zero(), One()), One(), Batch(One(), Zero())))
+    tensor([3, 6])
+
     """
-    if len(rest) == 0:
-        return torch.kron(x, y)
-    return Combine(torch.kron(x, y), *rest)
+    state = _kron(x, y)
+    for other in rest:
+        state = _kron(state, other)
+    return state
 
 
-def equal(x: torch.Tensor, y: torch.Tensor, atol=1e-10) -> bool:
+def equal(x: torch.Tensor, y: torch.Tensor, atol: float = None) -> bool:
     """The equal is a test if the two qubit states
 
     >>> equal(One(), One())
@@ -169,8 +353,26 @@ def equal(x: torch.Tensor, y: torch.Tensor, atol=1e-10) -> bool:
     >>> equal(One(), Zero())
     False
 
+Without atol the tolerance follows the precision of the states, which is looser for complex64 than for complex128:
+
+    >>> import torch
+    >>> equal(apply(apply(Plus(), H), H), Plus())
+    True
+    >>> equal(One(dtype=torch.complex128) + 1e-8, One(dtype=torch.complex128))
+    False
+
+Batches are compared item by item:
+
+    >>> equal(Batch(One(), Zero()), Batch(One(), One()))
+    tensor([ True, False])
+
     """
 
     # maybe there is a np shorthand for this,
     # but at least i can change it from one place if this does not work well
-    return (torch.linalg.norm(x - y) < atol).item()
+    if atol is None:
+        atol = Precision.tolerance(torch.promote_types(x.dtype, y.dtype))
+    close = torch.linalg.norm(x - y, dim=(-2, -1)) < atol
+    if close.dim() == 0:
+        return close.item()
+    return close
@@ -0,0 +1,179 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Registers kept as products of independent qubit clusters
+"""
+
+import typing
+import torch
+from .convert import Precision
+from .qbit import Measure, _kron
+from .gate import SWAP, apply_on
+from .pauli_group import PauliString
+from .expectation import expectation, _letters
+
+
+class Register:
+    """Register keeps the qubits as clusters with a small state vector each, until gates entangle them
+
+Every qubit starts in a cluster of its own, so building the register and the gates on single qubits cost
+nothing of the size of the whole register:
+
+    >>> register = Register.combine(One(), Zero(), Plus(), Zero())
+    >>> register
+    Register(4, clusters=[(0,), (1,), (2,), (3,)])
+    >>> _ = register.apply(H, 1).apply(PauliX, 3)
+    >>> register.clusters
+    [(0,), (1,), (2,), (3,)]
+
+A gate spanning several clusters merges them with a Kronecker product first. SWAP only exchanges the
+labels of its qubits:
+
+    >>> _ = register.apply(CNOT, 1, 3).apply(SWAP, 0, 2)
+    >>> register.clusters
+    [(2,), (1, 3), (0,)]
+    >>> register.dense().shape
+    torch.Size([16, 1])
+
+The results are the same as with the full state vector:
+
+    >>> circuit = Circuit(5).add(H, 0).add(CNOT, 0, 3).add(RY(0.4), 4).add(SWAP, 3, 1).add(Toffoli, 4, 1, 2)
+    >>> expected = circuit.run(Combine(Plus(), Zero(), One(), Minus(), Plus()))
+    >>> lazy = circuit.run(Register.combine(Plus(), Zero(), One(), Minus(), Plus()))
+    >>> lazy.clusters
+    [(0, 1, 2, 4), (3,)]
+    >>> equal(lazy.dense(), expected, atol=1e-6)
+    True
+
+Each cluster is measured on its own, and the expectation values of Pauli strings are products over the
+clusters:
+
+    >>> import torch
+    >>> sorted(Measure.counts(Circuit(3).add(H, 0).add(CNOT, 0, 1).run(Register.zeros(3)), 100))
+    ['000', '110']
+    >>> torch.allclose(lazy.expectation(['ZZIXI', 'XIZYZ']), expectation(expected, ['ZZIXI', 'XIZYZ']), atol=1e-6)
+    True
+
+A wide register of independent qubits never needs its 2^n amplitudes:
+
+    >>> wide = Register.zeros(200).apply(PauliX, 7).apply(H, 100)
+    >>> bits = wide.sample_bits(1000, generator=torch.Generator().manual_seed(0))
+    >>> bits[:, 7].all().item(), abs(bits[:, 100].double().mean().item() - 0.5) < 0.1
+    (True, True)
+
+    """
+
+    def __init__(self, clusters: typing.List[tuple]):
+        # each cluster is the tuple of its qubits and the state vector over them, in that order
+        self._clusters = [(tuple(qubits), state) for qubits, state in clusters]
+        self.n = sum(len(qubits) for qubits, _ in self._clusters)
+
+    def __repr__(self):
+        return 'Register(%d, clusters=%s)' % (self.n, self.clusters)
+
+    @property
+    def shape(self) -> tuple:
+        return (2**self.n, 1)
+
+    @property
+    def clusters(self) -> typing.List[tuple]:
+        """The qubits of each cluster"""
+        return [qubits for qubits, _ in self._clusters]
+
+    @staticmethod
+    def zeros(n: int, dtype: torch.dtype = None) -> 'Register':
+        """The all zero register"""
+        return Register.combine(*[torch.tensor([[1], [0]])] * n, dtype=dtype)
+
+    @staticmethod
+    def combine(*qubits: torch.Tensor, dtype: torch.dtype = None) -> 'Register':
+        """The product of single qubit states, each in a cluster of its own"""
+        dtype, device = Precision.resolve(dtype)
+        return Register([((qubit,), state.to(dtype=dtype, device=device).reshape(2, 1))
+                         for qubit, state in enumerate(qubits)])
+
+    def _cluster(self, qubit: int) -> int:
+        for index, (qubits, _) in enumerate(self._clusters):
+            if qubit in qubits:
+                return index
+        raise ValueError('invalid target %d for a register of %d qubits' % (qubit, self.n))
+
+    def apply(self, gate, *targets: int) -> 'Register':
+        """Apply a gate on the targets, merging their clusters if there are several, returns the register"""
+        if getattr(gate, 'kind', None) == 'channel':
+            raise ValueError('%s is a noise channel, it needs a density matrix from evolve' % gate)
+        if gate is SWAP:
+            # the qubits just trade their places
+            first, second = targets
+            self._clusters = [(tuple(second if qubit == first else first if qubit == second else qubit
+                                     for qubit in qubits), state) for qubits, state in self._clusters]
+            return self
+        indices = sorted({self._cluster(target) for target in targets})
+        if len(indices) > 1:
+            merged_qubits, merged = (), None
+            for index in indices:
+                qubits, state = self._clusters[index]
+                merged_qubits += qubits
+                merged = state if merged is None else _kron(merged, state)
+            self._clusters = [cluster for index, cluster in enumerate(self._clusters) if index not in indices[1:]]
+            self._clusters[indices[0]] = (merged_qubits, merged)
+        qubits, state = self._clusters[indices[0]]
+        self._clusters[indices[0]] = (qubits, apply_on(state, gate, [qubits.index(target) for target in targets]))
+        return self
+
+    def run(self, circuit) -> 'Register':
+        """Apply the gates of a circuit in order"""
+        for gate, targets in circuit:
+            self.apply(gate, *targets)
+        return self
+
+    def dense(self) -> torch.Tensor:
+        """The full state vector of 2^n amplitudes"""
+        order, state = (), None
+        for qubits, cluster in self._clusters:
+            order += qubits
+            state = cluster if state is None else _kron(state, cluster)
+        axes = [order.index(qubit) for qubit in range(self.n)]
+        return state.reshape(*[2] * self.n).permute(axes).reshape(-1, 1)
+
+    def sample_bits(self, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots results as bits of shape (shots, n), every cluster independently"""
+        bits = torch.zeros(shots, self.n, dtype=torch.bool)
+        for qubits, state in self._clusters:
+            indices = Measure.sample(state, shots, generator)
+            for position, qubit in enumerate(qubits):
+                bits[:, qubit] = (indices >> (len(qubits) - 1 - position) & 1).bool()
+        return bits
+
+    def sample(self, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots basis state indices like Measure.sample, for registers of up to 63 qubits"""
+        if self.n > 63:
+            raise ValueError('the indices of %d qubits do not fit into int64, use sample_bits' % self.n)
+        bits = self.sample_bits(shots, generator).long()
+        return (bits << torch.arange(self.n - 1, -1, -1)).sum(-1)
+
+    def expectation(self, paulis) -> torch.Tensor:
+        """Expectation values of Hermitian Pauli strings like expectation, as products of the cluster values"""
+        single = isinstance(paulis, (str, PauliString))
+        strings = [PauliString.from_label(pauli) if isinstance(pauli, str) else pauli
+                   for pauli in ([paulis] if single else paulis)]
+        letters, signs = [], []
+        for string in strings:
+            if string.n != self.n:
+                raise ValueError('%s does not act on %d qubits' % (string, self.n))
+            sign = (string.phase - (string.x & string.z).bit_count()) % 4
+            if sign % 2:
+                raise ValueError('%s is not Hermitian' % string)
+            letters.append(_letters(string))
+            signs.append(1 - sign)
+        values = torch.tensor(signs, dtype=Precision.real(self._clusters[0][1].dtype))
+        for qubits, state in self._clusters:
+            # the strings restricted to the cluster, the ones acting as identity on it are skipped
+            acting = [index for index, string in enumerate(letters) if any(qubit in string for qubit in qubits)]
+            if acting:
+                labels = [''.join(letters[index].get(qubit, 'I') for qubit in qubits) for index in acting]
+                values[acting] *= expectation(state, labels).to(values.device)
+        if single:
+            return values[0]
+        return values
@@ -0,0 +1,313 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+State vectors split across processes with torch.distributed
+"""
+
+import os
+import queue
+import pickle
+import typing
+import tempfile
+import traceback
+import multiprocessing
+import torch
+import torch.distributed as dist
+from .convert import Precision
+from .gate import Diagonal, apply_on
+from .pauli_group import PauliString
+from .expectation import _basis_change, _groups, _letters
+
+# seconds between the checks for workers which exited without a result
+_POLL = 0.5
+
+
+def launch(function: typing.Callable, processes: int, *args) -> list:
+    """Run function(*args) in forked worker processes joined into a gloo process group, returns the results by rank
+
+    >>> import os
+    >>> import torch
+    >>> import torch.distributed as dist
+    >>> launch(lambda: dist.get_rank() * 10, 3)
+    [0, 10, 20]
+
+A worker dying without a result, killed or exited, stops the others instead of leaving the caller waiting:
+
+    >>> launch(lambda: os._exit(3) if dist.get_rank() == 1 else 0, 2)
+    Traceback (most recent call last):
+    ...
+    RuntimeError: process 1 exited with the code 3 before returning a result
+
+    """
+    context = multiprocessing.get_context('fork')
+    results_queue = context.Queue()
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    os.remove(path)
+    workers = [context.Process(target=_worker, args=(function, args, rank, processes, 'file://' + path, results_queue))
+               for rank in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        results = _collect(workers, results_queue)
+    except RuntimeError:
+        # the other workers may be waiting for the failed one in a collective
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+        if os.path.exists(path):
+            os.remove(path)
+    return [results[rank] for rank in range(processes)]
+
+
+def _collect(workers: list, results_queue) -> dict:
+    """The results of the workers by rank, raising as soon as one fails or exits without a result"""
+    results, exited = {}, set()
+    while len(results) < len(workers):
+        try:
+            rank, result = results_queue.get(timeout=_POLL)
+        except queue.Empty:
+            missing = {rank for rank, worker in enumerate(workers) if rank not in results and worker.exitcode is not None}
+            # a result put just before the exit may still be in the pipe, so the worker gets one more round
+            dead = sorted(missing & exited)
+            if dead:
+                raise RuntimeError('process %d exited with the code %d before returning a result'
+                                   % (dead[0], workers[dead[0]].exitcode))
+            exited = missing
+            continue
+        results[rank] = pickle.loads(result)
+        if isinstance(results[rank], _Failure):
+            raise RuntimeError('process %d failed:\n%s' % (rank, results[rank].message))
+    return results
+
+
+class _Failure:
+    def __init__(self, message: str):
+        self.message = message
+
+
+def _worker(function, args, rank, processes, init_method, queue):
+    torch.set_num_threads(1)
+    try:
+        dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=processes)
+        result = function(*args)
+    except Exception:
+        result = _Failure(traceback.format_exc())
+    finally:
+        if dist.is_initialized():
+            dist.destroy_process_group()
+    # pickled by value, the tensors shared through file descriptors would not outlive the process
+    queue.put((rank, pickle.dumps(result)))
+
+
+class ShardedState:
+    """ShardedState splits the amplitudes of n qubits evenly across the processes of a torch.distributed group
+
+Every process holds the amplitudes of one value of the first g qubits, the global qubits, with 2^g processes.
+Gates on the other, local, qubits run without any communication and so do diagonal gates on any qubits.
+A gate on a global qubit first swaps it with a free local qubit, the two processes differing in it exchanging
+half of their amplitudes. The qubits are left in their new places, so only the order of the qubits is tracked:
+
+    >>> def simulate():
+    ...     state = ShardedState.combine(Zero(), Plus(), One(), Zero(), Minus(), Plus())
+    ...     circuit = Circuit(6).add(H, 0).add(CNOT, 0, 5).add(R(0.3), 1).add(Toffoli, 5, 1, 0).add(SWAP, 2, 3)
+    ...     circuit.run(state)
+    ...     return repr(state), state.tensor(), state.exchanges
+    >>> results = launch(simulate, 4)
+    >>> results[0][0]
+    'ShardedState(6, processes=4)'
+    >>> circuit = Circuit(6).add(H, 0).add(CNOT, 0, 5).add(R(0.3), 1).add(Toffoli, 5, 1, 0).add(SWAP, 2, 3)
+    >>> expected = circuit.run(Combine(Zero(), Plus(), One(), Zero(), Minus(), Plus()))
+    >>> all(equal(tensor, expected) for _, tensor, _ in results)
+    True
+    >>> [exchanges for _, _, exchanges in results]
+    [4, 4, 4, 4]
+
+A gate needs all its qubits local at once, so it can span at most the n - g local qubits:
+
+    >>> def toffoli():
+    ...     try:
+    ...         ShardedState.zeros(3).apply(Toffoli, 0, 1, 2)
+    ...     except ValueError as error:
+    ...         return str(error)
+    >>> launch(toffoli, 2)[0]
+    'CCX acts on 3 qubits, but 2 processes leave 2 of the 3 qubits local'
+
+Measurements and expectation values are reduced across the processes, so every process gets the same results:
+
+    >>> def measure():
+    ...     state = ShardedState.zeros(8)
+    ...     Circuit(8).add(H, 0).add(CNOT, 0, 1).add(CNOT, 1, 7).add(PauliX, 3).run(state)
+    ...     shots = Measure.counts(state, 1000, generator=torch.Generator().manual_seed(dist.get_rank()))
+    ...     return sorted(shots), state.expectation(['ZZIIIIII', 'XXIIIIIX', 'IIIZIIII', 'ZIIIIIIZ'])
+    >>> results = launch(measure, 2)
+    >>> results[0]
+    (['00010000', '11010001'], tensor([ 1.0000,  1.0000, -1.0000,  1.0000]))
+    >>> results[0][0] == results[1][0] and bool(torch.equal(results[0][1], results[1][1]))
+    True
+
+    """
+
+    def __init__(self, n: int, local: torch.Tensor, layout: typing.List[int] = None):
+        self.n = n
+        self.processes = dist.get_world_size()
+        self.rank = dist.get_rank()
+        self.g = self.processes.bit_length() - 1
+        if 2**self.g != self.processes or self.g > n:
+            raise ValueError('%d processes can not split %d qubits evenly' % (self.processes, n))
+        self.local = local
+        # the position of each qubit in the index of the amplitudes, the first g positions are the global ones
+        self.layout = list(range(n)) if layout is None else layout
+        self.exchanges = 0
+
+    def __repr__(self):
+        return 'ShardedState(%d, processes=%d)' % (self.n, self.processes)
+
+    @property
+    def shape(self) -> torch.Size:
+        return torch.Size([2**self.n, 1])
+
+    @staticmethod
+    def zeros(n: int, dtype: torch.dtype = None) -> 'ShardedState':
+        """The all zero register"""
+        return ShardedState.combine(*[torch.tensor([[1], [0]])] * n, dtype=dtype)
+
+    @staticmethod
+    def combine(*qubits: torch.Tensor, dtype: torch.dtype = None) -> 'ShardedState':
+        """The product of single qubit states, each process building its own part only"""
+        dtype, device = Precision.resolve(dtype)
+        qubits = [qubit.to(dtype=dtype, device=device).reshape(2) for qubit in qubits]
+        n = len(qubits)
+        g = dist.get_world_size().bit_length() - 1
+        rank = dist.get_rank()
+        local = torch.ones(1, dtype=dtype, device=device)
+        for position, qubit in enumerate(qubits[:g]):
+            local = local * qubit[rank >> (g - 1 - position) & 1]
+        for qubit in qubits[g:]:
+            local = torch.kron(local, qubit)
+        return ShardedState(n, local.reshape(-1, 1))
+
+    def _bit(self, position: int) -> int:
+        """The bit of this process at a global position"""
+        return self.rank >> (self.g - 1 - position) & 1
+
+    def _swap(self, position: int, free: int):
+        """Exchange the global position with the local one, in place"""
+        partner = self.rank ^ 1 << (self.g - 1 - position)
+        bit = self._bit(position)
+        # the amplitudes where the two bits differ change the process, that is half of the local ones
+        blocks = self.local.reshape(2**(free - self.g), 2, -1)
+        outgoing = blocks[:, 1 - bit].contiguous()
+        incoming = torch.empty_like(outgoing)
+        requests = dist.batch_isend_irecv([dist.P2POp(dist.isend, torch.view_as_real(outgoing), partner),
+                                           dist.P2POp(dist.irecv, torch.view_as_real(incoming), partner)])
+        for request in requests:
+            request.wait()
+        blocks[:, 1 - bit] = incoming
+        for qubit, place in enumerate(self.layout):
+            if place == position:
+                self.layout[qubit] = free
+            elif place == free:
+                self.layout[qubit] = position
+        self.exchanges += 1
+
+    def apply(self, gate, *targets: int) -> 'ShardedState':
+        """Apply a gate on the targets, returns the state for chaining"""
+        positions = [self.layout[target] for target in targets]
+        if getattr(gate, 'kind', None) == 'diagonal' and any(position < self.g for position in positions):
+            # the global bits are fixed in this process, so they just pick a part of the diagonal
+            phases = gate.diagonal(self.local.dtype, self.local.device).reshape(*[2] * len(targets))
+            index = tuple(self._bit(position) if position < self.g else slice(None) for position in positions)
+            local = [position - self.g for position in positions if position >= self.g]
+            if local:
+                self.local = apply_on(self.local, Diagonal(phases[index].reshape(-1)), local)
+            else:
+                self.local = self.local * phases[index]
+            return self
+        if len(positions) > self.n - self.g:
+            # every target has to be local, and a global one is swapped with a local qubit outside the targets
+            raise ValueError('%s acts on %d qubits, but %d processes leave %d of the %d qubits local'
+                             % (gate, len(positions), self.processes, self.n - self.g, self.n))
+        used = set(positions)
+        for index, position in enumerate(positions):
+            if position < self.g:
+                free = max(place for place in range(self.g, self.n) if place not in used)
+                self._swap(position, free)
+                used.add(free)
+                positions[index] = free
+        self.local = apply_on(self.local, gate, [position - self.g for position in positions])
+        return self
+
+    def run(self, circuit) -> 'ShardedState':
+        """Apply the gates of a circuit in order"""
+        for gate, targets in circuit:
+            self.apply(gate, *targets)
+        return self
+
+    def _indices(self) -> torch.Tensor:
+        """The register indices of the local amplitudes"""
+        physical = self.rank * len(self.local) + torch.arange(len(self.local), device=self.local.device)
+        indices = torch.zeros_like(physical)
+        for qubit, position in enumerate(self.layout):
+            indices |= (physical >> (self.n - 1 - position) & 1) << (self.n - 1 - qubit)
+        return indices
+
+    def tensor(self) -> torch.Tensor:
+        """The whole state gathered to every process"""
+        parts = [torch.empty_like(torch.view_as_real(self.local)) for _ in range(self.processes)]
+        dist.all_gather(parts, torch.view_as_real(self.local).contiguous())
+        state = torch.view_as_complex(torch.cat(parts)).reshape(*[2] * self.n)
+        return state.permute(self.layout).reshape(-1, 1)
+
+    def sample(self, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """Draws shots basis state indices, the draws of the first process are used by all"""
+        probabilities = self.local[:, 0].abs().square().double()
+        totals = [torch.zeros(1, dtype=torch.float64) for _ in range(self.processes)]
+        dist.all_gather(totals, probabilities.sum().reshape(1))
+        cumulative = torch.cumsum(torch.cat(totals), dim=0)
+        draws = torch.rand(shots, dtype=torch.float64, generator=generator) * cumulative[-1]
+        dist.broadcast(draws, 0)
+        owners = torch.searchsorted(cumulative, draws, right=True).clamp_(max=self.processes - 1)
+        mine = owners == self.rank
+        offset = cumulative[self.rank - 1] if self.rank > 0 else 0
+        found = torch.searchsorted(torch.cumsum(probabilities, dim=0), draws[mine] - offset, right=True)
+        samples = torch.zeros(shots, dtype=torch.int64)
+        samples[mine] = self._indices()[found.clamp_(max=len(probabilities) - 1)]
+        dist.all_reduce(samples)
+        return samples
+
+    def expectation(self, paulis) -> torch.Tensor:
+        """Expectation values of Hermitian Pauli strings like expectation, summed over the processes"""
+        single = isinstance(paulis, (str, PauliString))
+        strings = [PauliString.from_label(pauli) if isinstance(pauli, str) else pauli
+                   for pauli in ([paulis] if single else paulis)]
+        values = torch.zeros(len(strings), dtype=torch.float64)
+        for members in _groups(strings):
+            rotated = ShardedState(self.n, self.local.clone(), list(self.layout))
+            bases = {}
+            for member in members:
+                bases.update(_letters(strings[member]))
+            for qubit, letter in bases.items():
+                if letter != 'Z':
+                    rotated.apply(_basis_change(letter, self.local.dtype, self.local.device), qubit)
+            self.exchanges += rotated.exchanges
+            probabilities = rotated.local[:, 0].abs().square().double()
+            rotated_indices = rotated._indices()
+            for member in members:
+                string = strings[member]
+                sign = (string.phase - (string.x & string.z).bit_count()) % 4
+                if sign % 2:
+                    raise ValueError('%s is not Hermitian' % string)
+                parity = torch.zeros_like(rotated_indices)
+                for qubit in _letters(string):
+                    parity ^= rotated_indices >> (self.n - 1 - qubit) & 1
+                values[member] = (1 - sign) * torch.dot(probabilities, (1 - 2 * parity).double())
+        dist.all_reduce(values)
+        values = values.to(Precision.real(self.local.dtype))
+        if single:
+            return values[0]
+        return values
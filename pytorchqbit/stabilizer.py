@@ -6,10 +6,24 @@ Quantum error correction code.
 """
 
 import typing
-from itertools import product
-from functools import reduce
 import torch
-from .gate import (PauliX, PauliY, PauliZ, Identity, apply)
+from .convert import CONSTANTS, Precision
+from .pauli_group import PauliString
+from .expectation import expectation
+
+_LABELS = ['XZZXI', 'IXZZX', 'XIXZZ', 'ZXIXZ']
+
+# the bit q of a string is the bit 4 - q of a state index
+_REVERSED = [int(format(mask, '05b')[::-1], 2) for mask in range(32)]
+
+# shots of the Monte-Carlo simulation handled at once
+_CHUNK = 2**20
+
+
+def _parity(masks: torch.Tensor) -> torch.Tensor:
+    """The parity of the set bits of each five bit mask"""
+    return (masks ^ masks >> 1 ^ masks >> 2 ^ masks >> 3 ^ masks >> 4) & 1
+
 
 class _S_5_1_3:
     """S_5_1_3 error correction code encodes one logical qubit into five physical qubits.
@@ -18,21 +32,69 @@ class _S_5_1_3:
     >>> S_5_1_3
     S_5_1_3
 
-    >>> S_5_1_3.g1()
-    tensor([[ 0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j],
-            [ 1.+0.j,  0.+0.j,  0.+0.j, -1.+0.j,  0.+0.j, -1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j]])
-
-    >>> S_5_1_3.g2()
-    tensor([[ 1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j],
-            [ 0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j, -1.+0.j,  0.+0.j, -1.+0.j,  1.+0.j,  0.+0.j]])
-
-    >>> S_5_1_3.g3()
-    tensor([[ 0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  1.+0.j,  0.+0.j],
-            [ 1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j, -1.+0.j,  0.+0.j, -1.+0.j]])
-
-    >>> S_5_1_3.g4()
-    tensor([[ 1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j],
-            [ 0.+0.j, -1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j,  1.+0.j,  1.+0.j,  0.+0.j,  0.+0.j, -1.+0.j]])
+The generators are commuting operators on the five qubits, and they square to the identity:
+
+    >>> import torch
+    >>> S_5_1_3.g1().shape
+    torch.Size([32, 32])
+    >>> g = [S_5_1_3.g1(), S_5_1_3.g2(), S_5_1_3.g3(), S_5_1_3.g4()]
+    >>> all(torch.equal(a @ b, b @ a) for a in g for b in g)
+    True
+    >>> all(torch.equal(a @ a, Identity(5)) for a in g)
+    True
+
+The generators and the logical operators as compact Pauli strings:
+
+    >>> S_5_1_3.generators()
+    [+XZZXI, +IXZZX, +XIXZZ, +ZXIXZ]
+    >>> S_5_1_3.logical_x(), S_5_1_3.logical_z()
+    (+XXXXX, +ZZZZZ)
+
+The encoder maps a logical qubit, or a batch of them, into the code space where every generator gives +1:
+
+    >>> logical = apply(Plus(), R(0.3))
+    >>> code_word = S_5_1_3.encode(logical)
+    >>> code_word.shape
+    torch.Size([32, 1])
+    >>> S_5_1_3.syndrome(code_word)
+    0
+    >>> equal(S_5_1_3.decode(code_word), logical, atol=1e-6)
+    True
+    >>> equal(apply(S_5_1_3.encode(One()), S_5_1_3.logical_z()()), -S_5_1_3.encode(One()), atol=1e-6)
+    True
+
+Each of the 15 single qubit errors has its own syndrome, the bit i telling that the error anticommutes
+with the generator i. The lookup table gives the correction for each syndrome:
+
+    >>> error = PauliString.from_label('IIYII')
+    >>> S_5_1_3.syndrome(apply(code_word, error()))
+    7
+    >>> S_5_1_3.lookup()[7]
+    +IIYII
+    >>> len(set(S_5_1_3.lookup()))
+    16
+
+The correction measures the syndrome and undoes the error, item by item for a batch:
+
+    >>> errors = [PauliString.from_label(label)() for label in ['IIIII', 'XIIII', 'IIYII', 'IIIIZ']]
+    >>> damaged = torch.stack([apply(code_word, error) for error in errors])
+    >>> S_5_1_3.syndrome(damaged)
+    tensor([0, 8, 7, 2])
+    >>> equal(S_5_1_3.correct(damaged), code_word, atol=1e-6)
+    tensor([True, True, True, True])
+
+The Monte-Carlo simulation injects depolarizing errors, where each qubit gets X, Y or Z with the
+probability p / 3 each, and runs the whole syndrome and correction loop as bit operations over the shots.
+It gives the rate of the logical errors left after the correction, for one or many physical error rates:
+
+    >>> generator = torch.Generator().manual_seed(0)
+    >>> S_5_1_3.logical_error_rate(0.0, 1000)
+    tensor(0., dtype=torch.float64)
+    >>> rates = S_5_1_3.logical_error_rate(torch.tensor([0.01, 0.1, 0.5]), 1000000, generator=generator)
+    >>> rates.shape
+    torch.Size([3])
+    >>> bool(rates[0] < 0.01 and rates[1] < 0.1 and rates[2] > 0.5)
+    True
 
     """
 
@@ -40,24 +102,145 @@ class _S_5_1_3:
         pass
 
     @staticmethod
-    def g1() -> torch.Tensor:
-        return torch.hstack([PauliX(), PauliZ(), PauliZ(), PauliX(), Identity()])
+    def g1(dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return PauliString.from_label(_LABELS[0])(dtype, device)
+
+    @staticmethod
+    def g2(dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return PauliString.from_label(_LABELS[1])(dtype, device)
+
+    @staticmethod
+    def g3(dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return PauliString.from_label(_LABELS[2])(dtype, device)
+
+    @staticmethod
+    def g4(dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        return PauliString.from_label(_LABELS[3])(dtype, device)
+
+    @staticmethod
+    def generators() -> typing.List[PauliString]:
+        return [PauliString.from_label(label) for label in _LABELS]
+
+    @staticmethod
+    def logical_x() -> PauliString:
+        return PauliString.from_label('XXXXX')
+
+    @staticmethod
+    def logical_z() -> PauliString:
+        return PauliString.from_label('ZZZZZ')
+
+    @staticmethod
+    def code_words(dtype: torch.dtype = None, device=None) -> torch.Tensor:
+        """The logical zero and one as the columns of a 32 x 2 matrix"""
+        def build():
+            # projecting |00000> to the code space gives the logical zero, as ZZZZZ commutes with the generators
+            zero = torch.zeros(32, 1, dtype=Precision.dtype)
+            zero[0] = 1
+            for generator in S_5_1_3.generators():
+                zero = (zero + torch.matmul(generator(), zero)) / 2
+            zero = zero / torch.linalg.norm(zero)
+            return torch.hstack([zero, torch.matmul(S_5_1_3.logical_x()(), zero)])
+        return CONSTANTS('S_5_1_3', build, dtype, device)
+
+    @staticmethod
+    def encode(state: torch.Tensor) -> torch.Tensor:
+        """Encode a logical qubit of shape (..., 2, 1) into a code word of shape (..., 32, 1)"""
+        return torch.matmul(S_5_1_3.code_words(state.dtype, state.device), state)
+
+    @staticmethod
+    def decode(state: torch.Tensor) -> torch.Tensor:
+        """The logical qubit of a code word, the inverse of encode"""
+        return torch.matmul(S_5_1_3.code_words(state.dtype, state.device).mH, state)
+
+    @staticmethod
+    def syndrome(state: torch.Tensor):
+        """The syndrome of a code word hit by Pauli errors, an int for a single state and a tensor for a batch"""
+        values = expectation(state, S_5_1_3.generators())
+        bits = (values < 0).long()
+        syndrome = (bits << torch.arange(4, device=bits.device)).sum(dim=-1)
+        if syndrome.dim() == 0:
+            return syndrome.item()
+        return syndrome
+
+    @staticmethod
+    def lookup() -> typing.List[PauliString]:
+        """The correction for each of the 16 syndromes, the identity or a single qubit Pauli"""
+        table = [PauliString(5)] * 16
+        for qubit in range(5):
+            for letter in 'XYZ':
+                error = PauliString.from_label('I' * qubit + letter + 'I' * (4 - qubit))
+                syndrome = sum(int(not error.commutes(generator)) << index
+                               for index, generator in enumerate(S_5_1_3.generators()))
+                table[syndrome] = error
+        return table
 
     @staticmethod
-    def g2() -> torch.Tensor:
-        return torch.hstack([Identity(), PauliX(), PauliZ(), PauliZ(), PauliX()])
+    def correct(state: torch.Tensor) -> torch.Tensor:
+        """Measure the syndrome and apply its correction, each item of a batch gets its own correction"""
+        syndrome = torch.as_tensor(S_5_1_3.syndrome(state), device=state.device)
+        table = S_5_1_3.lookup()
+        x = torch.tensor([_REVERSED[string.x] for string in table], device=state.device)[syndrome, None]
+        z = torch.tensor([_REVERSED[string.z] for string in table], device=state.device)[syndrome, None]
+        phase = torch.tensor([1j**string.phase for string in table], dtype=state.dtype,
+                             device=state.device)[syndrome, None]
+        # X**x Z**z moves the amplitude at index i ^ x to index i, with the sign of the Z:s on the index i ^ x
+        indices = torch.arange(32, device=state.device) ^ x
+        signs = 1 - 2 * _parity(indices & z)
+        amplitudes = torch.gather(state[..., 0], -1, indices.expand(*state.shape[:-1]))
+        return (phase * signs * amplitudes)[..., None]
 
     @staticmethod
-    def g3() -> torch.Tensor:
-        return torch.hstack([PauliX(), Identity(), PauliX(), PauliZ(), PauliZ()])
+    def _tables() -> typing.Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """The syndrome and the logical failure of every five qubit Pauli error, and the correction of every
+syndrome, with the errors packed as ten bit masks x | z << 5"""
+        def syndromes():
+            errors = torch.arange(1024)
+            ex, ez = errors & 31, errors >> 5
+            syndrome = torch.zeros(1024, dtype=torch.int64)
+            for index, generator in enumerate(S_5_1_3.generators()):
+                syndrome |= _parity(ex & generator.z ^ ez & generator.x) << index
+            return syndrome
+
+        def failures():
+            # with a zero syndrome the residual commutes with the generators, so it is a logical error exactly
+            # when it does not commute with both of the logical operators
+            errors = torch.arange(1024)
+            ex, ez = errors & 31, errors >> 5
+            logical_x, logical_z = S_5_1_3.logical_x(), S_5_1_3.logical_z()
+            return (_parity(ex & logical_z.z ^ ez & logical_z.x) | _parity(ex & logical_x.z ^ ez & logical_x.x))
+
+        def corrections():
+            return torch.tensor([string.x | string.z << 5 for string in S_5_1_3.lookup()])
+
+        return (CONSTANTS('S_5_1_3 syndromes', syndromes, dtype=torch.int64),
+                CONSTANTS('S_5_1_3 failures', failures, dtype=torch.int64),
+                CONSTANTS('S_5_1_3 corrections', corrections, dtype=torch.int64))
 
     @staticmethod
-    def g4() -> torch.Tensor:
-        return torch.hstack([PauliZ(), PauliX(), Identity(), PauliX(), PauliZ()])
+    def logical_error_rate(p, shots: int, generator: torch.Generator = None) -> torch.Tensor:
+        """The rate of logical errors after the correction of depolarizing errors with the probability p per qubit
+
+Every shot is a ten bit error mask, and its syndrome, correction and logical failure are table lookups done
+for all the shots at once. A tensor of probabilities gives a tensor of rates.
+        """
+        p = torch.as_tensor(p, dtype=torch.float32)[..., None, None]
+        syndromes, failures, corrections = S_5_1_3._tables()
+        weights = (1 << torch.arange(5)).to(torch.int16)
+
+        count = torch.zeros(p.shape[:-2], dtype=torch.int64)
+        for start in range(0, shots, _CHUNK):
+            size = min(_CHUNK, shots - start)
+            draws = torch.rand(*p.shape[:-2], size, 5, generator=generator)
+            # below p / 3 the error is X, then Y and then Z up to p
+            x = draws < 2 * p / 3
+            z = (draws >= p / 3) & (draws < p)
+            errors = (x * weights).sum(dim=-1, dtype=torch.int16) | (z * weights).sum(dim=-1, dtype=torch.int16) << 5
+            errors = errors.long()
+            residual = errors ^ corrections[syndromes[errors]]
+            count += failures[residual].sum(dim=-1)
+        return count.double() / shots
 
     def __repr__(self):
         return 'S_5_1_3'
 
-#NOT READY
 S_5_1_3 = _S_5_1_3()
-
@@ -0,0 +1,130 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Circuit templates evaluated over batches of angles, and their parameter-shift gradients
+"""
+
+import math
+import typing
+import torch
+from .circuit import Circuit
+from .expectation import expectation
+
+
+class Parameter:
+    """Parameter is a placeholder angle of a circuit template, the column index of the angles of a sweep
+
+    >>> Parameter(0)
+    p0
+    >>> Circuit(1).add(RY(Parameter(0)), 0).add(R(Parameter(1)), 0)
+    Circuit(1, [(RY(p0), (0,)), (R(p1), (0,))])
+
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def __repr__(self):
+        return 'p%d' % self.index
+
+
+def _occurrences(circuit: Circuit) -> typing.List[int]:
+    """The positions of the gates of the circuit which take their angle from a Parameter"""
+    return [position for position, (gate, _) in enumerate(circuit.operations)
+            if isinstance(getattr(gate, 'parameter', None), Parameter)]
+
+
+def _bind(circuit: Circuit, positions: typing.List[int], angles: torch.Tensor) -> Circuit:
+    """The circuit with the gate at positions[j] rebuilt with the batch of angles[..., j]"""
+    operations = list(circuit.operations)
+    for column, position in enumerate(positions):
+        gate, targets = operations[position]
+        operations[position] = (type(gate)(angles[..., column]), targets)
+    return Circuit(circuit.n, operations)
+
+
+def _columns(circuit: Circuit, positions: typing.List[int], angles: torch.Tensor) -> torch.Tensor:
+    indices = [circuit.operations[position][0].parameter.index for position in positions]
+    if indices and max(indices) >= angles.shape[-1]:
+        raise ValueError('the circuit has the parameter p%d but the angles have %d columns'
+                         % (max(indices), angles.shape[-1]))
+    return torch.tensor(indices, dtype=torch.int64, device=angles.device)
+
+
+def sweep(circuit: Circuit, angles: torch.Tensor, state: torch.Tensor = None) -> torch.Tensor:
+    """The states of a circuit template at each row of an angle tensor of shape (B, parameters)
+
+Every parameterized gate is built once as a batch of B matrices, and all the B states go through the circuit
+together, so a sweep is as many tensor operations as there are gates:
+
+    >>> import torch
+    >>> template = Circuit(2).add(RY(Parameter(0)), 0).add(CNOT, 0, 1).add(RX(Parameter(1)), 1).add(R(Parameter(0)), 1)
+    >>> angles = torch.rand(1000, 2) * 6
+    >>> states = sweep(template, angles)
+    >>> states.shape
+    torch.Size([1000, 4, 1])
+    >>> row = [float(angle) for angle in angles[7]]
+    >>> bound = Circuit(2).add(RY(row[0]), 0).add(CNOT, 0, 1).add(RX(row[1]), 1).add(R(row[0]), 1)
+    >>> equal(states[7], bound.run(), atol=1e-6)
+    True
+
+Landscapes come out of expectation over the batch, and autograd follows the angles through the sweep:
+
+    >>> landscape = expectation(sweep(template, angles), ['ZZ', 'XI'])
+    >>> landscape.shape
+    torch.Size([1000, 2])
+    >>> _ = angles.requires_grad_()
+    >>> expectation(sweep(template, angles), 'ZZ').sum().backward()
+    >>> angles.grad.shape
+    torch.Size([1000, 2])
+
+    """
+    positions = _occurrences(circuit)
+    columns = _columns(circuit, positions, angles)
+    return _bind(circuit, positions, angles[..., columns]).run(state)
+
+
+def parameter_shift(circuit: Circuit, angles: torch.Tensor, paulis, state: torch.Tensor = None) -> torch.Tensor:
+    """Gradients of Pauli expectation values by every parameter, at each row of the angles, in one batched run
+
+The gates exp(-i angle P / 2) and R satisfy dE / d angle = (E(angle + pi / 2) - E(angle - pi / 2)) / 2. Every
+gate using a parameter is shifted on its own and the shifts of the same parameter are summed, so the rule
+stays exact for shared parameters. All the 2 x gates x B shifted circuits run as one batch. The gradients
+have the shape (B, parameters) for one string and (B, strings, parameters) for a list of them:
+
+    >>> import torch
+    >>> template = Circuit(2).add(RY(Parameter(0)), 0).add(CNOT, 0, 1).add(RX(Parameter(1)), 1).add(R(Parameter(0)), 1)
+    >>> angles = torch.rand(50, 2, requires_grad=True)
+    >>> gradients = parameter_shift(template, angles, ['ZZ', 'YY'])
+    >>> gradients.shape
+    torch.Size([50, 2, 2])
+    >>> reference, = torch.autograd.grad(expectation(sweep(template, angles), 'YY').sum(), angles)
+    >>> torch.allclose(gradients[:, 1], reference, atol=1e-5)
+    True
+
+    """
+    positions = _occurrences(circuit)
+    columns = _columns(circuit, positions, angles)
+    angles = angles.detach()
+    expanded = angles[..., columns]
+    occurrences = len(positions)
+
+    # shifts[s, j, ..., j'] moves the occurrence j by the sign s times pi / 2
+    signs = torch.tensor([1.0, -1.0], dtype=angles.dtype, device=angles.device) * math.pi / 2
+    shifts = signs[:, None, None] * torch.eye(occurrences, dtype=angles.dtype, device=angles.device)
+    shifts = shifts.reshape(2, occurrences, *[1] * (angles.dim() - 1), occurrences)
+    shifted = expanded + shifts
+
+    values = expectation(_bind(circuit, positions, shifted).run(state), paulis)
+    single = values.dim() == shifted.dim() - 1
+    if single:
+        values = values[..., None]
+    # (2, occurrences, ..., strings) to (..., strings, occurrences)
+    derivatives = torch.movedim((values[0] - values[1]) / 2, 0, -1)
+    gradients = torch.zeros(*derivatives.shape[:-1], angles.shape[-1], dtype=derivatives.dtype,
+                            device=derivatives.device)
+    gradients.index_add_(-1, columns, derivatives)
+    if single:
+        return gradients[..., 0, :]
+    return gradients
@@ -0,0 +1,248 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Stabilizer tableau simulation of Clifford circuits from https://arxiv.org/abs/quant-ph/0406196
+"""
+
+import typing
+import numpy as np
+import torch
+from .gate import (H, PauliX, PauliY, PauliZ, Phase, CNOT, CPauliZ, SWAP)
+from .pauli_group import PauliString
+
+
+def _to_bits(value: int, n: int) -> np.ndarray:
+    """The n lowest bits of an integer as a bool array, bit q at index q"""
+    data = np.frombuffer(value.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(data, bitorder='little')[:n].astype(bool)
+
+
+def _from_bits(bits: np.ndarray) -> int:
+    """Inverse of _to_bits"""
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+def _solve(matrix: np.ndarray) -> np.ndarray:
+    """Find D with matrix @ D.T == I over GF(2) for a matrix of full row rank"""
+    rows, columns = matrix.shape
+    reduced = matrix.copy()
+    operations = np.eye(rows, dtype=bool)
+    pivots = []
+    for column in range(columns):
+        if len(pivots) == rows:
+            break
+        row = len(pivots)
+        candidates = np.nonzero(reduced[row:, column])[0]
+        if len(candidates) == 0:
+            continue
+        pivot = row + candidates[0]
+        reduced[[row, pivot]] = reduced[[pivot, row]]
+        operations[[row, pivot]] = operations[[pivot, row]]
+        others = reduced[:, column].copy()
+        others[row] = False
+        reduced[others] ^= reduced[row]
+        operations[others] ^= operations[row]
+        pivots.append(column)
+    if len(pivots) < rows:
+        raise ValueError('the generators are not independent')
+    # reduced == operations @ matrix has unit vectors in the pivot columns
+    solution = np.zeros((columns, rows), dtype=bool)
+    solution[pivots] = operations
+    return solution.T
+
+
+class Tableau:
+    """Tableau simulates Clifford circuits on stabilizer states with the Aaronson-Gottesman algorithm
+
+The tableau keeps n destabilizer and n stabilizer generators as bits, packed 64 rows to a machine word
+along each qubit column. A gate is a handful of word operations on the columns of its qubits and a measurement
+is O(n^2) bit operations, so thousands of qubits are fine. The register starts as |0...0>:
+
+    >>> Tableau(3)
+    Tableau(3)
+    >>> Tableau(3).stabilizers()
+    [+ZII, +IZI, +IIZ]
+
+The gates are the same objects as for the state vectors:
+
+    >>> bell = Tableau(2).apply(H, 0).apply(CNOT, 0, 1)
+    >>> bell.stabilizers()
+    [+XX, +ZZ]
+    >>> Tableau(2).apply(PauliX, 0).apply(H, 1).apply(Phase, 1).apply(CPauliZ, 0, 1).stabilizers()
+    [-ZI, +ZY]
+    >>> circuit = Circuit(3).add(H, 0).add(CNOT, 0, 1).add(Phase, 1).add(CPauliZ, 1, 2).add(H, 2).add(PauliY, 0)
+    >>> state = circuit.add(SWAP, 0, 2).run()
+    >>> all(equal(apply(state, stabilizer()), state, atol=1e-6) for stabilizer in Tableau(3).run(circuit).stabilizers())
+    True
+    >>> Tableau(2).apply(PauliX, 0).apply(SWAP, 0, 1).measure(1)
+    1
+
+Measurements collapse the state, so later measurements agree with earlier ones:
+
+    >>> import torch
+    >>> ghz = Tableau(500, generator=torch.Generator().manual_seed(3)).apply(H, 0)
+    >>> for qubit in range(499):
+    ...     _ = ghz.apply(CNOT, qubit, qubit + 1)
+    >>> first = ghz.measure(0)
+    >>> all(ghz.measure(qubit) == first for qubit in [1, 250, 499])
+    True
+
+Circuits of Clifford gates run directly:
+
+    >>> Tableau(3).run(Circuit(3).add(PauliX, 0).add(CNOT, 0, 2)).measure(2)
+    1
+
+A stabilizer group can be given as the initial state. Here the five qubit code with the logical zero,
+where the parity of all the qubits is even:
+
+    >>> code = Tableau.from_stabilizers(S_5_1_3.generators() + [S_5_1_3.logical_z()])
+    >>> code.stabilizers()
+    [+XZZXI, +IXZZX, +XIXZZ, +ZXIXZ, +ZZZZZ]
+    >>> sum(code.measure(qubit) for qubit in range(5)) % 2
+    0
+
+    """
+
+    def __init__(self, n: int, generator: torch.Generator = None):
+        self.n = n
+        self.generator = generator
+        # rows 0..n-1 are the destabilizers, n..2n-1 the stabilizers and 2n is scratch space
+        bits = np.zeros((n, 2 * n + 1), dtype=bool)
+        bits[np.arange(n), np.arange(n)] = True
+        self._x = self._pack(bits)
+        bits = np.zeros((n, 2 * n + 1), dtype=bool)
+        bits[np.arange(n), n + np.arange(n)] = True
+        self._z = self._pack(bits)
+        self._r = self._pack(np.zeros(2 * n + 1, dtype=bool))
+
+    def __repr__(self):
+        return 'Tableau(%d)' % self.n
+
+    @staticmethod
+    def from_stabilizers(stabilizers: typing.List[PauliString], generator: torch.Generator = None) -> 'Tableau':
+        """The stabilizer state of n independent commuting Hermitian Pauli strings on n qubits"""
+        n = len(stabilizers)
+        if any(stabilizer.n != n for stabilizer in stabilizers):
+            raise ValueError('%d stabilizers do not define a state of their qubits' % n)
+        sx = np.array([_to_bits(stabilizer.x, n) for stabilizer in stabilizers])
+        sz = np.array([_to_bits(stabilizer.z, n) for stabilizer in stabilizers])
+        if np.any((sx.astype(int) @ sz.T.astype(int) + sz.astype(int) @ sx.T.astype(int)) % 2):
+            raise ValueError('the stabilizers do not commute')
+        signs = [(stabilizer.phase - (stabilizer.x & stabilizer.z).bit_count()) % 4 for stabilizer in stabilizers]
+        if any(sign % 2 for sign in signs):
+            raise ValueError('the stabilizers are not Hermitian')
+
+        # destabilizers anticommute with their own stabilizer and commute with the rest
+        solution = _solve(np.hstack([sz, sx]))
+        dx, dz = solution[:, :n], solution[:, n:]
+        # adding stabilizers keeps that, and makes the destabilizers commute with each other
+        products = (dx.astype(int) @ dz.T.astype(int) + dz.astype(int) @ dx.T.astype(int)) % 2
+        upper = np.triu(products, 1)
+        dx = dx ^ ((upper @ sx.astype(int)) % 2).astype(bool)
+        dz = dz ^ ((upper @ sz.astype(int)) % 2).astype(bool)
+
+        tableau = Tableau(n, generator)
+        empty = np.zeros((n, 1), dtype=bool)
+        tableau._x = tableau._pack(np.hstack([dx.T, sx.T, empty]))
+        tableau._z = tableau._pack(np.hstack([dz.T, sz.T, empty]))
+        tableau._r = tableau._pack(np.array([False] * n + [sign == 2 for sign in signs] + [False]))
+        return tableau
+
+    @staticmethod
+    def _pack(bits: np.ndarray) -> np.ndarray:
+        """Pack the rows of the last axis 64 to a word"""
+        words = (bits.shape[-1] + 63) // 64
+        packed = np.packbits(bits, axis=-1, bitorder='little')
+        padding = [(0, 0)] * (bits.ndim - 1) + [(0, 8 * words - packed.shape[-1])]
+        return np.ascontiguousarray(np.pad(packed, padding)).view(np.uint64)
+
+    def _unpack(self, words: np.ndarray) -> np.ndarray:
+        return np.unpackbits(words.view(np.uint8), axis=-1, bitorder='little')[..., :2 * self.n + 1].astype(bool)
+
+    def stabilizers(self) -> typing.List[PauliString]:
+        """The stabilizer generators as Pauli strings"""
+        x, z, r = self._unpack(self._x), self._unpack(self._z), self._unpack(self._r)
+        strings = []
+        for row in range(self.n, 2 * self.n):
+            string_x, string_z = _from_bits(x[:, row]), _from_bits(z[:, row])
+            # (-1)**r times the Y form, where every Y is i * X * Z
+            phase = 2 * int(r[row]) + (string_x & string_z).bit_count()
+            strings.append(PauliString(self.n, string_x, string_z, phase))
+        return strings
+
+    def apply(self, gate, *targets: int) -> 'Tableau':
+        """Apply a Clifford gate on the targets, returns the tableau for chaining"""
+        x, z = self._x, self._z
+        if gate is H:
+            a, = targets
+            self._r ^= x[a] & z[a]
+            x[a], z[a] = z[a].copy(), x[a].copy()
+        elif gate is Phase:
+            a, = targets
+            self._r ^= x[a] & z[a]
+            z[a] ^= x[a]
+        elif gate is PauliX:
+            a, = targets
+            self._r ^= z[a]
+        elif gate is PauliY:
+            a, = targets
+            self._r ^= x[a] ^ z[a]
+        elif gate is PauliZ:
+            a, = targets
+            self._r ^= x[a]
+        elif gate is CNOT:
+            a, b = targets
+            self._r ^= x[a] & z[b] & ~(x[b] ^ z[a])
+            x[b] ^= x[a]
+            z[a] ^= z[b]
+        elif gate is CPauliZ:
+            a, b = targets
+            self.apply(H, b).apply(CNOT, a, b).apply(H, b)
+        elif gate is SWAP:
+            a, b = targets
+            x[[a, b]] = x[[b, a]]
+            z[[a, b]] = z[[b, a]]
+        else:
+            raise ValueError('%s is not a supported Clifford gate' % gate)
+        return self
+
+    def run(self, circuit) -> 'Tableau':
+        """Apply the gates of a circuit in order"""
+        for gate, targets in circuit:
+            self.apply(gate, *targets)
+        return self
+
+    def measure(self, target: int) -> int:
+        """Measure the target qubit in the computational basis and collapse the state"""
+        n = self.n
+        x, z, r = self._unpack(self._x), self._unpack(self._z), self._unpack(self._r)
+        # the Y form (-1)**r * sigma(x, z) is i**phase * X**x * Z**z in the form of the Pauli strings
+        phases = 2 * r.astype(int) + (x & z).sum(axis=0)
+
+        anticommuting = np.nonzero(x[target, n:2 * n])[0]
+        if len(anticommuting) == 0:
+            # the outcome is determined, it is the sign of the product of the stabilizers which gives Z
+            rows = n + np.nonzero(x[target, :n])[0]
+            rows_x, rows_z = x[:, rows], z[:, rows]
+            before = np.bitwise_xor.accumulate(rows_z, axis=1) ^ rows_z
+            phase = phases[rows].sum() + 2 * (before & rows_x).sum()
+            product_x = np.bitwise_xor.reduce(rows_x, axis=1)
+            product_z = np.bitwise_xor.reduce(rows_z, axis=1)
+            return int((phase - (product_x & product_z).sum()) % 4 // 2)
+
+        p = n + anticommuting[0]
+        rows = np.nonzero(x[target, :2 * n])[0]
+        rows = rows[rows != p]
+        # every other row anticommuting with Z gets multiplied by row p
+        new_x, new_z = x[:, rows] ^ x[:, [p]], z[:, rows] ^ z[:, [p]]
+        phase = phases[rows] + phases[p] + 2 * (z[:, rows] & x[:, [p]]).sum(axis=0)
+        r[rows] = (phase - (new_x & new_z).sum(axis=0)) % 4 // 2
+        x[:, rows], z[:, rows] = new_x, new_z
+
+        outcome = int(torch.randint(2, (1,), generator=self.generator).item())
+        x[:, p - n], z[:, p - n], r[p - n] = x[:, p], z[:, p], r[p]
+        x[:, p], z[:, p], r[p] = False, False, bool(outcome)
+        z[target, p] = True
+        self._x, self._z, self._r = self._pack(x), self._pack(z), self._pack(r)
+        return outcome
@@ -0,0 +1,172 @@
+#    @copyright: 2020 by Pauli Rikula
+#    @license: MIT <http://www.opensource.org/licenses/mit-license.php>
+
+"""
+Opt-in tracing of the gate applications and the tensor constructions
+"""
+
+import os
+import json
+import time
+import typing
+import functools
+import threading
+from contextlib import contextmanager
+import torch
+
+
+def _label(value) -> str:
+    """The repr of a gate object, or the shape of a tensor instead of its values"""
+    if isinstance(value, torch.Tensor):
+        return 'tensor%s' % list(value.shape)
+    return repr(value)
+
+
+class Trace:
+    """Trace is the log of the operations recorded by Tracer.record, one dict per operation"""
+
+    def __init__(self):
+        self.events = []
+        self._origin = time.perf_counter_ns()
+
+    def __repr__(self):
+        return 'Trace(%d events)' % len(self.events)
+
+    def chrome(self, path: str = None) -> dict:
+        """The events in the Chrome trace format, written to path if given, for chrome://tracing or Perfetto"""
+        events = [{'name': '%s %s' % (event['name'], event['gate']) if event['gate'] else event['name'],
+                   'cat': event['name'], 'ph': 'X', 'ts': event['start'], 'dur': event['duration'],
+                   'pid': os.getpid(), 'tid': event['thread'],
+                   'args': {key: event[key] for key in ['shapes', 'flops', 'bytes', 'hits', 'misses']}}
+                  for event in self.events]
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with open(path, 'wt') as output:
+                json.dump(trace, output)
+        return trace
+
+    def rows(self) -> typing.List[dict]:
+        """The events aggregated by the operation and the gate, the most time consuming first"""
+        rows = {}
+        for event in self.events:
+            row = rows.setdefault((event['name'], event['gate']), {
+                'name': event['name'], 'gate': event['gate'], 'calls': 0, 'duration': 0.0, 'flops': 0,
+                'bytes': 0, 'hits': 0, 'misses': 0})
+            row['calls'] += 1
+            for key in ['duration', 'flops', 'bytes', 'hits', 'misses']:
+                row[key] += event[key]
+        return sorted(rows.values(), key=lambda row: -row['duration'])
+
+    def summary(self) -> str:
+        """The aggregated events as a table, the nested operations are included in the times of their callers"""
+        lines = ['%-12s %-24s %7s %12s %12s %10s %12s %6s %6s' % (
+            'operation', 'gate', 'calls', 'total ms', 'mean us', 'GFLOP/s', 'MB', 'hits', 'misses')]
+        for row in self.rows():
+            lines.append('%-12s %-24s %7d %12.3f %12.1f %10.2f %12.3f %6d %6d' % (
+                row['name'], row['gate'][:24], row['calls'], row['duration'] / 1e3, row['duration'] / row['calls'],
+                row['flops'] / max(row['duration'], 1e-3) / 1e3, row['bytes'] / 2**20, row['hits'], row['misses']))
+        return '\n'.join(lines)
+
+
+class _Tracer:
+    """Tracer records every apply, apply_on, Combine and constant tensor construction while it is on
+
+    >>> with Tracer.record() as trace:
+    ...     state = Circuit(3).add(H, 0).add(CNOT, 0, 2).add(R(0.125), 1).add(PauliX, 2).run()
+    >>> applied = [event for event in trace.events if event['name'] == 'apply_on']
+    >>> [(event['gate'], event['shapes']) for event in applied]
+    [('H', [(8, 1)]), ('CX', [(8, 1)]), ('R(0.125)', [(8, 1)]), ('X', [(8, 1)])]
+
+Each event has its time in microseconds, an estimate of its floating point operations, the bytes of its result
+and the hits and misses of the constant caches during it. The matrix of the new angle was built when the gate
+was added to the circuit:
+
+    >>> sorted(applied[2])
+    ['bytes', 'depth', 'duration', 'flops', 'gate', 'hits', 'misses', 'name', 'shapes', 'start', 'thread']
+    >>> applied[2]['flops'], applied[2]['bytes']
+    (48, 64)
+    >>> [(event['name'], event['depth']) for event in trace.events if event['gate'] == '0.125']
+    [('construct', 0)]
+
+The constructions inside an operation are nested events, and they count as its cache misses:
+
+    >>> with Tracer.record() as built:
+    ...     _ = apply_on(Combine(*[Zero()] * 7), MCX(6), range(7))
+    >>> [(event['name'], event['gate'], event['depth'], event['misses']) for event in built.events]
+    [('Combine', '', 0, 0), ('construct', 'CCCCCCX', 1, 0), ('apply_on', 'CCCCCCX', 0, 1)]
+    >>> len(built.events[0]['shapes']), built.events[0]['flops'], built.events[0]['bytes']
+    (7, 1512, 1024)
+
+The log exports to the Chrome trace format and to a summary table:
+
+    >>> trace.chrome()['traceEvents'][-1]['name']
+    'apply_on X'
+    >>> print(trace.summary().splitlines()[0])
+    operation    gate                       calls     total ms      mean us    GFLOP/s           MB   hits misses
+
+When the tracer is off the wrapped functions only check a flag, and nothing is recorded:
+
+    >>> Tracer.active
+    False
+
+    """
+
+    def __init__(self):
+        self.active = False
+        self._trace = None
+        self._stack = []
+
+    def __repr__(self):
+        return 'Tracer'
+
+    @contextmanager
+    def record(self):
+        """Trace the operations in a with block, yields the Trace"""
+        trace = Trace()
+        previous = self.active, self._trace
+        self.active, self._trace = True, trace
+        try:
+            yield trace
+        finally:
+            self.active, self._trace = previous
+
+    def traced(self, name: str, flops: typing.Callable = None):
+        """Decorate a function to be recorded under name, flops estimates the operations from its arguments"""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.active:
+                    return function(*args, **kwargs)
+                label = _label(args[1]) if len(args) > 1 and name.startswith('apply') else ''
+                return self.call(name, label, function, args, kwargs, flops)
+            return wrapper
+        return decorate
+
+    def call(self, name: str, label: str, function: typing.Callable, args: tuple = (), kwargs: dict = None,
+             flops: typing.Callable = None):
+        """Run function(*args, **kwargs) and record it"""
+        kwargs = kwargs or {}
+        trace = self._trace
+        event = {'name': name, 'gate': label, 'depth': len(self._stack), 'thread': threading.get_ident(),
+                 'shapes': [tuple(arg.shape) for arg in args if isinstance(arg, torch.Tensor)],
+                 'hits': 0, 'misses': 0}
+        self._stack.append(event)
+        start = time.perf_counter_ns()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            end = time.perf_counter_ns()
+            self._stack.pop()
+        event['start'] = (start - trace._origin) / 1e3
+        event['duration'] = (end - start) / 1e3
+        event['flops'] = flops(*args, **kwargs) if flops is not None else 0
+        event['bytes'] = result.nbytes if isinstance(result, torch.Tensor) else 0
+        trace.events.append(event)
+        return result
+
+    def cache(self, hit: bool):
+        """Count a hit or a miss of a constant cache for the innermost recorded operation"""
+        if self._stack:
+            self._stack[-1]['hits' if hit else 'misses'] += 1
+
+Tracer = _Tracer()
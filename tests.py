@@ -10,12 +10,16 @@ if __name__ == '__main__':
     # by importing these here, there might be some import errors left..
     globs = {
         'convert_to_complex': pytorchqbit.convert_to_complex,
+        'Precision': pytorchqbit.Precision,
+        'compress': pytorchqbit.compress,
+        'decompress': pytorchqbit.decompress,
         'Zero': pytorchqbit.Zero,
         'One': pytorchqbit.One,
         'Plus': pytorchqbit.Plus,
         'Minus': pytorchqbit.Minus,
         'Measure': pytorchqbit.Measure,
         'Combine': pytorchqbit.Combine,
+        'Batch': pytorchqbit.Batch,
         'Identity': pytorchqbit.Identity,
         'H': pytorchqbit.H,
         'PauliX': pytorchqbit.PauliX,
@@ -26,14 +30,58 @@ if __name__ == '__main__':
         'CNOT': pytorchqbit.CNOT,
         'CPauliZ': pytorchqbit.CPauliZ,
         'SWAP': pytorchqbit.SWAP,
+        'MCX': pytorchqbit.MCX,
+        'Toffoli': pytorchqbit.Toffoli,
+        'Diagonal': pytorchqbit.Diagonal,
+        'Unitary': pytorchqbit.Unitary,
         'apply': pytorchqbit.apply,
+        'apply_on': pytorchqbit.apply_on,
         'equal': pytorchqbit.equal,
+        'Circuit': pytorchqbit.Circuit,
         'P1': pytorchqbit.P1,
         'Pn': pytorchqbit.Pn,
-        'S_5_1_3': pytorchqbit.S_5_1_3
+        'PauliString': pytorchqbit.PauliString,
+        'expectation': pytorchqbit.expectation,
+        'S_5_1_3': pytorchqbit.S_5_1_3,
+        'Tableau': pytorchqbit.Tableau,
+        'density_matrix': pytorchqbit.density_matrix,
+        'evolve': pytorchqbit.evolve,
+        'Kraus': pytorchqbit.Kraus,
+        'Depolarizing': pytorchqbit.Depolarizing,
+        'AmplitudeDamping': pytorchqbit.AmplitudeDamping,
+        'PhaseDamping': pytorchqbit.PhaseDamping,
+        'MappedState': pytorchqbit.MappedState,
+        'ShardedState': pytorchqbit.ShardedState,
+        'launch': pytorchqbit.launch,
+        'Tracer': pytorchqbit.Tracer,
+        'RX': pytorchqbit.RX,
+        'RY': pytorchqbit.RY,
+        'RZ': pytorchqbit.RZ,
+        'adjoint_expectation': pytorchqbit.adjoint_expectation,
+        'Parameter': pytorchqbit.Parameter,
+        'sweep': pytorchqbit.sweep,
+        'parameter_shift': pytorchqbit.parameter_shift,
+        'MPSState': pytorchqbit.MPSState,
+        'Register': pytorchqbit.Register,
+        'circuits_equivalent': pytorchqbit.circuits_equivalent,
+        'FrameSampler': pytorchqbit.FrameSampler,
+        'unpack': pytorchqbit.unpack
         }
     doctest.testfile(filename="stabilizer.py", module_relative=True, package=pytorchqbit, globs=globs)
     doctest.testfile(filename="pauli_group.py", module_relative=True, package=pytorchqbit, globs=globs)
     doctest.testfile(filename="qbit.py", module_relative=True, package=pytorchqbit, globs=globs)
     doctest.testfile(filename="gate.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="expectation.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="frame.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="tableau.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="density.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="mapped.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="register.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="mps.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="sharded.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="tracer.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="adjoint.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="sweep.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="circuit.py", module_relative=True, package=pytorchqbit, globs=globs)
+    doctest.testfile(filename="convert.py", module_relative=True, package=pytorchqbit, globs=globs)
     doctest.testfile(filename="__init__.py", module_relative=True, package=pytorchqbit, globs=globs)